@@ -0,0 +1,137 @@
+"""End-to-end benchmark of the vimpck commands
+
+Run from the root of the repository, no network access is needed:
+
+    python -m tests.benchmark.bench_command [-n 10 100 1000] [-j 8]
+
+For each number of plugins N, N local bare repositories (with and without
+.gitmodules, with different history depths) and the matching VIMPCKRC are
+generated, then each step is run in a fresh python process:
+
+    - install: clone every plugin
+    - ls: list the plugins
+    - upgrade: nothing to pull
+    - upgrade-10%: 10% of the remotes have a new commit
+    - rm-10%: remove 10% of the plugins
+    - clean-10%: remove 10% of the entries of the configuration file, then
+      clean
+
+For each step, the wall time of the command, the number of subprocesses it
+spawned and the peak RSS of the vimpck process are reported.
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from tests.benchmark import fixtures
+
+
+def run_step(step, kwargs, result_path):
+    """Run one command in the current process and write its measures
+
+    Executed in a fresh python process by measure_step
+    """
+    from vim_pck import command
+
+    nb_subprocess = [0]
+    popen_init = subprocess.Popen.__init__
+
+    def counting_init(self, *args, **kw):
+        nb_subprocess[0] += 1
+        popen_init(self, *args, **kw)
+
+    # asyncio subprocesses are also created through subprocess.Popen
+    subprocess.Popen.__init__ = counting_init
+    commands = {'install': command.install_cmd,
+                'ls': command.ls_cmd,
+                'upgrade': command.upgrade_cmd,
+                'rm': command.remove_cmd,
+                'clean': command.clean_cmd}
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        start = time.perf_counter()
+        commands[step](**kwargs)
+        wall = time.perf_counter() - start
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+    with open(result_path, 'w') as f:
+        json.dump({'wall': wall,
+                   'subprocess': nb_subprocess[0],
+                   'rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss},
+                  f)
+
+
+def measure_step(step, kwargs, env):
+    """Run a step in a fresh python process and return its measures"""
+    with tempfile.NamedTemporaryFile(suffix='.json') as result:
+        subprocess.run([sys.executable, '-m', 'tests.benchmark.bench_command',
+                        '--run', step, json.dumps(kwargs), result.name],
+                       env=env, check=True)
+        with open(result.name) as f:
+            return json.load(f)
+
+
+def bench(nb_plugins, jobs, basepath):
+    """Benchmark every step on a fixture of nb_plugins plugins
+
+    return:
+        measures (list((str, dict)))
+    """
+    conf_path, pack_path, remote_urls = fixtures.make_fixture(basepath, nb_plugins)
+    env = dict(os.environ, VIMPCKRC=conf_path,
+               XDG_CACHE_HOME=os.path.join(basepath, 'cache'),
+               PYTHONPATH=os.pathsep.join(sys.path), **fixtures.BENCH_ENV)
+    tenth = max(1, nb_plugins // 10)
+    measures = []
+
+    measures.append(('install', measure_step('install', {'jobs': jobs}, env)))
+    measures.append(('ls', measure_step('ls', {'start': False, 'opt': False}, env)))
+    measures.append(('upgrade', measure_step('upgrade', {'plug': [], 'jobs': jobs}, env)))
+
+    for remote_url in remote_urls[:tenth]:
+        fixtures.push_commit(remote_url, 'NEWS')
+    measures.append(('upgrade-10%', measure_step('upgrade', {'plug': [], 'jobs': jobs}, env)))
+
+    removed = ['package{}/{}/vim-plugin{:05d}'.format(i % 10, 'opt' if i % 4 == 3 else 'start', i)
+               for i in range(tenth)]
+    measures.append(('rm-10%', measure_step('rm', {'plug': removed, 'r': True}, env)))
+
+    fixtures.write_config(conf_path, pack_path, remote_urls[tenth:-tenth])
+    measures.append(('clean-10%', measure_step('clean', {}, env)))
+    return measures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-n', type=int, nargs='+', default=[10, 100, 1000],
+                        help='number of plugins')
+    parser.add_argument('-j', '--jobs', type=int, default=8,
+                        help='number of concurrent git processes')
+    parser.add_argument('--run', nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        step, kwargs, result_path = args.run
+        run_step(step, json.loads(kwargs), result_path)
+        return
+
+    print("{:>6} {:<12} {:>9} {:>6} {:>9}".format(
+        'N', 'step', 'wall (s)', 'procs', 'RSS (MB)'))
+    for nb_plugins in args.n:
+        with tempfile.TemporaryDirectory(prefix='vimpck-bench-') as basepath:
+            for step, measure in bench(nb_plugins, args.jobs, basepath):
+                print("{:>6} {:<12} {:>9.3f} {:>6} {:>9.1f}".format(
+                    nb_plugins, step, measure['wall'], measure['subprocess'],
+                    measure['rss'] / 1024))
+
+
+if __name__ == '__main__':
+    main()
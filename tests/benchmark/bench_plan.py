@@ -0,0 +1,99 @@
+"""Benchmark of the reconciliation planner
+
+Run from the root of the repository, no git repository is needed:
+
+    python -m tests.benchmark.bench_plan [-n 1000 5000] [-r 3]
+
+For each number of entries N, a configuration of N remote urls and a pack
+path are simulated: 10% of the entries are not installed, 10% of the
+installed plugins are not configured anymore, 5% changed of type and 10%
+are frozen. The time taken to compute what install, upgrade and clean have
+to do is reported for:
+
+    - legacy: the set differences and list scans used before vim_pck.plan
+    - plan: vim_pck.plan.Plan
+"""
+
+import argparse
+import time
+from types import SimpleNamespace
+
+from vim_pck import plan
+from vim_pck import utils
+
+
+def make_state(nb_entries):
+    """Simulate a configuration file and a pack path
+
+    return:
+        (repos, all_plug) (2-uple): see ConfigFile.repos and DiskPlugin.all_plug
+    """
+    repos = {}
+    all_plug = {}
+    for i in range(nb_entries):
+        url = 'https://github.com/user{}/vim-plugin{:05d}'.format(i % 97, i)
+        plug_type = 'opt' if i % 4 == 3 else 'start'
+        spec = {'package': 'package{}'.format(i % 10), 'type': plug_type,
+                'freeze': i % 10 == 5, 'depth': None, 'filter': None}
+        if i % 10 != 1:
+            # installed, 5% in the directory of the other type
+            disk_type = plug_type
+            if i % 20 == 2:
+                disk_type = 'start' if plug_type == 'opt' else 'opt'
+            all_plug['{}/{}/vim-plugin{:05d}'.format(spec['package'], disk_type, i)] = url
+        if i % 10 != 3:
+            repos[url] = spec
+    return repos, all_plug
+
+
+def legacy(repos, all_plug):
+    """The diff logic of install_cmd, upgrade_cmd and clean_cmd before the
+    planner
+    """
+    vimpckrc = SimpleNamespace(repos=repos, rem_urls=list(repos))
+    freeze_false = utils.ConfigFile.freeze_false
+    install = set(freeze_false(vimpckrc)).symmetric_difference(set(all_plug.values()))
+    upgrade = {k: v for k, v in all_plug.items() if v in freeze_false(vimpckrc)}
+    clean = []
+    for rem_url in set(vimpckrc.rem_urls).symmetric_difference(set(all_plug.values())):
+        # the configured plugins that are not installed made clean crash
+        clean += [k for k, v in all_plug.items() if v == rem_url][:1]
+    return install, upgrade, clean
+
+
+def planner(repos, all_plug):
+    todo = plan.Plan(repos, all_plug)
+    return todo.installs, todo.upgrades, todo.removes
+
+
+def measure(func, repeat, *args):
+    """Best wall time of repeat calls, in seconds"""
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        wall = time.perf_counter() - start
+        best = wall if best is None else min(best, wall)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-n', type=int, nargs='+', default=[1000, 5000],
+                        help='number of entries')
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help='number of runs, the best one is reported')
+    args = parser.parse_args()
+
+    print("{:>6} {:<8} {:>10} {:>8} {:>8} {:>8}".format(
+        'N', 'planner', 'wall (ms)', 'install', 'upgrade', 'remove'))
+    for nb_entries in args.n:
+        repos, all_plug = make_state(nb_entries)
+        for name, func in [('legacy', legacy), ('plan', planner)]:
+            wall, (install, upgrade, remove) = measure(func, args.repeat, repos, all_plug)
+            print("{:>6} {:<8} {:>10.1f} {:>8} {:>8} {:>8}".format(
+                nb_entries, name, wall * 1e3, len(install), len(upgrade), len(remove)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+"""Benchmark of the pack path scan of DiskPlugin
+
+Run from the root of the repository, no git repository is needed:
+
+    python -m tests.benchmark.bench_scan [-n 10000] [-r 3] [--latency 0.5]
+
+A synthetic pack path of about N directories is generated: plugins made of
+a .git directory, a few runtime directories and files, spread over 20
+packages and the start and opt types. The plugin directories found by the
+following walkers are compared:
+
+    - legacy: the os.walk based walker used before the scandir one
+    - scandir: DiskPlugin._list_plug_dir
+
+For each walker, the wall time, the number of directories listed and the
+number of entries read are reported. On a network home directory (NFS,
+SSHFS) each listing is at least one round trip: --latency adds a delay in
+milliseconds to each listing to simulate one.
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+from vim_pck import utils
+
+# directories and files of a synthetic plugin, 5 directories per plugin
+PLUGIN_DIRS = ['.git', 'plugin', 'autoload', 'doc']
+PLUGIN_FILES = ['README.md', 'LICENSE', 'plugin/main.vim', 'doc/main.txt']
+
+
+def make_pack(basepath, nb_dirs):
+    """Create a pack path of about nb_dirs directories
+
+    return:
+        (pack_path, nb_plugins) (2-uple)
+    """
+    pack_path = os.path.join(basepath, 'pack')
+    nb_plugins = max(1, nb_dirs // (len(PLUGIN_DIRS) + 1))
+    for i in range(nb_plugins):
+        plugin = os.path.join(pack_path, 'package{:02d}'.format(i % 20),
+                              'opt' if i % 4 == 3 else 'start',
+                              'vim-plugin{:05d}'.format(i))
+        for name in PLUGIN_DIRS:
+            os.makedirs(os.path.join(plugin, name))
+        for name in PLUGIN_FILES:
+            open(os.path.join(plugin, name), 'w').close()
+    return pack_path, nb_plugins
+
+
+def legacy(pack_path, level=3):
+    """The os.walk based walker of DiskPlugin before the scandir one"""
+    some_dir = pack_path.rstrip(os.path.sep)
+    num_sep = some_dir.count(os.path.sep)
+    dir_list = {}
+    for root, dirs, files in os.walk(some_dir):
+        dir_list[root] = 0
+        if num_sep + level <= root.count(os.path.sep):
+            del dirs[:]
+    for elem in dir_list.keys():
+        dir_list[elem] = len(os.path.normpath(elem).split(os.sep))
+    max_depth = max(dir_list.values())
+    return [k for k, v in dir_list.items() if v == max_depth]
+
+
+def scandir(pack_path):
+    walker = utils.DiskPlugin.__new__(utils.DiskPlugin)
+    walker.pack_path = pack_path
+    return walker._list_plug_dir()
+
+
+class CountingScandir:
+    """Replacement of os.scandir that counts the listings and the entries
+    read, and waits latency seconds per listing
+    """
+
+    def __init__(self, latency):
+        self.scandir = os.scandir
+        self.latency = latency
+        self.listings = 0
+        self.entries = 0
+
+    def __call__(self, path='.'):
+        self.listings += 1
+        if self.latency:
+            time.sleep(self.latency)
+        entries = list(self.scandir(path))
+        self.entries += len(entries)
+        return _Listing(entries)
+
+
+class _Listing:
+    """An iterator over read entries usable as the object returned by
+    os.scandir
+    """
+
+    def __init__(self, entries):
+        self._it = iter(entries)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._it)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def close(self):
+        pass
+
+
+def measure(func, pack_path, repeat, latency):
+    """Best wall time of repeat calls, in seconds, with the number of
+    listings and of entries of the last call
+    """
+    best = None
+    for i in range(repeat):
+        counter = CountingScandir(latency)
+        os.scandir = counter
+        try:
+            start = time.perf_counter()
+            result = func(pack_path)
+            wall = time.perf_counter() - start
+        finally:
+            os.scandir = counter.scandir
+        best = wall if best is None else min(best, wall)
+    return best, counter, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-n', type=int, default=10000,
+                        help='number of directories of the pack path')
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help='number of runs, the best one is reported')
+    parser.add_argument('--latency', type=float, default=0,
+                        help='simulated delay of a directory listing in ms')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='vimpck-bench-') as basepath:
+        pack_path, nb_plugins = make_pack(basepath, args.n)
+        print("{} plugins, latency {} ms".format(nb_plugins, args.latency))
+        print("{:<8} {:>10} {:>9} {:>9} {:>8}".format(
+            'walker', 'wall (ms)', 'listings', 'entries', 'plugins'))
+        for name, func in [('legacy', legacy), ('scandir', scandir)]:
+            wall, counter, plugins = measure(func, pack_path, args.repeat,
+                                             args.latency / 1e3)
+            print("{:<8} {:>10.1f} {:>9} {:>9} {:>8}".format(
+                name, wall * 1e3, counter.listings, counter.entries, len(plugins)))
+
+
+if __name__ == '__main__':
+    main()
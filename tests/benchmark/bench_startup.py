@@ -0,0 +1,127 @@
+"""Startup benchmark of the vimpck subcommands
+
+Run from the root of the repository, no network access is needed:
+
+    python -m tests.benchmark.bench_startup [-n 100] [-r 10]
+
+A fixture of N installed plugins is generated, then each subcommand is run
+through ``python -m vim_pck.cli`` in a fresh process:
+
+    - cold: the vimpck cache (configuration cache and plugin index) is empty
+    - warm: median of the next runs, the cache is filled
+    - import: total time spent importing modules, as reported by
+      ``python -X importtime``, with the slowest top level imports
+
+Byte code is written under a temporary PYTHONPYCACHEPREFIX and compiled
+before measuring, so that the repository is left untouched.
+"""
+
+import argparse
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from tests.benchmark import fixtures
+
+# subcommands that should not do more work than reading the cache
+COMMANDS = [['help'],
+            ['--help'],
+            ['ls'],
+            ['ls', '--start'],
+            ['ls', '--hash'],
+            ['stats'],
+            ['install'],
+            ['upgrade', '--help'],
+            ['rm', '--help'],
+            ['clean']]
+
+
+def run_cli(args, env, importtime=False):
+    """Run vimpck in a fresh python process
+
+    return:
+        (wall, stderr) (2-uple): wall time in seconds and stderr of the process
+    """
+    cmd = [sys.executable]
+    if importtime:
+        cmd += ['-X', 'importtime']
+    cmd += ['-m', 'vim_pck.cli'] + args
+    start = time.perf_counter()
+    # vimpck exits with a message and a non zero status when there is
+    # nothing to do, it is still a valid measure
+    proc = subprocess.run(cmd, env=env, stdout=subprocess.DEVNULL,
+                          stderr=subprocess.PIPE)
+    return time.perf_counter() - start, proc.stderr.decode('UTF-8')
+
+
+def parse_importtime(stderr):
+    """Parse the output of python -X importtime
+
+    return:
+        (total, top) (2-uple): total import time in seconds and a list of
+        (module, cumulative time in seconds) of the top level imports
+    """
+    top = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        fields = line[len('import time:'):].split('|')
+        cumulative_us, name = int(fields[1]), fields[2]
+        # nested imports are indented by two spaces per level
+        if not name[1:].startswith(' '):
+            top.append((name.strip(), cumulative_us / 1e6))
+    return sum(elem[1] for elem in top), top
+
+
+def bench(nb_plugins, repeat, basepath):
+    """Benchmark every subcommand on a fixture of nb_plugins installed plugins
+
+    return:
+        measures (list((list(str), dict)))
+    """
+    conf_path, pack_path, remote_urls = fixtures.make_fixture(basepath, nb_plugins)
+    cache_home = os.path.join(basepath, 'cache')
+    env = dict(os.environ, VIMPCKRC=conf_path, XDG_CACHE_HOME=cache_home,
+               PYTHONPATH=os.pathsep.join(sys.path),
+               PYTHONPYCACHEPREFIX=os.path.join(basepath, 'pycache'),
+               **fixtures.BENCH_ENV)
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    run_cli(['install', '--jobs', '8'], env)
+
+    measures = []
+    for args in COMMANDS:
+        shutil.rmtree(cache_home, ignore_errors=True)
+        cold, _ = run_cli(args, env)
+        warm = statistics.median(run_cli(args, env)[0] for i in range(repeat))
+        total, top = parse_importtime(run_cli(args, env, importtime=True)[1])
+        top.sort(key=lambda elem: elem[1], reverse=True)
+        measures.append((args, {'cold': cold, 'warm': warm, 'import': total,
+                                'top': top[:4]}))
+    return measures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-n', type=int, default=100,
+                        help='number of installed plugins')
+    parser.add_argument('-r', '--repeat', type=int, default=10,
+                        help='number of warm runs')
+    args = parser.parse_args()
+
+    print("{:<14} {:>9} {:>9} {:>11}  {}".format(
+        'command', 'cold (ms)', 'warm (ms)', 'import (ms)', 'slowest imports (ms)'))
+    with tempfile.TemporaryDirectory(prefix='vimpck-bench-') as basepath:
+        for cmd, measure in bench(args.n, args.repeat, basepath):
+            top = ', '.join('{} {:.1f}'.format(name, cumulative * 1e3)
+                            for name, cumulative in measure['top'])
+            print("{:<14} {:>9.1f} {:>9.1f} {:>11.1f}  {}".format(
+                ' '.join(cmd), measure['cold'] * 1e3, measure['warm'] * 1e3,
+                measure['import'] * 1e3, top))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""Offline fixtures of the benchmark suite
+
+Generate N local bare repositories and the matching vimpck configuration
+file. A few template repositories are created with git, with and without
+.gitmodules and with different history depths, then copied to create the N
+remotes so that generating 1000 remotes only takes a few seconds.
+"""
+
+import os
+import shutil
+import subprocess
+
+from tests.conftest import GIT_ENV, make_remote
+
+# (number of commits, with a submodule)
+TEMPLATES = [(2, False), (10, False), (50, False), (10, True)]
+
+# environment allowing the file:// submodules of the templates to be cloned
+BENCH_ENV = dict(GIT_CONFIG_COUNT='1', GIT_CONFIG_KEY_0='protocol.file.allow',
+                 GIT_CONFIG_VALUE_0='always')
+
+
+def make_templates(basepath):
+    """Create the template bare repositories
+
+    return:
+        templates (list(str)): path of the bare repositories
+    """
+    templates = []
+    sub_url = make_remote(os.path.join(basepath, 'templates'), 'submodule',
+                          {'plugin/sub.vim': '" submodule'})
+    for depth, with_submodule in TEMPLATES:
+        name = 'depth{}{}'.format(depth, '-sub' if with_submodule else '')
+        files = {'plugin/{}.vim'.format(name): '" {}'.format(name),
+                 'doc/{}.txt'.format(name): '*{}.txt*'.format(name)}
+        files.update({'autoload/file{}.vim'.format(i): '" {}'.format(i)
+                      for i in range(depth - len(files))})
+        submodules = {'sub': 'file://' + sub_url} if with_submodule else None
+        templates.append(make_remote(os.path.join(basepath, 'templates'), name,
+                                     files, submodules))
+    return templates
+
+
+def make_fixture(basepath, nb_plugins):
+    """Create nb_plugins remotes and a vimpck configuration file
+
+    Arguments:
+            - basepath (str): directory of the fixture
+            - nb_plugins (int): number of plugins
+
+    return:
+        (conf_path, pack_path, remote_urls) (3-uple)
+    """
+    templates = make_templates(basepath)
+    remote_dir = os.path.join(basepath, 'remotes')
+    pack_path = os.path.join(basepath, 'pack')
+    conf_path = os.path.join(basepath, 'vimpckrc')
+    remote_urls = []
+    for i in range(nb_plugins):
+        remote_url = os.path.join(remote_dir, 'vim-plugin{:05d}.git'.format(i))
+        shutil.copytree(templates[i % len(templates)], remote_url)
+        remote_urls.append(remote_url)
+    write_config(conf_path, pack_path, remote_urls)
+    return conf_path, pack_path, remote_urls
+
+
+def write_config(conf_path, pack_path, remote_urls):
+    """Write a vimpck configuration file, plugins are spread over 10
+    packages, one out of 4 is optional"""
+    with open(conf_path, 'w') as f:
+        f.write('[SETTING]\n    pack_path = {}\n[REPOSITORY]\n'.format(pack_path))
+        for i, remote_url in enumerate(remote_urls):
+            f.write('    [[{}]]\n'.format(remote_url))
+            f.write('        package = package{}\n'.format(i % 10))
+            f.write('        type = {}\n'.format('opt' if i % 4 == 3 else 'start'))
+
+
+def push_commit(remote_url, name):
+    """Add a file in a new commit on the master branch of a bare remote"""
+    env = dict(os.environ, GIT_INDEX_FILE=os.path.join(remote_url, 'bench-index'),
+               **GIT_ENV)
+
+    def git(*args, stdin=None):
+        compl_proc = subprocess.run(["git", "-C", remote_url] + list(args),
+                                    input=stdin, stdout=subprocess.PIPE,
+                                    env=env, check=True)
+        return compl_proc.stdout.decode('UTF-8').strip()
+
+    blob = git("hash-object", "-w", "--stdin", stdin=name.encode('UTF-8'))
+    git("read-tree", "master")
+    git("update-index", "--add", "--cacheinfo", "100644,{},{}".format(blob, name))
+    tree = git("write-tree")
+    commit = git("commit-tree", tree, "-p", "master", "-m", name)
+    git("update-ref", "refs/heads/master", commit)
@@ -1,6 +1,7 @@
 import pytest
 import configparser
 import os
+import subprocess
 
 
 @pytest.fixture()
@@ -8,6 +9,23 @@ def temp_dir(tmpdir_factory):
     return(tmpdir_factory)
 
 
+@pytest.fixture(autouse=True)
+def cache_home(tmpdir_factory, monkeypatch):
+    """ Keep the vimpck cache of each test in a temporary directory """
+    cache_dir = tmpdir_factory.mktemp('cache')
+    monkeypatch.setitem(os.environ, 'XDG_CACHE_HOME', str(cache_dir))
+    return str(cache_dir)
+
+
+@pytest.fixture(autouse=True)
+def git_policy(monkeypatch):
+    """ Restore the timeouts and the retries of the git commands after each
+    test, the commands configure them from the configuration file """
+    from vim_pck import git
+    monkeypatch.setattr(git.Git, 'timeouts', {})
+    monkeypatch.setattr(git.Git, 'retries', 0)
+
+
 @pytest.fixture()
 def write_conf_1(temp_dir, monkeypatch):
     """ A clean configuration file
@@ -138,3 +156,126 @@ def write_conf_4(temp_dir, monkeypatch):
     monkeypatch.setitem(os.environ, 'VIMPCKRC', str(confpath))
     print(os.environ["VIMPCKRC"])
 
+
+GIT_ENV = dict(GIT_AUTHOR_NAME='vimpck', GIT_COMMITTER_NAME='vimpck',
+               GIT_AUTHOR_EMAIL='vimpck@test', GIT_COMMITTER_EMAIL='vimpck@test')
+
+
+def make_remote(basepath, name, files=None, submodules=None):
+    """ Create a bare repository usable as a remote url without network
+
+    1. Initialize a working repository with one commit per file
+    2. Add the submodules, a dict with key: path, value: remote url
+    3. Clone it as a bare repository named <name>.git in basepath
+
+    return:
+        the path of the bare repository
+    """
+    env = dict(os.environ, **GIT_ENV)
+    work_dir = os.path.join(str(basepath), 'work', name)
+    bare_dir = os.path.join(str(basepath), name + '.git')
+    os.makedirs(work_dir)
+    subprocess.run(["git", "-C", work_dir, "init", "-q", "-b", "master"],
+                   env=env, check=True)
+    for file_name, content in (files or {'README': name}).items():
+        file_path = os.path.join(work_dir, file_name)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(file_path, 'w') as f:
+            f.write(content)
+        subprocess.run(["git", "-C", work_dir, "add", file_name],
+                       env=env, check=True)
+        subprocess.run(["git", "-C", work_dir, "commit", "-q", "-m", file_name],
+                       env=env, check=True)
+    for path, remote_url in (submodules or {}).items():
+        subprocess.run(["git", "-C", work_dir, "-c", "protocol.file.allow=always",
+                        "submodule", "add", "-q", remote_url, path],
+                       env=env, check=True)
+        subprocess.run(["git", "-C", work_dir, "commit", "-q", "-m", path],
+                       env=env, check=True)
+    subprocess.run(["git", "clone", "-q", "--bare", work_dir, bare_dir],
+                   env=env, check=True)
+    # allow partial clones of the local remote
+    subprocess.run(["git", "-C", bare_dir, "config", "uploadpack.allowFilter", "true"],
+                   env=env, check=True)
+    return bare_dir
+
+
+@pytest.fixture()
+def allow_file_protocol(monkeypatch):
+    """ Allow git to clone submodules from local remotes """
+    monkeypatch.setitem(os.environ, 'GIT_CONFIG_COUNT', '1')
+    monkeypatch.setitem(os.environ, 'GIT_CONFIG_KEY_0', 'protocol.file.allow')
+    monkeypatch.setitem(os.environ, 'GIT_CONFIG_VALUE_0', 'always')
+
+
+def push_commit(remote_url, file_name):
+    """ Add a commit to a bare repository created by make_remote """
+    env = dict(os.environ, **GIT_ENV)
+    name = os.path.basename(remote_url)[:-len('.git')]
+    work_dir = os.path.join(os.path.dirname(remote_url), 'work', name)
+    with open(os.path.join(work_dir, file_name), 'w') as f:
+        f.write(file_name)
+    subprocess.run(["git", "-C", work_dir, "add", file_name],
+                   env=env, check=True)
+    subprocess.run(["git", "-C", work_dir, "commit", "-q", "-m", file_name],
+                   env=env, check=True)
+    subprocess.run(["git", "-C", work_dir, "push", "-q", remote_url, "master"],
+                   env=env, check=True)
+
+
+@pytest.fixture()
+def write_conf_local(temp_dir, monkeypatch):
+    """ A clean configuration file pointing to local bare repositories
+
+    1. Create 4 bare repositories
+    2. Write a vimpck configuration file and save it
+    3. Set the VIMPCKRC env variable to the path of the created configuration
+        file
+
+    return:
+        (pack_path, plugins) with plugins a dict, key: remote url, value:
+        <package>/<type>/<plugin>
+    """
+    config = configparser.ConfigParser()
+    basepath = temp_dir.mktemp('local_remote')
+    pack_path = basepath.join('pack')
+    confpath = basepath.join('config.ini')
+    plugins = {}
+    config['SETTING'] = {'pack_path': pack_path}
+    config['REPOSITORY'] = {}
+    for name, package, plug_type in [('vim-commentary', 'common', 'start'),
+                                     ('vim-dispatch', 'common', 'opt'),
+                                     ('vim-mustache-handlebars', 'filetype', 'start'),
+                                     ('vim-colors-solarized', 'colors', 'start')]:
+        remote_url = make_remote(basepath, name)
+        plugins[remote_url] = '/'.join([package, plug_type, name])
+    with open(confpath, 'w') as configfile:
+        config.write(configfile)
+        for remote_url, plug in plugins.items():
+            package, plug_type, name = plug.split('/')
+            configfile.write("    [[{}]]\n".format(remote_url))
+            configfile.write("        package = {}\n".format(package))
+            configfile.write("        type = {}\n".format(plug_type))
+    monkeypatch.setitem(os.environ, 'VIMPCKRC', str(confpath))
+    return str(pack_path), plugins
+
+
+def wait_removed(path, timeout=10):
+    """ Wait for a background process to delete path
+
+    return:
+        True when path was deleted before the timeout
+    """
+    import time
+    deadline = time.monotonic() + timeout
+    while os.path.lexists(path) and time.monotonic() < deadline:
+        time.sleep(0.05)
+    return not os.path.lexists(path)
+
+
+def write_settings(**settings):
+    """ Set options of the SETTING section of the VIMPCKRC configuration file """
+    import configobj
+    config = configobj.ConfigObj(os.environ['VIMPCKRC'])
+    config['SETTING'].update(settings)
+    config.write()
@@ -1,10 +1,14 @@
 import configparser
+import json
 import os
 import pytest
 from urllib.parse import urlparse
+import shutil
 import subprocess
 from vim_pck import command
 from vim_pck import utils
+from vim_pck import git
+from tests.conftest import make_remote, push_commit, wait_removed, write_settings
 
 
 @pytest.mark.skip(reason="to be reimplemented")
@@ -251,3 +255,473 @@ def test_upgrade_cmd(write_conf_1):
         else:
             assert 0
 
+
+class Test_Install_cmd_local:
+    """Test vim_pck.command.install_cmd() against local bare repositories
+    """
+
+    @pytest.mark.parametrize("jobs", [1, 4])
+    def test_install(self, write_conf_local, jobs):
+        """
+        Install the plugins of the configuration file, serially and
+        concurrently, and check that each one has been cloned in its package
+        directory
+        """
+
+        pack_path, plugins = write_conf_local
+
+        command.install_cmd(jobs=jobs)
+
+        plugls = utils.DiskPlugin(pack_path)
+        assert plugls.all_plug == {v: k for k, v in plugins.items()}
+
+    @pytest.mark.parametrize("mode", ['shared', 'dissociate'])
+    def test_mirror(self, write_conf_local, cache_home, mode):
+        """
+        With the mirror setting, each remote is mirrored in the cache and the
+        plugins borrow its objects, a wiped pack path is reinstalled from it
+        """
+
+        pack_path, plugins = write_conf_local
+        write_settings(mirror=mode)
+
+        for i in range(2):
+            command.install_cmd(jobs=4)
+            assert utils.DiskPlugin(pack_path).all_plug == {v: k for k, v in plugins.items()}
+            for remote_url, plug in plugins.items():
+                mirror = git.mirror_dir(remote_url, os.path.join(cache_home, 'vimpck', 'mirrors'))
+                assert os.path.isdir(mirror)
+                alternates = os.path.join(pack_path, plug, '.git', 'objects', 'info', 'alternates')
+                assert os.path.isfile(alternates) == (mode == 'shared')
+            shutil.rmtree(pack_path)
+
+
+class Test_Upgrade_cmd_local:
+    """Test vim_pck.command.upgrade_cmd() against local bare repositories
+    """
+
+    @pytest.mark.parametrize("jobs", [1, 4])
+    def test_upgrade(self, write_conf_local, capsys, jobs):
+        """
+        Install the plugins, add a commit to one of the remotes and upgrade
+        all plugins. Only this plugin should be reported as updated.
+        """
+
+        pack_path, plugins = write_conf_local
+        command.install_cmd(jobs=jobs)
+        updated_url = sorted(plugins)[0]
+        push_commit(updated_url, 'NEWS')
+        capsys.readouterr()
+
+        command.upgrade_cmd(plug=(), jobs=jobs)
+
+        lines = capsys.readouterr().out.splitlines()
+        for remote_url in plugins:
+            status = [line for line in lines if remote_url + ':' in line]
+            assert len(status) == 1
+            if remote_url == updated_url:
+                assert 'Updated' in status[0]
+            else:
+                assert 'Already up to date' in status[0]
+        local_dir = os.path.join(pack_path, plugins[updated_url])
+        assert os.path.isfile(os.path.join(local_dir, 'NEWS'))
+
+    def test_precheck(self, write_conf_local, capsys, monkeypatch):
+        """
+        Only the plugin whose remote moved is pulled, unless force is set
+        """
+
+        pack_path, plugins = write_conf_local
+        command.install_cmd(jobs=4)
+        updated_url = sorted(plugins)[0]
+        push_commit(updated_url, 'NEWS')
+
+        pulled = []
+        git_cmd_async = git.Pull.git_cmd_async
+
+        def spy(self):
+            pulled.append(self.local_dir)
+            return git_cmd_async(self)
+
+        monkeypatch.setattr(git.Pull, 'git_cmd_async', spy)
+        command.upgrade_cmd(plug=(), jobs=4)
+        assert pulled == [os.path.join(pack_path, plugins[updated_url])]
+
+        del pulled[:]
+        capsys.readouterr()
+        command.upgrade_cmd(plug=(), jobs=4, force=True)
+        assert len(pulled) == len(plugins)
+        assert capsys.readouterr().out.count('Already up to date') == len(plugins)
+
+    def test_mirror(self, write_conf_local, cache_home):
+        """
+        The mirror of a plugin whose remote moved is refreshed
+        """
+
+        pack_path, plugins = write_conf_local
+        write_settings(mirror='shared')
+        command.install_cmd(jobs=4)
+        updated_url = sorted(plugins)[0]
+        push_commit(updated_url, 'NEWS')
+
+        command.upgrade_cmd(plug=(), jobs=4)
+
+        mirror = git.mirror_dir(updated_url, os.path.join(cache_home, 'vimpck', 'mirrors'))
+        head = git.read_head(os.path.join(pack_path, plugins[updated_url]))
+        assert git.resolve_ref(mirror, 'refs/heads/master') == head
+        assert head == git.resolve_ref(updated_url, 'HEAD')
+
+
+class Test_Bundle_cmd_local:
+    """Test vim_pck.command.bundle_export_cmd() and the offline install
+    """
+
+    def test_export_install(self, write_conf_local, temp_dir, allow_file_protocol,
+                            monkeypatch, capsys):
+        """
+        Export the installed plugins, make the remotes unreachable and install
+        from the bundles in an empty pack path. Submodules are installed from
+        their bundle and the remote urls are kept.
+        """
+
+        import configobj
+
+        pack_path, plugins = write_conf_local
+        basepath = os.path.dirname(pack_path)
+        sub_url = make_remote(basepath, 'sub')
+        plug_url = make_remote(basepath, 'vim-sub', submodules={'sub': 'file://' + sub_url})
+        config = configobj.ConfigObj(os.environ['VIMPCKRC'])
+        config['REPOSITORY'][plug_url] = {'package': 'common', 'type': 'start'}
+        config.write()
+        plugins[plug_url] = 'common/start/vim-sub'
+        command.install_cmd(jobs=4)
+        heads = {url: git.read_head(os.path.join(pack_path, plug))
+                 for url, plug in plugins.items()}
+        with open(os.environ['VIMPCKRC'] + '.lock') as f:
+            sub_commit = git.read_head(os.path.join(pack_path, plugins[plug_url], 'sub'))
+            assert json.load(f)['plugins'][plug_url]['submodules'] == {'sub': sub_commit}
+
+        bundle_dir = str(temp_dir.mktemp('bundles'))
+        for i in range(2):
+            # the second export overwrites the bundles
+            command.bundle_export_cmd(dir=bundle_dir, jobs=4)
+            assert capsys.readouterr().out.count('Exported') == len(plugins)
+
+        for remote_url in list(plugins) + [sub_url]:
+            os.rename(remote_url, remote_url + '.gone')
+        monkeypatch.delitem(os.environ, 'GIT_CONFIG_COUNT')
+        shutil.rmtree(pack_path)
+        command.install_cmd(jobs=4, from_bundles=bundle_dir)
+
+        assert capsys.readouterr().out.count('Installed') == len(plugins)
+        for remote_url, plug in plugins.items():
+            local_dir = os.path.join(pack_path, plug)
+            assert git.read_head(local_dir) == heads[remote_url]
+            assert git.get_config(local_dir, 'remote.origin.url') == remote_url
+            assert git.upstream(local_dir) == ('origin', 'refs/heads/master',
+                                               'refs/remotes/origin/master')
+        sub_dir = os.path.join(pack_path, plugins[plug_url], 'sub')
+        assert git.get_config(sub_dir, 'remote.origin.url') == 'file://' + sub_url
+        assert os.path.isfile(os.path.join(sub_dir, 'README'))
+
+
+class Test_Lockfile_local:
+    """Test the lockfile and vim_pck.command.install_cmd(locked=True)
+    """
+
+    def test_locked(self, write_conf_local):
+        """
+        The lockfile records the installed commits. After the remotes moved,
+        a locked install in an empty pack path checks out the recorded
+        commits, with the history depth of a single commit, and the plugins
+        can still be upgraded.
+        """
+
+        pack_path, plugins = write_conf_local
+        command.install_cmd(jobs=4)
+        lock_path = os.environ['VIMPCKRC'] + '.lock'
+        with open(lock_path) as f:
+            lock = json.load(f)['plugins']
+        assert set(lock) == set(plugins)
+        for remote_url, plug in plugins.items():
+            local_dir = os.path.join(pack_path, plug)
+            assert lock[remote_url] == {'commit': git.read_head(local_dir),
+                                        'branch': 'master', 'submodules': {}}
+
+        for remote_url in plugins:
+            push_commit(remote_url, 'NEWS')
+        shutil.rmtree(pack_path)
+        command.install_cmd(jobs=4, locked=True)
+        for remote_url, plug in plugins.items():
+            local_dir = os.path.join(pack_path, plug)
+            assert git.read_head(local_dir) == lock[remote_url]['commit']
+            assert not os.path.isfile(os.path.join(local_dir, 'NEWS'))
+            assert subprocess.run(["git", "-C", local_dir, "rev-list", "--count", "HEAD"],
+                                  stdout=subprocess.PIPE).stdout.strip() == b'1'
+        with open(lock_path) as f:
+            assert json.load(f)['plugins'] == lock
+
+        command.upgrade_cmd(plug=(), jobs=4)
+        with open(lock_path) as f:
+            upgraded = json.load(f)['plugins']
+        for remote_url, plug in plugins.items():
+            local_dir = os.path.join(pack_path, plug)
+            assert os.path.isfile(os.path.join(local_dir, 'NEWS'))
+            assert upgraded[remote_url]['commit'] == git.resolve_ref(remote_url, 'HEAD')
+
+
+class Test_Plan_cmd_local:
+    """Test the plan of install_cmd() and clean_cmd(), and their dry run
+    """
+
+    def test_relocate_clean(self, write_conf_local, capsys):
+        """
+        A plugin whose type changed is moved, a plugin removed from the
+        configuration file is cleaned, nothing is done by a dry run
+        """
+
+        import configobj
+
+        pack_path, plugins = write_conf_local
+        command.install_cmd(jobs=4)
+        moved_url, removed_url = sorted(plugins)[:2]
+        config = configobj.ConfigObj(os.environ['VIMPCKRC'])
+        package, plug_type, name = plugins[moved_url].split('/')
+        config['REPOSITORY'][moved_url]['type'] = 'opt' if plug_type == 'start' else 'start'
+        del config['REPOSITORY'][removed_url]
+        config.write()
+        target = '/'.join([package, config['REPOSITORY'][moved_url]['type'], name])
+        capsys.readouterr()
+
+        command.install_cmd(dry_run=True)
+        command.clean_cmd(dry_run=True)
+        assert capsys.readouterr().out.splitlines() == [
+            'relocate {} -> {}'.format(plugins[moved_url], target),
+            'remove   {}'.format(plugins[removed_url])]
+        assert utils.DiskPlugin(pack_path).all_plug == {v: k for k, v in plugins.items()}
+
+        command.install_cmd()
+        command.clean_cmd()
+        del plugins[removed_url]
+        plugins[moved_url] = target
+        assert utils.DiskPlugin(pack_path).all_plug == {v: k for k, v in plugins.items()}
+        assert utils.DiskPlugin(pack_path, rescan=True).all_plug == {v: k for k, v in plugins.items()}
+        capsys.readouterr()
+        command.install_cmd(dry_run=True)
+        command.clean_cmd(dry_run=True)
+        command.upgrade_cmd(plug=(), dry_run=True)
+        lines = capsys.readouterr().out.splitlines()
+        assert lines[:2] == ['no plugin to install !', 'no plugins to be removed!']
+        assert sorted(lines[2:]) == sorted('upgrade  {}'.format(plug) for plug in plugins.values())
+
+
+class Test_Remove_cmd_local:
+    """Test vim_pck.command.remove_cmd() against local bare repositories
+    """
+
+    def test_remove_config(self, write_conf_local, monkeypatch):
+        """
+        Remove plugins and their section, the configuration file is written
+        once, atomically, and keeps its permissions
+        """
+
+        import configobj
+
+        pack_path, plugins = write_conf_local
+        command.install_cmd(jobs=4)
+        os.chmod(os.environ['VIMPCKRC'], 0o640)
+        removed = sorted(plugins)[:2]
+
+        writes = []
+        write = utils.ConfigFile.write
+
+        def spy(self):
+            writes.append(self.conf_path)
+            return write(self)
+
+        monkeypatch.setattr(utils.ConfigFile, 'write', spy)
+        command.remove_cmd(plug=[plugins[url] for url in removed] + ['not/a/plugin'], r=True)
+
+        assert writes == [os.environ['VIMPCKRC']]
+        assert os.stat(os.environ['VIMPCKRC']).st_mode & 0o777 == 0o640
+        assert set(configobj.ConfigObj(os.environ['VIMPCKRC'])['REPOSITORY']) == \
+            set(plugins) - set(removed)
+        assert utils.DiskPlugin(pack_path, rescan=True).all_plug == \
+            {v: k for k, v in plugins.items() if k not in removed}
+        assert wait_removed(utils.Trash(pack_path).path)
+
+
+class Test_Stats_cmd_local:
+    """Test vim_pck.command.stats_cmd() against local bare repositories
+    """
+
+    def test_stats(self, write_conf_local, monkeypatch):
+        """
+        Every plugin is measured, the number of commits is only counted
+        again when HEAD moves
+        """
+
+        pack_path, plugins = write_conf_local
+        command.install_cmd(jobs=4)
+        updated_url = sorted(plugins)[0]
+        push_commit(updated_url, 'NEWS')
+        command.upgrade_cmd(plug=(), jobs=4)
+
+        stats = json.loads(command.stats_cmd(json=True, sort='depth')[0])
+        assert [elem['plugin'] for elem in stats][0] == plugins[updated_url]
+        assert {elem['plugin'] for elem in stats} == set(plugins.values())
+        for elem in stats:
+            assert elem['url'] in plugins
+            assert elem['depth'] == (2 if elem['url'] == updated_url else 1)
+            assert elem['files'] == len(os.listdir(os.path.join(pack_path, elem['plugin']))) - 1
+            assert elem['git_bytes'] >= elem['loose_bytes'] + elem['packed_bytes'] > 0
+            assert elem['submodules'] == 0
+
+        counted = []
+        git_cmd_async = git.CountCommits.git_cmd_async
+
+        def spy(self):
+            counted.append(self.local_dir)
+            return git_cmd_async(self)
+
+        monkeypatch.setattr(git.CountCommits, 'git_cmd_async', spy)
+        lines = command.stats_cmd(sort='name')
+        assert not counted
+        assert lines[-1].endswith('total (4 plugins)')
+        assert [line.split()[-1] for line in lines[1:-1]] == sorted(plugins.values())
+
+
+class Test_Helptags_local:
+    """Test the generation of the help tags by install_cmd and upgrade_cmd
+    """
+
+    def test_install_upgrade(self, write_conf_local):
+        """
+        The tags files of the cloned plugins are written, upgrade only writes
+        the ones of the plugins that moved
+        """
+
+        import configobj
+
+        pack_path, plugins = write_conf_local
+        basepath = os.path.dirname(pack_path)
+        doc = {'doc/vim-doc.txt': '*vim-doc.txt*\tdoc\n\n*vim-doc-intro* |vim-doc|\n'}
+        for name in ['vim-doc', 'vim-doc-frozen']:
+            remote_url = make_remote(basepath, name, files=doc)
+            config = configobj.ConfigObj(os.environ['VIMPCKRC'])
+            config['REPOSITORY'][remote_url] = {'package': 'doc', 'type': 'start'}
+            config.write()
+            plugins[remote_url] = 'doc/start/' + name
+        command.install_cmd(jobs=4)
+
+        tags_files = {url: os.path.join(pack_path, plug, 'doc', 'tags')
+                      for url, plug in plugins.items() if 'vim-doc' in plug}
+        for tags_path in tags_files.values():
+            with open(tags_path, 'rb') as f:
+                assert f.read() == (b"vim-doc-intro\tvim-doc.txt\t/*vim-doc-intro*\n"
+                                    b"vim-doc.txt\tvim-doc.txt\t/*vim-doc.txt*\n")
+            os.remove(tags_path)
+        moved_url = [url for url in tags_files if plugins[url].endswith('vim-doc')][0]
+        push_commit(moved_url, 'NEWS')
+        command.upgrade_cmd(plug=(), jobs=4)
+        assert {url: os.path.exists(path) for url, path in tags_files.items()} == \
+            {url: url == moved_url for url in tags_files}
+
+        write_settings(helptags='False')
+        shutil.rmtree(os.path.join(pack_path, plugins[moved_url]))
+        command.install_cmd()
+        assert not os.path.exists(tags_files[moved_url])
+
+
+class Test_Snapshot_local:
+    """Test the snapshot mode against local bare repositories
+    """
+
+    def test_install_upgrade(self, write_conf_local, capsys):
+        """
+        The snapshots are listed, locked and only materialised again when
+        their remote tip moved
+        """
+
+        pack_path, plugins = write_conf_local
+        write_settings(mode='snapshot')
+        command.install_cmd(jobs=4)
+        for plug in plugins.values():
+            local_dir = os.path.join(pack_path, plug)
+            assert sorted(os.listdir(local_dir)) == ['.vimpck-snapshot', 'README']
+        heads = {url: git.resolve_ref(url, 'HEAD') for url in plugins}
+        assert sorted(command.ls_cmd(start=False, opt=False, hash=True, rescan=True)) == \
+            sorted("{} {}".format(plug, heads[url][:7]) for url, plug in plugins.items())
+        with open(os.environ['VIMPCKRC'] + '.lock') as f:
+            assert {url: entry['commit'] for url, entry in json.load(f)['plugins'].items()} \
+                == heads
+
+        updated_url = sorted(plugins)[0]
+        push_commit(updated_url, 'NEWS')
+        capsys.readouterr()
+        command.upgrade_cmd(plug=(), jobs=4)
+        out = capsys.readouterr().out
+        assert out.count('Already up to date') == len(plugins) - 1
+        assert out.count('Updated') == 1
+        local_dir = os.path.join(pack_path, plugins[updated_url])
+        assert os.path.isfile(os.path.join(local_dir, 'NEWS'))
+        assert not os.path.exists(os.path.join(local_dir, '.git'))
+
+    def test_mixed_modes(self, write_conf_local, capsys):
+        """ the mode of a plugin overrides the setting """
+
+        import configobj
+
+        pack_path, plugins = write_conf_local
+        snapshot_url = sorted(plugins)[0]
+        config = configobj.ConfigObj(os.environ['VIMPCKRC'])
+        config['REPOSITORY'][snapshot_url]['mode'] = 'snapshot'
+        config.write()
+        command.install_cmd(jobs=4)
+        for url, plug in plugins.items():
+            local_dir = os.path.join(pack_path, plug)
+            assert os.path.isdir(os.path.join(local_dir, '.git')) == (url != snapshot_url)
+            assert (git.read_snapshot(local_dir) is None) == (url != snapshot_url)
+
+        bundle_dir = os.path.join(os.path.dirname(pack_path), 'bundles')
+        capsys.readouterr()
+        command.bundle_export_cmd(dir=bundle_dir)
+        out = capsys.readouterr().out
+        assert out.count('Exported') == len(plugins) - 1
+        assert 'Snapshot, not exported' in out
+
+
+class Test_Merge_local:
+    """Test the merged runtime directory against local bare repositories
+    """
+
+    def test_install_remove(self, write_conf_local, capsys):
+        """ the merge root follows the installed and the removed plugins """
+
+        import configobj
+
+        pack_path, plugins = write_conf_local
+        basepath = os.path.dirname(pack_path)
+        files = {'plugin/vim-merged.vim': 'let g:merged = 1\n',
+                 'doc/vim-merged.txt': '*vim-merged.txt*\tdoc\n'}
+        remote_url = make_remote(basepath, 'vim-merged', files=files)
+        config = configobj.ConfigObj(os.environ['VIMPCKRC'])
+        config['REPOSITORY'][remote_url] = {'package': 'common', 'type': 'start'}
+        config.write()
+        write_settings(merge='symlink')
+        command.install_cmd(jobs=4)
+        out = capsys.readouterr().out
+        assert "4 start plugins" in out and "4 -> 1 runtimepath entries" in out
+
+        start = os.path.join(basepath, 'vimpck-merged', 'pack', 'vimpck', 'start', 'vimpck')
+        assert os.path.realpath(os.path.join(start, 'plugin')) == \
+            os.path.join(pack_path, 'common/start/vim-merged/plugin')
+        with open(os.path.join(start, 'doc', 'tags')) as f:
+            assert f.read() == "vim-merged.txt\tvim-merged.txt\t/*vim-merged.txt*\n"
+        opt = os.path.join(basepath, 'vimpck-merged', 'pack', 'vimpck', 'opt')
+        assert os.listdir(opt) == ['vim-dispatch']
+
+        command.remove_cmd(plug=['common/start/vim-merged'], r=False)
+        out = capsys.readouterr().out
+        assert "3 start plugins" in out and "3 -> 1 runtimepath entries" in out
+        assert os.listdir(start) == []
@@ -1,8 +1,11 @@
+import asyncio
 import os
 import re
 import subprocess
+import time
 
 from vim_pck import git
+from tests.conftest import GIT_ENV, make_remote, push_commit
 
 
 def test_humanish():
@@ -156,3 +159,494 @@ class Test_Hash():
         out = obj.git_cmd()
         # check that git clone return 1
         assert out
+
+
+class Test_get_config():
+    """ Test the in-process git config reader """
+
+    def test_same_as_git_config(self, temp_dir):
+        """ quoted values, comments, continuation and include must give the
+        same result as git config --get """
+        local_dir = str(temp_dir.mktemp("test_get_config"))
+        subprocess.run(["git", "-C", local_dir, "init", "-q"], check=True)
+        include_path = os.path.join(local_dir, "extra.inc")
+        with open(include_path, "w") as f:
+            f.write('[remote "upstream"]\n\turl = /path/from/include\n')
+        with open(os.path.join(local_dir, ".git", "config"), "a") as f:
+            f.write('[remote "origin"]\n'
+                    '\turl = "https://host/a path/repo" ; comment\n'
+                    '\tfetch = +refs/heads/*:refs/remotes/origin/* # comment\n'
+                    '[Branch "Master"]\n'
+                    '\tDescription = one \\\n'
+                    'two\\t"three # four"\n'
+                    '[include]\n'
+                    '\tpath = ../extra.inc\n')
+        for key in ["remote.origin.url", "remote.origin.fetch",
+                    "branch.Master.description", "remote.upstream.url",
+                    "core.bare"]:
+            cmd = ["git", "-C", local_dir, "config", "--get", key]
+            compl_proc = subprocess.run(cmd, stdout=subprocess.PIPE,
+                                        check=True)
+            expected = compl_proc.stdout.decode('UTF-8').rstrip('\n')
+            assert git.get_config(local_dir, key) == expected
+        assert git.get_config(local_dir, "remote.nope.url") is None
+
+    def test_gitdir_file(self, temp_dir):
+        """ a worktree with a .git file pointing to the git directory """
+        bsdir = str(temp_dir.mktemp("test_get_config"))
+        local_dir = os.path.join(bsdir, "repo")
+        worktree = os.path.join(bsdir, "worktree")
+        subprocess.run(["git", "init", "-q", local_dir], check=True)
+        subprocess.run(["git", "-C", local_dir, "remote", "add", "origin",
+                        "fake_url"], check=True)
+        subprocess.run(["git", "-C", local_dir, "-c", "user.name=a",
+                        "-c", "user.email=a@a", "commit", "-q",
+                        "--allow-empty", "-m", "init"], check=True)
+        subprocess.run(["git", "-C", local_dir, "worktree", "add", "-q",
+                        worktree], check=True)
+        assert os.path.isfile(os.path.join(worktree, ".git"))
+        assert git.get_config(worktree, "remote.origin.url") == "fake_url"
+
+    def test_not_a_repository(self, temp_dir):
+        """ not a git repository """
+        local_dir = str(temp_dir.mktemp("test_get_config"))
+        assert git.get_config(local_dir, "remote.origin.url") is None
+
+
+class Test_LocalHash():
+    """ Test the in-process HEAD resolution """
+
+    @staticmethod
+    def rev_parse(local_dir):
+        cmd = ["git", "-C", local_dir, "rev-parse", "HEAD"]
+        compl_proc = subprocess.run(cmd, stdout=subprocess.PIPE, check=True)
+        return compl_proc.stdout.decode('UTF-8').rstrip()
+
+    def test_refs(self, temp_dir):
+        """ loose ref, packed ref, detached HEAD and linked worktree """
+        bsdir = str(temp_dir.mktemp("test_LocalHash_class"))
+        local_dir = os.path.join(bsdir, "repo")
+        subprocess.run(["git", "init", "-q", local_dir], check=True)
+        for message in ["first", "second"]:
+            subprocess.run(["git", "-C", local_dir, "-c", "user.name=a",
+                            "-c", "user.email=a@a", "commit", "-q",
+                            "--allow-empty", "-m", message], check=True)
+        obj = git.LocalHash(local_dir)
+        assert not obj.git_cmd()
+        assert obj.retrieve_stdout() == self.rev_parse(local_dir)
+
+        subprocess.run(["git", "-C", local_dir, "pack-refs", "--all"],
+                       check=True)
+        assert git.read_head(local_dir) == self.rev_parse(local_dir)
+
+        subprocess.run(["git", "-C", local_dir, "checkout", "-q", "HEAD~1"],
+                       check=True)
+        assert git.read_head(local_dir) == self.rev_parse(local_dir)
+
+        worktree = os.path.join(bsdir, "worktree")
+        subprocess.run(["git", "-C", local_dir, "worktree", "add", "-q",
+                        "-b", "other", worktree, "HEAD"], check=True)
+        assert git.read_head(worktree) == self.rev_parse(worktree)
+
+    def test_non_valid_address(self, temp_dir):
+        """ not a git repository, fall back to git rev-list """
+        local_dir = str(temp_dir.mktemp("test_LocalHash_class"))
+        obj = git.LocalHash(local_dir)
+        assert obj.git_cmd()
+        assert obj.error_proc is not None
+
+
+class Test_Clone_local():
+    """ Test shallow and partial clones against local remotes """
+
+    @staticmethod
+    def git_out(*args):
+        compl_proc = subprocess.run(["git"] + list(args), stdout=subprocess.PIPE,
+                                    check=True)
+        return compl_proc.stdout.decode('UTF-8').rstrip()
+
+    @staticmethod
+    def dir_size(path):
+        return sum(os.path.getsize(os.path.join(root, name))
+                   for root, dirs, files in os.walk(path) for name in files)
+
+    def test_depth(self, temp_dir, allow_file_protocol):
+        """ depth is applied to the clone and to the submodules, the shallow
+        clone must use less disk space than the complete one """
+        bsdir = str(temp_dir.mktemp("test_Clone_class"))
+        files = {"doc/file{}.txt".format(i): os.urandom(4096).hex()
+                 for i in range(20)}
+        sub_url = make_remote(bsdir, "sub", files)
+        # the local clone optimization ignores --depth, use file:// for the
+        # submodule
+        remote_url = make_remote(bsdir, "plugin", files, {"sub": "file://" + sub_url})
+
+        full = git.Clone(remote_url, os.path.join(bsdir, "full"))
+        assert not full.git_cmd()
+        shallow = git.Clone(remote_url, os.path.join(bsdir, "shallow"), depth=1)
+        assert not shallow.git_cmd()
+
+        for local_dir in [shallow.local_dir, os.path.join(shallow.local_dir, "sub")]:
+            assert self.git_out("-C", local_dir, "rev-list", "--count", "HEAD") == "1"
+        assert self.git_out("-C", full.local_dir, "rev-list", "--count", "HEAD") == "21"
+        assert self.git_out("-C", shallow.local_dir, "config", "remote.origin.url") == remote_url
+        assert (self.dir_size(os.path.join(shallow.local_dir, ".git"))
+                < self.dir_size(os.path.join(full.local_dir, ".git")))
+
+    def test_filter(self, temp_dir):
+        """ blob:none partial clone """
+        bsdir = str(temp_dir.mktemp("test_Clone_class"))
+        remote_url = make_remote(bsdir, "plugin")
+        obj = git.Clone(remote_url, bsdir, filter_spec="blob:none")
+        assert not obj.git_cmd()
+        assert self.git_out("-C", obj.local_dir, "config",
+                            "remote.origin.partialclonefilter") == "blob:none"
+
+
+class Test_git_cmd_async():
+    """ Test the asyncio backend of the Git classes """
+
+    def test_same_result(self, temp_dir):
+        """ git_cmd and git_cmd_async return the same contract """
+        bsdir = str(temp_dir.mktemp("test_git_cmd_async"))
+        remote_url = make_remote(bsdir, "plugin")
+        obj = git.Clone(remote_url, bsdir)
+        loop = asyncio.new_event_loop()
+        try:
+            assert not loop.run_until_complete(obj.git_cmd_async())
+            assert isinstance(obj.compl_proc, subprocess.CompletedProcess)
+            for cls in [git.Hash, git.GetRemote]:
+                sync_obj, async_obj = cls(obj.local_dir), cls(obj.local_dir)
+                assert not sync_obj.git_cmd()
+                assert not loop.run_until_complete(async_obj.git_cmd_async())
+                assert sync_obj.retrieve_stdout() == async_obj.retrieve_stdout()
+            obj = git.Pull(bsdir)
+            assert loop.run_until_complete(obj.git_cmd_async())
+            assert isinstance(obj.error_proc, subprocess.CalledProcessError)
+            assert obj.error_proc.stderr
+        finally:
+            loop.close()
+
+
+class Test_Mirror():
+    """ Test the mirror cache of bare repositories """
+
+    def test_mirror_dir(self):
+        """ urls of the same remote share the same mirror """
+        url = "https://github.com/tpope/vim-commentary"
+        path = git.mirror_dir(url, "/cache")
+        assert re.match(r"^/cache/vim-commentary-[0-9a-f]{12}\.git$", path)
+        assert git.mirror_dir(url + ".git/", "/cache") == path
+        assert git.mirror_dir("https://github.com/other/vim-commentary", "/cache") != path
+
+    def test_create_refresh(self, temp_dir):
+        """ the mirror is cloned then fetched, the clone borrows its objects """
+        bsdir = str(temp_dir.mktemp("test_Mirror_class"))
+        remote_url = make_remote(bsdir, "plugin")
+        path = git.mirror_dir(remote_url, os.path.join(bsdir, "mirrors"))
+        mirror = git.Mirror(remote_url, path)
+        assert not mirror.git_cmd()
+        assert os.listdir(os.path.dirname(path)) == [os.path.basename(path)]
+
+        push_commit(remote_url, "NEWS")
+        assert not git.Mirror(remote_url, path).git_cmd()
+        assert git.resolve_ref(path, "refs/heads/master") == git.resolve_ref(remote_url, "HEAD")
+
+        obj = git.Clone(remote_url, bsdir, reference=path)
+        assert not obj.git_cmd()
+        with open(os.path.join(obj.local_dir, ".git", "objects", "info", "alternates")) as f:
+            assert f.read().strip() == os.path.join(path, "objects")
+
+    def test_fail(self, temp_dir):
+        """ nothing is left in the mirror cache when the clone fails """
+        bsdir = str(temp_dir.mktemp("test_Mirror_class"))
+        path = os.path.join(bsdir, "mirrors", "missing.git")
+        assert git.Mirror(os.path.join(bsdir, "missing"), path).git_cmd()
+        assert os.listdir(os.path.dirname(path)) == []
+
+
+class Test_LockedClone():
+    """ Test the LockedClone class on a directory that already exists """
+
+    def test_existing_dir(self, temp_dir):
+        """ a directory that is not empty is left untouched """
+        bsdir = str(temp_dir.mktemp("test_LockedClone_class"))
+        remote_url = make_remote(bsdir, "plugin")
+        root_dir = os.path.join(bsdir, "pack")
+        local_dir = os.path.join(root_dir, "plugin")
+        commit = git.resolve_ref(remote_url, "HEAD")
+        os.makedirs(local_dir)
+        with open(os.path.join(local_dir, "README"), "w") as f:
+            f.write("mine")
+        obj = git.LockedClone(remote_url, root_dir, commit, "master")
+        assert obj.git_cmd()
+        assert b"already exists" in obj.error_proc.stderr
+        assert os.listdir(local_dir) == ["README"]
+        with open(os.path.join(local_dir, "README")) as f:
+            assert f.read() == "mine"
+
+    def test_existing_plugin(self, temp_dir):
+        """ the plugin of another remote with the same name is kept """
+        bsdir = str(temp_dir.mktemp("test_LockedClone_class"))
+        other_url = make_remote(os.path.join(bsdir, "other"), "plugin")
+        remote_url = make_remote(bsdir, "plugin")
+        root_dir = os.path.join(bsdir, "pack")
+        local_dir = os.path.join(root_dir, "plugin")
+        assert not git.Clone(other_url, root_dir).git_cmd()
+        head = git.read_head(local_dir)
+        obj = git.LockedClone(remote_url, root_dir,
+                              git.resolve_ref(remote_url, "HEAD"), "master")
+        assert obj.git_cmd()
+        assert git.read_head(local_dir) == head
+        assert git.get_config(local_dir, "remote.origin.url") == other_url
+
+    def test_cleanup(self, temp_dir):
+        """ a failed install removes what it created, an empty directory is
+        kept """
+        bsdir = str(temp_dir.mktemp("test_LockedClone_class"))
+        remote_url = make_remote(bsdir, "plugin")
+        root_dir = os.path.join(bsdir, "pack")
+        local_dir = os.path.join(root_dir, "plugin")
+        missing = "0" * 40
+        assert git.LockedClone(remote_url, root_dir, missing).git_cmd()
+        assert not os.path.exists(local_dir)
+        os.makedirs(local_dir)
+        assert git.LockedClone(remote_url, root_dir, missing).git_cmd()
+        assert os.listdir(local_dir) == []
+        assert not git.LockedClone(remote_url, root_dir,
+                                   git.resolve_ref(remote_url, "HEAD")).git_cmd()
+
+
+class Test_Snapshot():
+    """ Test the snapshots, trees installed without git metadata """
+
+    def test_snapshot(self, temp_dir, allow_file_protocol):
+        """ no .git is left, the commits are recorded in the sidecar file """
+        bsdir = str(temp_dir.mktemp("test_Snapshot_class"))
+        sub_url = make_remote(bsdir, "sub")
+        remote_url = make_remote(bsdir, "plugin", submodules={"sub": "file://" + sub_url})
+        local_dir = os.path.join(bsdir, "pack", "plugin")
+        obj = git.Snapshot(remote_url, local_dir)
+        assert not obj.git_cmd()
+
+        assert sorted(os.listdir(os.path.dirname(local_dir))) == ["plugin"]
+        assert sorted(os.listdir(local_dir)) == [".gitmodules", ".vimpck-snapshot",
+                                                 "README", "sub"]
+        assert os.listdir(os.path.join(local_dir, "sub")) == ["README"]
+        assert git.read_snapshot(local_dir) == {
+            "url": remote_url, "commit": git.resolve_ref(remote_url, "HEAD"),
+            "branch": "master", "submodules": {"sub": git.resolve_ref(sub_url, "HEAD")}}
+        assert obj.submodules == {"sub": (None, git.resolve_ref(sub_url, "HEAD"))}
+        assert git.read_snapshot(bsdir) is None
+
+    def test_replace(self, temp_dir):
+        """ a new snapshot replaces the previous one, which is kept when the
+        clone fails """
+        bsdir = str(temp_dir.mktemp("test_Snapshot_class"))
+        remote_url = make_remote(bsdir, "plugin")
+        local_dir = os.path.join(bsdir, "pack", "plugin")
+        assert not git.Snapshot(remote_url, local_dir).git_cmd()
+        push_commit(remote_url, "NEWS")
+        assert not git.Snapshot(remote_url, local_dir, replace=True).git_cmd()
+        assert os.path.isfile(os.path.join(local_dir, "NEWS"))
+        assert git.read_snapshot(local_dir)["commit"] == git.resolve_ref(remote_url, "HEAD")
+
+        os.rename(remote_url, remote_url + ".gone")
+        obj = git.Snapshot(remote_url, local_dir, replace=True)
+        assert obj.git_cmd()
+        assert obj.error_proc.stderr
+        assert os.path.isfile(os.path.join(local_dir, "NEWS"))
+        assert os.listdir(os.path.dirname(local_dir)) == ["plugin"]
+
+    def test_existing(self, temp_dir):
+        """ a directory that is not a snapshot of the remote is kept """
+        bsdir = str(temp_dir.mktemp("test_Snapshot_class"))
+        other_url = make_remote(os.path.join(bsdir, "other"), "plugin")
+        remote_url = make_remote(bsdir, "plugin")
+        local_dir = os.path.join(bsdir, "pack", "plugin")
+        os.makedirs(local_dir)
+        with open(os.path.join(local_dir, "precious.txt"), "w") as f:
+            f.write("precious")
+        for replace in [False, True]:
+            obj = git.Snapshot(remote_url, local_dir, replace=replace)
+            assert obj.git_cmd()
+            assert obj.error_proc.stderr.startswith(b"fatal: ")
+            assert os.listdir(local_dir) == ["precious.txt"]
+
+        os.remove(os.path.join(local_dir, "precious.txt"))
+        assert not git.Snapshot(other_url, local_dir).git_cmd()
+        assert git.Snapshot(remote_url, local_dir).git_cmd()
+        assert git.Snapshot(remote_url, local_dir, replace=True).git_cmd()
+        assert git.read_snapshot(local_dir)["url"] == other_url
+        assert os.listdir(os.path.dirname(local_dir)) == ["plugin"]
+
+
+class Test_Pull_submodule():
+    """ Test the submodule step of the Pull class """
+
+    @staticmethod
+    def bump_submodule(remote_url, path):
+        """ Point the submodule path of a bare repository created by
+        make_remote to the tip of its remote """
+        env = dict(os.environ, **GIT_ENV)
+        work_dir = os.path.join(os.path.dirname(remote_url), 'work',
+                                os.path.basename(remote_url)[:-len('.git')])
+        for cmd in [["-C", os.path.join(work_dir, path), "pull", "-q"],
+                    ["-C", work_dir, "commit", "-q", "-am", path],
+                    ["-C", work_dir, "push", "-q", remote_url, "master"]]:
+            subprocess.run(["git"] + cmd, env=env, check=True)
+
+    def test_jobs(self):
+        """ the submodules are fetched in parallel on demand """
+        assert "--jobs" not in git.UpdateSubmodule("/plugin").command()
+        assert git.UpdateSubmodule("/plugin", 4).command()[-2:] == ["--jobs", "4"]
+        assert git.InitSubmodule("/plugin", jobs=4).command()[-2:] == ["--jobs", "4"]
+
+    def test_skip_update(self, temp_dir, allow_file_protocol, monkeypatch):
+        """ the submodules are only updated when the pull moved HEAD """
+        bsdir = str(temp_dir.mktemp("test_Pull_submodule"))
+        sub_url = make_remote(bsdir, "sub")
+        remote_url = make_remote(bsdir, "plugin", submodules={"sub": "file://" + sub_url})
+        clone = git.Clone(remote_url, bsdir)
+        assert not clone.git_cmd()
+        sub_head = git.read_head(os.path.join(clone.local_dir, "sub"))
+
+        # already up to date
+        updates = []
+        monkeypatch.setattr(git.UpdateSubmodule, "git_cmd",
+                            lambda self: updates.append(self) or 0)
+        obj = git.Pull(clone.local_dir)
+        assert not obj.git_cmd()
+        assert not updates and obj.submodules == {}
+        monkeypatch.undo()
+
+        push_commit(sub_url, "NEWS")
+        self.bump_submodule(remote_url, "sub")
+        obj = git.Pull(clone.local_dir, 2)
+        assert not obj.git_cmd()
+        new_head = git.read_head(os.path.join(clone.local_dir, "sub"))
+        assert new_head != sub_head
+        assert obj.submodules == {"sub": (sub_head, new_head)}
+
+
+class Test_timeout_retry():
+    """ Test the timeouts and the retries of the git commands """
+
+    class Script(git.Git):
+        """ A command that logs each attempt then fails with the stderr of
+        the attempt, it succeeds once the stderrs are exhausted """
+
+        operation = "query"
+
+        def __init__(self, local_dir, stderrs):
+            super().__init__(local_dir)
+            self.stderrs = stderrs
+
+        def command(self):
+            script = ('n=$(wc -l < log 2>/dev/null || echo 0); echo >> log; '
+                      'set -- "$@" ""; shift "$n"; '
+                      '[ -z "$1" ] && exit 0; echo "$1" >&2; exit 128')
+            return ["sh", "-c", "cd {} && {}".format(self.local_dir, script),
+                    "sh"] + self.stderrs
+
+        def attempts(self):
+            with open(os.path.join(self.local_dir, "log")) as f:
+                return len(f.readlines())
+
+    @staticmethod
+    def is_running(pid):
+        """ the process exists and is not a zombie """
+        try:
+            with open("/proc/{}/stat".format(pid)) as f:
+                return f.read().rsplit(")", 1)[1].split()[0] not in "ZX"
+        except OSError:
+            return False
+
+    def test_is_transient(self):
+        """ network errors are retried, missing repositories are not """
+        assert git.is_transient(b"fatal: unable to access 'https://host/repo/': "
+                                b"Could not resolve host: host")
+        assert git.is_transient(b"error: RPC failed; curl 56 GnuTLS recv error\n"
+                                b"fatal: early EOF")
+        assert not git.is_transient(b"remote: Repository not found.\n"
+                                    b"fatal: repository 'https://host/repo/' not found")
+        assert not git.is_transient(b"fatal: could not read Username for "
+                                    b"'https://host': terminal prompts disabled")
+
+    def test_backoff(self):
+        """ the delay doubles up to its maximum, with jitter """
+        for attempt in range(10):
+            delay = min(git.const.RETRY_MAX_DELAY, git.const.RETRY_DELAY * 2 ** attempt)
+            assert delay / 2 <= git.backoff(attempt) <= delay
+
+    def test_retry(self, temp_dir, monkeypatch):
+        """ transient failures are retried up to retries times """
+        monkeypatch.setattr(git, "backoff", lambda attempt: 0)
+        git.Git.configure({}, 2)
+        transient = "fatal: Could not resolve host: host"
+
+        obj = self.Script(str(temp_dir.mktemp("test_retry")), [transient, transient])
+        assert not obj.git_cmd()
+        assert obj.attempts() == 3
+
+        obj = self.Script(str(temp_dir.mktemp("test_retry")), [transient] * 3)
+        loop = asyncio.new_event_loop()
+        try:
+            assert loop.run_until_complete(obj.git_cmd_async())
+        finally:
+            loop.close()
+        assert obj.attempts() == 3
+        assert b"Could not resolve host" in obj.error_proc.stderr
+
+        obj = self.Script(str(temp_dir.mktemp("test_retry")),
+                          ["fatal: repository 'https://host/repo/' not found"])
+        assert obj.git_cmd()
+        assert obj.attempts() == 1
+
+    def test_timeout(self, temp_dir):
+        """ the command and its children are terminated on timeout """
+        cmd = ["sh", "-c", "sleep 60 & echo $!; wait"]
+
+        def run_async(cmd, timeout):
+            loop = asyncio.new_event_loop()
+            try:
+                return loop.run_until_complete(git.ex_subprocess_async(cmd, timeout))
+            finally:
+                loop.close()
+
+        for run in [git.ex_subprocess, run_async]:
+            start = time.monotonic()
+            out, compl_proc, error_proc = run(cmd, 0.5)
+            assert out == 1 and compl_proc is None
+            assert time.monotonic() - start < 10
+            assert isinstance(error_proc, subprocess.TimeoutExpired)
+            assert b"timed out after 0.5s" in error_proc.stderr
+        pid = int(git.ex_subprocess(cmd, 0.5)[2].stdout)
+        # the signal is delivered asynchronously
+        deadline = time.monotonic() + 5
+        while self.is_running(pid) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert not self.is_running(pid)
+
+    def test_not_started(self):
+        """ a command that cannot be started fails like the others """
+        cmd = ["vimpck-no-such-command"]
+
+        def run_async(cmd):
+            loop = asyncio.new_event_loop()
+            try:
+                return loop.run_until_complete(git.ex_subprocess_async(cmd))
+            finally:
+                loop.close()
+
+        for run in [git.ex_subprocess, run_async]:
+            out, compl_proc, error_proc = run(cmd)
+            assert out == 1 and compl_proc is None
+            assert isinstance(error_proc, subprocess.CalledProcessError)
+            assert b"could not run vimpck-no-such-command" in error_proc.stderr
+
+    def test_no_prompt(self):
+        """ git does not prompt for credentials """
+        out, compl_proc, error_proc = git.ex_subprocess(
+            ["sh", "-c", "echo $GIT_TERMINAL_PROMPT"])
+        assert compl_proc.stdout == b"0\n"
@@ -0,0 +1,102 @@
+import filecmp
+import os
+import shutil
+import subprocess
+
+import pytest
+
+from vim_pck import helptags
+
+DATA = os.path.join(os.path.dirname(__file__), 'data', 'helptags')
+
+
+@pytest.fixture()
+def plugins(temp_dir):
+    """ Copy the doc directories of the fixtures, see data/helptags
+
+    The expected tags files were written by vim 9.0 :helptags
+
+    return:
+        dict, key: name of the fixture, value: plugin directory
+    """
+    basepath = str(temp_dir.mktemp('helptags'))
+    plugin_dirs = {}
+    for name in sorted(os.listdir(DATA)):
+        plugin_dirs[name] = os.path.join(basepath, name)
+        shutil.copytree(os.path.join(DATA, name, 'doc'),
+                        os.path.join(plugin_dirs[name], 'doc'))
+    return plugin_dirs
+
+
+def cache(temp_dir):
+    return helptags.TagCache(os.path.join(str(temp_dir.mktemp('cache')), 'helptags.json'))
+
+
+class Test_helptags():
+    """ Test vim_pck.helptags """
+
+    def test_find_tags(self):
+        assert helptags.find_tags(b"*a* b*c* *d e* *f|g* *h*i *j*\n") == [b"a", b"j"]
+        assert helptags.find_tags(b"\t*a/b*\t*c\\d*\r\n") == [b"a/b", b"c\\d"]
+        assert helptags.find_tags(b"** *** *a**b*") == []
+        assert helptags.find_tags(b"*c* *d**e* *f*") == [b"c", b"f"]
+
+    def test_languages(self, plugins):
+        assert helptags.languages(os.path.join(plugins['a'], 'doc')) == {
+            'tags': ['Two.txt', 'one.txt'], 'tags-ja': ['one.jax']}
+        assert helptags.languages(os.path.join(plugins['a'], 'missing')) == {}
+
+    def test_same_as_vim(self, plugins, temp_dir):
+        """ the tags files are the ones written by vim """
+        errors = helptags.generate(list(plugins.values()), jobs=2, cache=cache(temp_dir))
+        assert errors == {plugins['a']: ['duplicate tag dup']}
+        for name, plugin_dir in plugins.items():
+            expected = os.path.join(DATA, name, 'expected')
+            names = sorted(os.listdir(expected))
+            assert sorted(helptags.languages(os.path.join(plugin_dir, 'doc'))) == names
+            for tags_name in names:
+                assert filecmp.cmp(os.path.join(plugin_dir, 'doc', tags_name),
+                                   os.path.join(expected, tags_name), shallow=False)
+
+    @pytest.mark.skipif(shutil.which('vim') is None, reason="vim is not installed")
+    def test_vim(self, plugins, temp_dir):
+        """ compare with the vim that is installed """
+        doc_dir = os.path.join(plugins['a'], 'doc')
+        with open(os.path.join(doc_dir, 'three.txt'), 'wb') as f:
+            f.write(b"*x*|*y* *z*\n" + b"*long* " * 200 + b"*cut*\n*nul\0*")
+        helptags.helptags(doc_dir, cache(temp_dir))
+        ours = {name: open(os.path.join(doc_dir, name), 'rb').read()
+                for name in ['tags', 'tags-ja']}
+        subprocess.run(['vim', '-es', '-u', 'NONE', '-N', '-c', 'helptags ' + doc_dir,
+                        '-c', 'qa!'], stdin=subprocess.DEVNULL, check=False)
+        for name, content in ours.items():
+            with open(os.path.join(doc_dir, name), 'rb') as f:
+                assert f.read() == content
+
+    def test_mixed_encodings(self, plugins, temp_dir):
+        """ as vim, the tags file is empty """
+        shutil.copy(os.path.join(plugins['b'], 'doc', 'two.txt'),
+                    os.path.join(plugins['a'], 'doc', 'utf8.txt'))
+        errors = helptags.helptags(os.path.join(plugins['a'], 'doc'), cache(temp_dir))
+        assert errors == ["mix of help file encodings within a language: utf8.txt"]
+        assert os.path.getsize(os.path.join(plugins['a'], 'doc', 'tags')) == 0
+
+    def test_cache(self, plugins, temp_dir, monkeypatch):
+        """ only the help files that changed are parsed again """
+        tag_cache = cache(temp_dir)
+        helptags.generate(list(plugins.values()), cache=tag_cache)
+        parsed = []
+        parse = helptags.parse
+
+        def spy(content):
+            parsed.append(content)
+            return parse(content)
+
+        monkeypatch.setattr(helptags, 'parse', spy)
+        doc_dir = os.path.join(plugins['b'], 'doc')
+        with open(os.path.join(doc_dir, 'two.txt'), 'ab') as f:
+            f.write(b"*new*\n")
+        helptags.generate(list(plugins.values()), cache=helptags.TagCache(tag_cache.path))
+        assert len(parsed) == 1
+        with open(os.path.join(doc_dir, 'tags'), 'rb') as f:
+            assert b"new\ttwo.txt\t/*new*\n" in f.read()
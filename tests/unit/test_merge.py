@@ -0,0 +1,157 @@
+import os
+import shutil
+import subprocess
+
+import pytest
+
+from vim_pck import merge
+
+FILES = {'common/start/vim-a/plugin/a.vim': "let g:a = 1\n",
+         'common/start/vim-a/autoload/a.vim': "function! a#f()\n  return 1\nendfunction\n",
+         'common/start/vim-a/ftplugin/python.vim': "let b:a = 1\n",
+         'common/start/vim-a/doc/a.txt': "*a.txt*\tdoc\n",
+         'common/start/vim-a/doc/tags': "stale\n",
+         'common/start/vim-a/README.md': "vim-a\n",
+         'common/start/vim-a/.git/HEAD': "ref: refs/heads/master\n",
+         'extra/start/vim-b/plugin/b.vim': "let g:b = 1\n",
+         'extra/start/vim-b/ftplugin/python.vim': "let b:b = 1\n",
+         'extra/start/vim-b/doc/b.txt': "*b.txt*\tdoc\n",
+         'extra/start/vim-b/after/plugin/b.vim': "let g:b_after = 1\n",
+         'extra/opt/vim-c/plugin/c.vim': "let g:c = 1\n"}
+
+HEADS = {'common/start/vim-a': 'a1', 'extra/start/vim-b': 'b1', 'extra/opt/vim-c': 'c1'}
+
+
+@pytest.fixture()
+def pack(temp_dir):
+    """ A pack path of 2 start plugins and of an opt plugin
+
+    return:
+        (pack_path, root) with root the merge root
+    """
+    basepath = str(temp_dir.mktemp('merge'))
+    pack_path = os.path.join(basepath, 'pack')
+    for path, content in FILES.items():
+        path = os.path.join(pack_path, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(content)
+    return pack_path, os.path.join(basepath, 'merged')
+
+
+def links(root):
+    """ Get the links of a merge root, key: path, value: target """
+    found = {}
+    for dirpath, dirnames, filenames in os.walk(root):
+        for name in dirnames + filenames:
+            path = os.path.join(dirpath, name)
+            if os.path.islink(path):
+                found[os.path.relpath(path, root)] = os.readlink(path)
+    return found
+
+
+class Test_merge():
+    """ Test vim_pck.merge """
+
+    def test_plugin_files(self, pack):
+        pack_path, root = pack
+        assert merge.plugin_files(os.path.join(pack_path, 'common/start/vim-a')) == [
+            'autoload/a.vim', 'doc/a.txt', 'ftplugin/python.vim', 'plugin/a.vim']
+
+    def test_layout(self):
+        """ the first plugin wins, the directories of a single plugin are
+        linked as a whole """
+        files = [('a', ['plugin/a.vim', 'autoload/a/x.vim', 'doc/a.txt', 'lib']),
+                 ('b', ['plugin/b.vim', 'autoload/a/x.vim', 'lib/b.py', 'doc/b.txt'])]
+        result, conflicts = merge.layout(files)
+        assert result == {'plugin/a.vim': ('a', False), 'plugin/b.vim': ('b', False),
+                          'autoload': ('a', True), 'lib': ('a', False),
+                          'doc/a.txt': ('a', False), 'doc/b.txt': ('b', False)}
+        assert conflicts == [('autoload/a/x.vim', 'a', 'b'), ('lib/b.py', 'a', 'b')]
+        result, conflicts = merge.layout(files, 'hardlink')
+        assert result['autoload/a/x.vim'] == ('a', False)
+
+    def test_build(self, pack):
+        pack_path, root = pack
+        report = merge.Runtime(root, pack_path).build(HEADS)
+        assert report == {'start': 2, 'before': 3, 'after': 2, 'added': 8, 'removed': 0,
+                          'conflicts': [('ftplugin/python.vim', 'common/start/vim-a',
+                                         'extra/start/vim-b')],
+                          'errors': []}
+        start = os.path.join('pack', 'vimpck', 'start', 'vimpck')
+        assert {path: target for path, target in links(root).items()
+                if path.startswith(start)} == {
+            os.path.join(start, path): os.path.join(pack_path, plugin, path)
+            for plugin, path in [('common/start/vim-a', 'autoload'),
+                                 ('common/start/vim-a', 'ftplugin'),
+                                 ('common/start/vim-a', 'plugin/a.vim'),
+                                 ('common/start/vim-a', 'doc/a.txt'),
+                                 ('extra/start/vim-b', 'plugin/b.vim'),
+                                 ('extra/start/vim-b', 'doc/b.txt'),
+                                 ('extra/start/vim-b', 'after')]}
+        with open(os.path.join(root, start, 'doc', 'tags')) as f:
+            assert f.read() == "a.txt\ta.txt\t/*a.txt*\nb.txt\tb.txt\t/*b.txt*\n"
+        assert os.readlink(os.path.join(root, 'pack', 'vimpck', 'opt', 'vim-c')) == \
+            os.path.join(pack_path, 'extra/opt/vim-c')
+
+    def test_incremental(self, pack, monkeypatch):
+        """ only the plugins whose HEAD changed are listed again, only the
+        links that changed are touched """
+        pack_path, root = pack
+        merge.Runtime(root, pack_path).build(HEADS)
+        listed = []
+        plugin_files = merge.plugin_files
+
+        def spy(plugin_dir):
+            listed.append(os.path.relpath(plugin_dir, pack_path))
+            return plugin_files(plugin_dir)
+
+        monkeypatch.setattr(merge, 'plugin_files', spy)
+        report = merge.Runtime(root, pack_path).build(HEADS)
+        assert (listed, report['added'], report['removed']) == ([], 0, 0)
+
+        os.remove(os.path.join(pack_path, 'extra/start/vim-b/plugin/b.vim'))
+        os.remove(os.path.join(pack_path, 'extra/start/vim-b/doc/b.txt'))
+        report = merge.Runtime(root, pack_path).build(dict(HEADS, **{'extra/start/vim-b': 'b2'}))
+        assert listed == ['extra/start/vim-b']
+        # plugin only has a file of vim-a left, it is linked as a whole
+        assert (report['added'], report['removed']) == (1, 3)
+        assert os.path.islink(os.path.join(root, 'pack', 'vimpck', 'start', 'vimpck', 'plugin'))
+        start = os.path.join(root, 'pack', 'vimpck', 'start', 'vimpck')
+        assert sorted(os.listdir(os.path.join(start, 'plugin'))) == ['a.vim']
+        with open(os.path.join(start, 'doc', 'tags')) as f:
+            assert f.read() == "a.txt\ta.txt\t/*a.txt*\n"
+
+        report = merge.Runtime(root, pack_path).build({'extra/start/vim-b': 'b2'})
+        assert report['before'] == 2
+        assert sorted(os.listdir(start)) == ['after', 'ftplugin']
+        assert os.listdir(os.path.join(root, 'pack', 'vimpck', 'opt')) == []
+
+    def test_hardlink(self, pack):
+        """ the files are hard links, made again when the plugin changed """
+        pack_path, root = pack
+        merge.Runtime(root, pack_path, 'hardlink').build(HEADS)
+        source = os.path.join(pack_path, 'common/start/vim-a/autoload/a.vim')
+        merged = os.path.join(root, 'pack', 'vimpck', 'start', 'vimpck', 'autoload', 'a.vim')
+        assert os.path.samefile(source, merged) and not os.path.islink(merged)
+        os.remove(source)
+        with open(source, 'w') as f:
+            f.write("function! a#f()\n  return 2\nendfunction\n")
+        merge.Runtime(root, pack_path, 'hardlink').build(dict(HEADS, **{'common/start/vim-a': 'a2'}))
+        assert os.path.samefile(source, merged)
+
+    @pytest.mark.skipif(shutil.which('vim') is None, reason="vim is not installed")
+    def test_vim(self, pack):
+        """ vim loads the merged start plugins from one runtimepath entry """
+        pack_path, root = pack
+        merge.Runtime(root, pack_path).build(HEADS)
+        out = os.path.join(root, 'out')
+        check = ("call writefile([len(filter(split(&rtp, ','), 'v:val =~# \"^{}\"')),"
+                 " g:a, g:b, g:b_after, a#f(), exists('g:c')], '{}')").format(root, out)
+        subprocess.run(['vim', '-es', '-N', '-u', 'NORC', '-i', 'NONE',
+                        '--cmd', 'set packpath=' + root, '-c', 'packadd vim-c',
+                        '-c', check, '-c', 'qa!'],
+                       stdin=subprocess.DEVNULL, timeout=30, check=False)
+        with open(out) as f:
+            # merged start directory, its after directory and vim-c
+            assert f.read().split() == ['3', '1', '1', '1', '1', '1']
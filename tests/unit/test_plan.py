@@ -0,0 +1,47 @@
+import os
+
+from vim_pck import plan
+
+
+def spec(package='vimpck', plug_type='start', freeze=False):
+    return {'package': package, 'type': plug_type, 'freeze': freeze}
+
+
+class Test_Plan():
+    """ Test vim_pck.plan.Plan """
+
+    def test_actions(self):
+        """ every kind of action is planned once """
+        repos = {'https://host/new': spec(),
+                 'https://host/same.git': spec('common'),
+                 'https://host/frozen': spec('common', freeze=True),
+                 'https://host/moved': spec('common', 'opt'),
+                 'https://host/twice': spec()}
+        all_plug = {'common/start/same': 'https://host/same',
+                    'common/start/frozen': 'https://host/frozen',
+                    'common/start/moved': 'https://host/moved',
+                    'vimpck/start/twice': 'https://host/twice',
+                    'other/start/twice': 'https://host/twice/',
+                    'vimpck/opt/unused': 'https://host/unused'}
+
+        todo = plan.Plan(repos, all_plug)
+
+        assert todo.installs == [plan.Action(plan.Kind.install, 'https://host/new', None,
+                                             os.path.join('vimpck', 'start', 'new'))]
+        assert todo.relocates == [plan.Action(plan.Kind.relocate, 'https://host/moved',
+                                              'common/start/moved',
+                                              os.path.join('common', 'opt', 'moved'))]
+        assert [action.path for action in todo.upgrades] == ['common/start/moved',
+                                                             'common/start/same',
+                                                             'vimpck/start/twice']
+        assert [action.path for action in todo.removes] == ['other/start/twice',
+                                                            'vimpck/opt/unused']
+        assert len(todo.actions()) == 7
+        assert str(todo.removes[1]) == 'remove   vimpck/opt/unused'
+
+    def test_empty(self):
+        """ nothing to do when the configuration file and the disk agree """
+        todo = plan.Plan({'https://host/plugin': spec()},
+                         {'vimpck/start/plugin': 'https://host/plugin'})
+        assert not todo.installs and not todo.removes and not todo.relocates
+        assert len(todo.upgrades) == 1
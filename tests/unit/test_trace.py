@@ -0,0 +1,51 @@
+import json
+import os
+
+from vim_pck import git
+from vim_pck import trace
+
+
+class Test_trace():
+    """ Test vim_pck.trace """
+
+    def test_disabled(self):
+        """ nothing is recorded without --trace """
+        with trace.span('phase'):
+            assert not trace.enabled()
+        assert trace.finish() == []
+
+    def test_git_verb(self):
+        assert trace.git_verb(['git', '-C', '/plug', 'submodule', 'update']) == 'git submodule'
+        assert trace.git_verb(['git', '-c', 'a=b', '--git-dir', '/m', 'fetch']) == 'git fetch'
+
+    def test_record(self, temp_dir):
+        """ the spans, the git commands and the summary are written """
+        path = os.path.join(str(temp_dir.mktemp('test_trace')), 'trace.json')
+        trace.start(path)
+        with trace.span('pull', jobs=2):
+            with trace.plugin('https://host/slow', 'pull'):
+                git.ex_subprocess(['git', 'version'])
+                git.ex_subprocess(['git', 'rev-parse', '--verify', 'no-such-ref'])
+            with trace.plugin('https://host/fast', 'pull'):
+                pass
+        lines = trace.finish()
+        assert not trace.enabled()
+
+        with open(path) as f:
+            data = json.load(f)
+        events = {(event['cat'], event['name']): event for event in data['traceEvents']}
+        command = events[('git', 'git rev-parse')]
+        assert command['args']['plugin'] == 'https://host/slow'
+        assert command['args']['exit'] != 0
+        assert command['args']['stderr_bytes'] > 0
+        assert command['args']['argv'][:2] == ['git', 'rev-parse']
+        assert events[('git', 'git version')]['args']['stdout_bytes'] > 0
+        assert events[('plugin', 'https://host/slow')]['tid'] == 1
+
+        summary = data['otherData']['summary']
+        assert summary['slowest'][0]['plugin'] == 'https://host/slow'
+        assert set(summary['slowest'][0]['git']) == {'git version', 'git rev-parse'}
+        # one job out of two was busy
+        assert 0 < summary['phases'][0]['efficiency'] <= 0.5 + 1e-3
+        assert lines[0] == ':: Trace written to {}'.format(path)
+        assert 'parallel efficiency:' in lines
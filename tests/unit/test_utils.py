@@ -4,6 +4,7 @@ import subprocess
 import pytest
 
 from vim_pck import utils
+from tests.conftest import wait_removed
 
 
 @pytest.mark.skip(reason="to be reimplemented")
@@ -82,9 +83,108 @@ class Test_ConfigFile():
             assert 0
 
 
+class Test_ConfigFile_cache():
+    """ Test the compiled configuration cache of ConfigFile """
+
+    def test_warm_run(self, write_conf_local, monkeypatch):
+        """ A warm run must not parse the configuration file, an edit must
+        be detected """
+        pack_path, plugins = write_conf_local
+        vimpckrc = utils.ConfigFile()
+        freeze_false = vimpckrc.freeze_false()
+        assert freeze_false == list(plugins)
+
+        def fail(*args, **kwargs):
+            raise AssertionError("configuration file parsed")
+
+        with monkeypatch.context() as m:
+            m.setattr(utils.ConfigFile, '_read_conf', fail)
+            warm = utils.ConfigFile()
+            assert warm.freeze_false() == freeze_false
+            assert warm.pack_path == vimpckrc.pack_path
+            assert warm.clone_opts(freeze_false[0]) == (0, '')
+
+        with open(os.environ["VIMPCKRC"], 'a') as f:
+            f.write('    [[https://github.com/tpope/vim-surround]]\n'
+                    '        freeze = True\n'
+                    '        depth = 1\n')
+        vimpckrc = utils.ConfigFile()
+        assert vimpckrc.freeze_false() == freeze_false
+        assert vimpckrc.clone_opts('https://github.com/tpope/vim-surround') == (1, '')
+
+
+def make_fake_plugins(bsdir, plugins):
+    """Create git repositories with a fake remote url
+
+    Arguments:
+            - bsdir (str): pack path
+            - plugins (dict): key = <package>/<type>/<plugin>,
+                              value = remote url
+    """
+    for key in plugins:
+        local_dir = os.path.join(bsdir, key)
+        os.makedirs(local_dir)
+        cmd = ["git", "-C", local_dir, "init"]
+        subprocess.run(cmd, stdout=subprocess.PIPE,
+                       stderr=subprocess.PIPE, check=True)
+        cmd = ["git", "-C", local_dir, "remote", "add", "origin",
+               plugins[key]]
+        subprocess.run(cmd, stdout=subprocess.PIPE,
+                       stderr=subprocess.PIPE, check=True)
+
+
 class Test_DiskPlugin():
     """Test the DiskPlugin class"""
 
+    def test_state_index(self, temp_dir, monkeypatch):
+        """
+        The second DiskPlugin instance must be built from the index without
+        walking the pack path, until a plugin is added or rescan is asked
+        """
+        bsdir = str(temp_dir.mktemp("test_DiskPlugin_class"))
+        plugins = {'colors/start/vim-colors-solarized': 'fake_url1',
+                   'common/opt/vim-dispatch': 'fake_url2'}
+        make_fake_plugins(bsdir, plugins)
+        assert utils.DiskPlugin(bsdir).all_plug == plugins
+
+        walked = []
+        list_plug_dir = utils.DiskPlugin._list_plug_dir
+
+        def spy(self, *args):
+            walked.append(True)
+            return list_plug_dir(self, *args)
+
+        monkeypatch.setattr(utils.DiskPlugin, '_list_plug_dir', spy)
+        assert utils.DiskPlugin(bsdir).all_plug == plugins
+        assert not walked
+
+        utils.DiskPlugin(bsdir, rescan=True)
+        assert len(walked) == 1
+
+        new_plugin = {'common/start/vim-commentary': 'fake_url3'}
+        make_fake_plugins(bsdir, new_plugin)
+        plugins.update(new_plugin)
+        assert utils.DiskPlugin(bsdir).all_plug == plugins
+        assert len(walked) == 2
+
+    def test_stray_directories(self, temp_dir):
+        """
+        Only the <package>/{start|opt}/<plugin> directories with a .git are
+        plugins, directories at other depths do not change the result
+        """
+        bsdir = str(temp_dir.mktemp("test_DiskPlugin_class"))
+        plugins = {'common/start/vim-commentary': 'fake_url1',
+                   'common/opt/vim-dispatch': 'fake_url2'}
+        make_fake_plugins(bsdir, plugins)
+        for stray in ['common/start/not-a-repo/plugin',
+                      'common/start/vim-commentary/deep/er/.git',
+                      'common/other/vim-plugin/.git',
+                      'empty-package']:
+            os.makedirs(os.path.join(bsdir, stray))
+        open(os.path.join(bsdir, 'common', 'start', 'file'), 'w').close()
+        assert utils.DiskPlugin(bsdir).all_plug == plugins
+        assert utils.DiskPlugin(os.path.join(bsdir, 'missing')).all_plug == {}
+
     def test_install_4_fake_plugin_no_problem(self, temp_dir):
         """
         Simulate installing 4 plugins by creating 4 git folder and assigning
@@ -121,3 +221,88 @@ class Test_DiskPlugin():
         else:
             assert 0
 
+
+class Test_Trash():
+    """ Test the Trash class
+    """
+
+    def test_move_empty(self, temp_dir):
+        """ a moved directory leaves the pack path at once and is deleted with
+        the leftovers of a previous run """
+        bsdir = str(temp_dir.mktemp('Trash'))
+        pack_path = os.path.join(bsdir, 'pack')
+        plugins = [os.path.join(pack_path, 'pkg', 'start', name) for name in ['a', 'b']]
+        for plugin in plugins:
+            os.makedirs(os.path.join(plugin, 'plugin'))
+        trash = utils.Trash(pack_path)
+        assert trash.path == os.path.join(bsdir, '.vimpck-trash')
+        os.makedirs(os.path.join(trash.path, 'leftover', 'doc'))
+
+        for plugin in plugins:
+            trash.move(plugin)
+            assert not os.path.exists(plugin)
+        assert len(os.listdir(trash.path)) == 3
+
+        trash.empty(4)
+        assert not os.path.exists(trash.path)
+        assert os.listdir(os.path.join(pack_path, 'pkg', 'start')) == []
+
+    def test_empty_detached(self, temp_dir):
+        """ the trash is emptied by a process that is not waited for """
+        bsdir = str(temp_dir.mktemp('Trash'))
+        pack_path = os.path.join(bsdir, 'pack')
+        plugin = os.path.join(pack_path, 'pkg', 'start', 'a')
+        os.makedirs(os.path.join(plugin, 'plugin'))
+        trash = utils.Trash(pack_path)
+        trash.move(plugin)
+        trash.empty_detached(2)
+        assert wait_removed(trash.path)
+        # nothing to delete
+        trash.empty_detached(2)
+
+    def test_other_filesystem(self, temp_dir, monkeypatch):
+        """ the directory is deleted in place when it can not be renamed to
+        the trash """
+        import errno
+
+        bsdir = str(temp_dir.mktemp('Trash'))
+        plugin = os.path.join(bsdir, 'pack', 'pkg', 'start', 'a')
+        os.makedirs(plugin)
+
+        def rename(src, dst):
+            raise OSError(errno.EXDEV, 'Invalid cross-device link')
+
+        monkeypatch.setattr(os, 'rename', rename)
+        utils.Trash(os.path.join(bsdir, 'pack')).move(plugin)
+        assert not os.path.exists(plugin)
+
+
+class Test_usage():
+    """ Test the disk usage functions
+    """
+
+    def test_dir_usage(self, temp_dir):
+        """ files and symbolic links are counted, skipped entries are only
+        skipped at the top level """
+        bsdir = str(temp_dir.mktemp('usage'))
+        for path, size in [('a', 10), ('doc/b', 20), ('.git/c', 30), ('doc/.git/d', 40)]:
+            os.makedirs(os.path.dirname(os.path.join(bsdir, path)), exist_ok=True)
+            with open(os.path.join(bsdir, path), 'w') as f:
+                f.write('x' * size)
+        os.symlink('a', os.path.join(bsdir, 'link'))
+        assert utils.dir_usage(bsdir) == (101, 5)
+        assert utils.dir_usage(bsdir, skip=('.git',)) == (71, 4)
+
+    def test_object_usage(self, temp_dir):
+        """ loose objects are counted apart from the packs """
+        bsdir = str(temp_dir.mktemp('usage'))
+        subprocess.run(['git', 'init', '-q', bsdir], check=True)
+        with open(os.path.join(bsdir, 'README'), 'w') as f:
+            f.write('usage')
+        subprocess.run(['git', '-C', bsdir, 'add', 'README'], check=True)
+        loose, packed = utils.object_usage(bsdir)
+        assert loose > 0 and packed == 0
+        subprocess.run(['git', '-C', bsdir, 'repack', '-adq'], check=True)
+        subprocess.run(['git', '-C', bsdir, 'prune'], check=True)
+        assert utils.object_usage(bsdir)[1] > 0
+        assert utils.object_usage(os.path.join(bsdir, 'missing')) == (0, 0)
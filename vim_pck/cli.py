@@ -1,44 +1,109 @@
 import click
-from vim_pck import command
+
+# vim_pck.command is imported by each subcommand, so that `vimpck help` and
+# `vimpck -h` only load click
 
 # enable -h as an help flag
 CONTEXT_SETTINGS = dict(help_option_names=['-h', '--help'])
 
 
 @click.group(context_settings=CONTEXT_SETTINGS)
-def main():
+@click.option('--rescan', is_flag=True,
+              help='rebuild the plugin index from the pack path')
+@click.option('--trace', type=click.Path(dir_okay=False, writable=True),
+              help='write the timing of each phase and git command to a '
+              'Chrome trace file')
+@click.pass_context
+def main(ctx, rescan, trace):
     """Vim package manager"""
-    pass
+    ctx.obj = {'rescan': rescan}
+    if trace:
+        from vim_pck import trace as tracer
+        tracer.start(trace)
+        ctx.call_on_close(lambda: click.echo('\n'.join(tracer.finish()), err=True))
 
 
 @click.command(context_settings=CONTEXT_SETTINGS)
-def install(**kwargs):
+@click.option('--jobs', '-j', type=click.IntRange(min=1), default=None,
+              help='number of plugins cloned at the same time')
+@click.option('--from-bundles', type=click.Path(exists=True, file_okay=False),
+              help='clone from a directory written by vimpck bundle export')
+@click.option('--locked', is_flag=True,
+              help='install the commits recorded in the lockfile')
+@click.option('--dry-run', '-n', is_flag=True,
+              help='only show the plugins that would be installed or moved')
+@click.pass_obj
+def install(obj, **kwargs):
     """Install package(s)"""
-    command.install_cmd(**kwargs)
+    from vim_pck import command
+    command.install_cmd(**kwargs, **obj)
 
 
 @click.command(context_settings=CONTEXT_SETTINGS)
 @click.option('--start', is_flag=True, help='list autostart packages')
 @click.option('--opt', is_flag=True, help='list optional packages')
-def ls(**kwargs):
+@click.option('--hash', is_flag=True, help='show the hash of the checked out commit')
+@click.pass_obj
+def ls(obj, **kwargs):
     """List installed package(s)"""
-    print(*command.ls_cmd(**kwargs), sep='\n')
+    from vim_pck import command
+    print(*command.ls_cmd(**kwargs, **obj), sep='\n')
+
+
+@click.command(context_settings=CONTEXT_SETTINGS)
+@click.option('--sort', '-s', default='name',
+              type=click.Choice(['name', 'size', 'files', 'git', 'loose',
+                                 'packed', 'submodules', 'depth']),
+              help='sort by name or by decreasing size or count')
+@click.option('--json', is_flag=True, help='output json')
+@click.option('--jobs', '-j', type=click.IntRange(min=1), default=None,
+              help='number of plugins measured at the same time')
+@click.pass_obj
+def stats(obj, **kwargs):
+    """Show disk usage and history depth of package(s)"""
+    from vim_pck import command
+    print(*command.stats_cmd(**kwargs, **obj), sep='\n')
 
 
 @click.command(context_settings=CONTEXT_SETTINGS)
 @click.argument('plug', required=False, nargs=-1)
-# @click.option('--force', '-f', is_flag=True, help='force upgrade')
-def upgrade(**kwargs):
+@click.option('--jobs', '-j', type=click.IntRange(min=1), default=None,
+              help='number of plugins upgraded at the same time')
+@click.option('--force', '-f', is_flag=True,
+              help='pull every plugin, even when its remote did not change')
+@click.option('--dry-run', '-n', is_flag=True,
+              help='only show the plugins that would be upgraded')
+@click.pass_obj
+def upgrade(obj, **kwargs):
     """Upgrade installed package(s)"""
-    command.upgrade_cmd(**kwargs)
+    from vim_pck import command
+    command.upgrade_cmd(**kwargs, **obj)
 
 
 @click.command(context_settings=CONTEXT_SETTINGS)
 @click.option('-r', is_flag=True, help='Remove entry from configuration file')
 @click.argument('plug', required=True, nargs=-1)
-def rm(**kwargs):
+@click.pass_obj
+def rm(obj, **kwargs):
     """Remove specified package(s)"""
-    command.remove_cmd(**kwargs)
+    from vim_pck import command
+    command.remove_cmd(**kwargs, **obj)
+
+
+@click.group(context_settings=CONTEXT_SETTINGS)
+def bundle():
+    """Export plugins for an offline install"""
+
+
+@click.command(context_settings=CONTEXT_SETTINGS)
+@click.argument('dir', type=click.Path(file_okay=False))
+@click.option('--jobs', '-j', type=click.IntRange(min=1), default=None,
+              help='number of plugins exported at the same time')
+@click.pass_obj
+def export(obj, **kwargs):
+    """Write a git bundle of each plugin in DIR"""
+    from vim_pck import command
+    command.bundle_export_cmd(**kwargs, **obj)
 
 
 @click.command()
@@ -49,17 +114,24 @@ def help(ctx):
 
 
 @click.command(context_settings=CONTEXT_SETTINGS)
-def clean():
+@click.option('--dry-run', '-n', is_flag=True,
+              help='only show the plugins that would be removed')
+@click.pass_obj
+def clean(obj, **kwargs):
     """Remove unused plugins"""
-    command.clean_cmd()
+    from vim_pck import command
+    command.clean_cmd(**kwargs, **obj)
 
 
 main.add_command(install)
 main.add_command(ls)
+main.add_command(stats)
 main.add_command(upgrade)
 main.add_command(rm)
 main.add_command(help)
 main.add_command(clean)
+main.add_command(bundle)
+bundle.add_command(export)
 
 
 if __name__ == '__main__':
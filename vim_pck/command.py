@@ -1,65 +1,640 @@
 """This module is where the main function for the subcommand of vimpck are
 stored
+
+asyncio, spinner and ansi are only imported by the commands that render
+a progress block or spawn jobs, so that read-only commands like ``vimpck ls``
+start quickly.
 """
 
+import functools
+import itertools
 import os
 import sys
-import shutil
 
 from vim_pck import utils
-from vim_pck import spinner
 from vim_pck import git
-from vim_pck import ansi
+from vim_pck import plan
 from vim_pck import const
+from vim_pck import trace
+
+
+def _get_jobs(vimpckrc, jobs=None):
+    """Get the number of concurrent workers
+
+    Arguments:
+            - vimpckrc (ConfigFile instance): configuration file
+            - jobs (int): value given on the command line, override the
+              configuration file when set
+    """
+
+    if jobs is None:
+        jobs = vimpckrc.settings[const.JOBS_NAME]
+    return max(1, jobs)
+
+
+def _configure_git(vimpckrc):
+    """Apply the timeouts and the retries of the configuration file to the
+    git commands
+    """
+
+    git.Git.configure(vimpckrc.timeouts(), vimpckrc.settings[const.RETRIES_NAME])
+
+
+def _ansi_parser():
+    """Create the parser of the color tags of the status lines"""
+
+    from vim_pck import ansi
+
+    return ansi.Parser(const.LHS, const.RHS)
+
+
+def _progress(total=0):
+    """Create the live progress block of a command"""
+
+    from vim_pck import spinner
+
+    return spinner.Progress(total, const.INTERVAL, const.SEQUENCE, const.OFFSET)
+
+
+def _run_jobs(func, items, jobs, progress=None, describe="{}".format, phase="jobs"):
+    """Apply func to each item with at most jobs workers at the same time
+
+    All the jobs are driven by a single asyncio event loop, a semaphore bounds
+    the number of jobs running at the same time.
+
+    Arguments:
+            - func (coroutine function): function called with one item
+            - items (iterable): items to process
+            - jobs (int): maximum number of concurrent workers
+            - progress (Progress instance): a row is displayed for each
+              running job
+            - describe (callable): return the progress row of an item, also
+              the name of its job in the trace
+            - phase (str): name of the jobs in the trace
+
+    Yield:
+        (item, result) (2-uple): in completion order
+    """
+
+    import asyncio
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    semaphore = asyncio.Semaphore(jobs)
+
+    async def bounded(item):
+        async with semaphore:
+            if progress is not None:
+                progress.add(item, describe(item))
+            try:
+                with trace.plugin(describe(item), phase):
+                    return item, await func(item)
+            finally:
+                if progress is not None:
+                    progress.remove(item)
+
+    pending = [loop.create_task(bounded(item)) for item in items]
+    try:
+        with trace.span(phase, jobs=jobs):
+            while pending:
+                done, pending = loop.run_until_complete(
+                    asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED))
+                for task in done:
+                    yield task.result()
+    finally:
+        for task in pending:
+            task.cancel()
+        if pending:
+            loop.run_until_complete(asyncio.wait(pending))
+        asyncio.set_event_loop(None)
+        loop.close()
+
+
+def _write_status(progress, ansi_tran, status):
+    """Write a status line above the progress block"""
+
+    with trace.span('render'):
+        status = status.rjust(len(status) + const.OFFSET)
+        progress.write(ansi_tran.sub(status))
+
+
+def _print_fail(progress, ansi_tran, info, git_inst):
+    """Print the failure status line and the stderr of a git command"""
+
+    _write_status(progress, ansi_tran, "✗ {}: <red>Fail<reset>".format(info))
+    err_status = git_inst.error_proc.stderr.decode('UTF-8')
+    # TODO: duplicate the retrieve_stdout method, merge them
+    err_status = err_status.rjust(len(err_status) + const.OFFSET + 2)
+    progress.write(err_status)
+
+
+async def _mirror(vimpckrc, remote_url):
+    """Get the mirror of remote_url in the mirror cache, it is cloned first
+    when it does not exist. None when the mirror setting is off
+    """
+
+    reference = vimpckrc.mirror(remote_url)
+    if reference is not None and not os.path.isdir(reference):
+        # the remote is downloaded once in the mirror cache, a failure only
+        # means that the clone does not borrow anything
+        await git.Mirror(remote_url, reference).git_cmd_async()
+    return reference
+
+
+async def _snapshot(vimpckrc, remote_url, local_dir, bundles=None, lock=None,
+                    replace=False):
+    """Materialise remote_url in local_dir without git metadata, see
+    git.Snapshot
+
+    Arguments:
+            - bundles (BundleDir instance), lock (LockFile instance): see
+              _clone
+            - replace (bool): replace an existing snapshot of remote_url
+
+    Return:
+        (out, tmp_snapshot) (2-uple): git command status and Snapshot
+        instance
+    """
+
+    sub_jobs = vimpckrc.settings[const.SUBMODULE_JOBS_NAME]
+    if bundles is not None:
+        tmp_snapshot = git.Snapshot(remote_url, local_dir,
+                                    url_map=bundles.url_map(remote_url),
+                                    submodule_jobs=sub_jobs, replace=replace)
+    else:
+        filter_spec = vimpckrc.clone_opts(remote_url)[1]
+        if lock is not None:
+            entry = lock.plugins[remote_url]
+            tmp_snapshot = git.Snapshot(remote_url, local_dir, entry['commit'],
+                                        entry['branch'], filter_spec,
+                                        submodule_jobs=sub_jobs, replace=replace)
+        else:
+            tmp_snapshot = git.Snapshot(remote_url, local_dir, filter_spec=filter_spec,
+                                        reference=await _mirror(vimpckrc, remote_url),
+                                        submodule_jobs=sub_jobs, replace=replace)
+    return await tmp_snapshot.git_cmd_async(), tmp_snapshot
+
+
+async def _clone(vimpckrc, remote_url, bundles=None, lock=None):
+    """Clone remote_url in its package directory, or materialise it when its
+    mode is snapshot
+
+    Arguments:
+            - bundles (BundleDir instance): clone from the bundles of the
+              plugin and of its submodules instead of the network
+            - lock (LockFile instance): only fetch and check out the commit
+              recorded in the lockfile
+
+    Return:
+        (out, tmp_cloner) (2-uple): git command status and Clone instance
+    """
+
+    local_dir = os.path.join(vimpckrc.pack_path,
+                             vimpckrc.repos[remote_url][const.PKG_NAME],
+                             vimpckrc.repos[remote_url][const.TYPE_NAME])
+    os.makedirs(local_dir, exist_ok=True)
+    if vimpckrc.mode(remote_url) == 'snapshot':
+        return await _snapshot(vimpckrc, remote_url,
+                               os.path.join(local_dir, git.humanish(remote_url)),
+                               bundles, lock)
+    sub_jobs = vimpckrc.settings[const.SUBMODULE_JOBS_NAME]
+    if bundles is not None:
+        # every object is read from the local bundles, a mirror or a shallow
+        # clone would not save anything
+        tmp_cloner = git.Clone(remote_url, local_dir,
+                               url_map=bundles.url_map(remote_url),
+                               submodule_jobs=sub_jobs)
+        return await tmp_cloner.git_cmd_async(), tmp_cloner
+    depth, filter_spec = vimpckrc.clone_opts(remote_url)
+    if lock is not None:
+        entry = lock.plugins[remote_url]
+        tmp_cloner = git.LockedClone(remote_url, local_dir, entry['commit'],
+                                     entry['branch'], depth, filter_spec,
+                                     sub_jobs)
+        return await tmp_cloner.git_cmd_async(), tmp_cloner
+    reference = await _mirror(vimpckrc, remote_url)
+    dissociate = vimpckrc.settings[const.MIRROR_NAME] == 'dissociate'
+    tmp_cloner = git.Clone(remote_url, local_dir, depth, filter_spec,
+                           reference, dissociate, submodule_jobs=sub_jobs)
+    return await tmp_cloner.git_cmd_async(), tmp_cloner
+
+
+def _submodule_dirs(local_dir):
+    """Get the directories of the initialized submodules of a local
+    repository, recursively
+    """
+
+    sub_dirs = []
+    if os.path.isfile(os.path.join(local_dir, ".gitmodules")):
+        for sub_dir in git.parse_gitmodule(local_dir):
+            if os.path.exists(os.path.join(sub_dir, ".git")):
+                sub_dirs.append(sub_dir)
+                sub_dirs += _submodule_dirs(sub_dir)
+    return sub_dirs
+
+
+async def _export(vimpckrc, bundles, installed, exported, remote_url):
+    """Write the bundles of an installed plugin and of its submodules
+
+    Arguments:
+            - bundles (BundleDir instance): destination
+            - installed (dict): key = remote url, value = path of the plugin
+              relative to the pack path
+            - exported (set): remote urls already exported by another job,
+              submodules shared by several plugins are only bundled once
+
+    Return:
+        (out, tmp_bundler, head, submodules) (4-uple): git command status,
+        last Bundle instance, hash of HEAD and remote urls of the submodules
+    """
+
+    local_dir = os.path.join(vimpckrc.pack_path, installed[remote_url])
+    repos = [(remote_url, local_dir)]
+    for sub_dir in _submodule_dirs(local_dir):
+        try:
+            sub_url = git.get_config(sub_dir, "remote.origin.url")
+        except (OSError, ValueError):
+            sub_url = None
+        if sub_url is not None:
+            repos.append((sub_url, sub_dir))
+
+    tmp_bundler = None
+    for url, repo_dir in repos:
+        if url in exported:
+            continue
+        exported.add(url)
+        tmp_bundler = git.Bundle(repo_dir, bundles.bundle_path(url))
+        if await tmp_bundler.git_cmd_async() != 0:
+            return 1, tmp_bundler, None, []
+    return 0, tmp_bundler, _head(local_dir), [url for url, repo_dir in repos[1:]]
+
+
+def _lock_entry(local_dir):
+    """Get the lockfile entry of an installed plugin
+
+    Return:
+        (commit, branch, submodules) (3-uple): see LockFile.update, None
+        when the commit of the plugin is unknown
+    """
+
+    snapshot = git.read_snapshot(local_dir)
+    if snapshot is not None:
+        return (snapshot['commit'], snapshot.get('branch'),
+                snapshot.get('submodules', {}))
+    commit = _head(local_dir)
+    if commit is None:
+        return None
+    try:
+        branch = git.head_branch(local_dir)
+    except (OSError, ValueError):
+        branch = None
+    submodules = {}
+    for sub_dir in _submodule_dirs(local_dir):
+        sub_commit = _head(sub_dir)
+        if sub_commit is not None:
+            submodules[os.path.relpath(sub_dir, local_dir)] = sub_commit
+    return commit, branch, submodules
+
+
+@trace.span('lock')
+def _write_lock(vimpckrc, index):
+    """Record the commit checked out for each plugin of the configuration
+    file in the lockfile
+
+    Arguments:
+            - index (StateIndex instance): installed plugins
+    """
+
+    lock = utils.LockFile(vimpckrc.conf_path)
+    try:
+        lock.load()
+    except ValueError:
+        # no lockfile yet, or a broken one that is replaced
+        pass
+    lock.prune(vimpckrc.rem_urls)
+    for rel_path, entry in index.plugins.items():
+        if entry['url'] not in vimpckrc.repos:
+            continue
+        lock_entry = _lock_entry(os.path.join(vimpckrc.pack_path, rel_path))
+        if lock_entry is not None:
+            lock.update(entry['url'], *lock_entry)
+    try:
+        lock.save()
+    except OSError as err:
+        print("could not write the lockfile: {}".format(err), file=sys.stderr)
+
+
+def _print_plan(actions, nothing):
+    """Print the actions of a --dry-run, or nothing when there is none"""
+
+    if not actions:
+        print(nothing)
+    for action in actions:
+        print(action)
+
+
+def _relocate(vimpckrc, index, action):
+    """Move a plugin to the directory of its package and type
+
+    Return:
+        status (str): status line of the move
+    """
+
+    src = os.path.join(vimpckrc.pack_path, action.path)
+    dst = os.path.join(vimpckrc.pack_path, action.target)
+    info = "{}".format(action.path)
+    if os.path.exists(dst):
+        return "✗ {}: <red>{} already exists<reset>".format(info, action.target)
+    try:
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        os.rename(src, dst)
+    except OSError as err:
+        return "✗ {}: <red>Could not move: {}<reset>".format(info, err.strerror)
+    index.remove(action.path)
+    index.update(action.target, action.remote_url, _head(dst))
+    return "✓ {}: <green>Moved to {}<reset>".format(info, action.target)
+
+
+def _head(local_dir):
+    """Get the hash of HEAD of a local repository, or the commit of a
+    snapshot, None if it fails
+    """
+
+    snapshot = git.read_snapshot(local_dir)
+    if snapshot is not None:
+        return snapshot['commit']
+    tmp_hasher = git.LocalHash(local_dir)
+    if tmp_hasher.git_cmd() == 0:
+        return tmp_hasher.retrieve_stdout()
+    return None
+
+
+async def _is_up_to_date(vimpckrc, path):
+    """Check with git ls-remote if the upstream branch of a plugin moved
+
+    Return:
+        head (str): the hash of HEAD when the remote tip, the local tracking
+        reference and HEAD are the same commit, None otherwise or if it can
+        not be determined. For a snapshot, the materialised commit when it is
+        the remote tip of its branch
+    """
+
+    local_dir = os.path.join(vimpckrc.pack_path, path)
+    snapshot = git.read_snapshot(local_dir)
+    if snapshot is not None:
+        remote, head = snapshot['url'], snapshot['commit']
+        merge_ref = "HEAD"
+        if snapshot.get('branch'):
+            merge_ref = "refs/heads/{}".format(snapshot['branch'])
+    else:
+        try:
+            tracking = git.upstream(local_dir)
+            if tracking is None:
+                return None
+            remote, merge_ref, tracking_ref = tracking
+            gitdir = git.git_dir(local_dir)
+            head = git.resolve_ref(gitdir, "HEAD")
+            local_tip = git.resolve_ref(gitdir, tracking_ref)
+        except (OSError, ValueError):
+            return None
+        if head is None or head != local_tip:
+            return None
+    tmp_lsremote = git.LsRemote(local_dir, remote, merge_ref)
+    if await tmp_lsremote.git_cmd_async() != 0 or tmp_lsremote.remote_tip() != head:
+        return None
+    return head
+
+
+async def _pull(vimpckrc, plug, path):
+    """Pull the plugin located at <pack_path>/path
+
+    When the plugin borrows its objects from the mirror cache, the mirror is
+    refreshed first so that the pull only downloads the references. A
+    snapshot is materialised again at the remote tip.
+
+    Arguments:
+            - plug (dict): key = path, value = remote url
+
+    Return:
+        (out, tmp_puller, hash_bef, hash_aft) (4-uple): git command status,
+        Pull or Snapshot instance and the hash of HEAD before and after the
+        pull
+    """
+
+    local_dir = os.path.join(vimpckrc.pack_path, path)
+    reference = vimpckrc.mirror(plug[path])
+    if (vimpckrc.settings[const.MIRROR_NAME] == 'shared' and reference is not None
+            and os.path.isdir(reference)):
+        await git.Mirror(plug[path], reference).git_cmd_async()
+    snapshot = git.read_snapshot(local_dir)
+    if snapshot is not None:
+        out, tmp_snapshot = await _snapshot(vimpckrc, plug[path], local_dir,
+                                            replace=True)
+        return out, tmp_snapshot, snapshot['commit'], _head(local_dir)
+    tmp_puller = git.Pull(local_dir, vimpckrc.settings[const.SUBMODULE_JOBS_NAME])
+    tmp_hasher = [git.LocalHash(local_dir) for i in range(2)]
+    await tmp_hasher[0].git_cmd_async()
+    hash_bef = tmp_hasher[0].retrieve_stdout()
+    out = await tmp_puller.git_cmd_async()
+    await tmp_hasher[1].git_cmd_async()
+    hash_aft = tmp_hasher[1].retrieve_stdout()
+    return out, tmp_puller, hash_bef, hash_aft
+
+
+def _install_sources(vimpckrc, from_bundles, locked):
+    """Load the bundles or the lockfile an install clones from
+
+    Return:
+        (bundles, lock) (2-uple): BundleDir and LockFile instances, None
+        when not used
+    """
+
+    bundles = None
+    lock = None
+    if from_bundles and locked:
+        sys.exit("--from-bundles and --locked can not be used together")
+    if from_bundles:
+        bundles = utils.BundleDir(from_bundles)
+        try:
+            bundles.load()
+        except ValueError as err:
+            sys.exit(str(err))
+    if locked:
+        lock = utils.LockFile(vimpckrc.conf_path)
+        try:
+            lock.load()
+        except ValueError as err:
+            sys.exit(str(err))
+    return bundles, lock
+
+
+def _install_targets(diff, bundles, lock, progress, ansi_tran):
+    """Report the plugins missing from the bundles or from the lockfile
 
+    Return:
+        targets (list(str)): remote urls that can be installed
+    """
+
+    targets = []
+    for remote_url in diff:
+        if bundles is not None and bundles.url_map(remote_url) is None:
+            status = "✗ {}: <red>Not in the bundles<reset>".format(remote_url)
+        elif lock is not None and remote_url not in lock.plugins:
+            status = "✗ {}: <red>Not in the lockfile<reset>".format(remote_url)
+        else:
+            targets.append(remote_url)
+            continue
+        _write_status(progress, ansi_tran, status)
+    return targets
+
+
+def _install_results(vimpckrc, index, results, progress, ansi_tran):
+    """Report the result of each clone and record the installed plugins in
+    the index
+
+    Return:
+        installed (list(str)): directories of the installed plugins
+    """
+
+    installed = []
+    for remote_url, (out, tmp_cloner) in results:
+        info = "{}".format(remote_url)
+        if out == 0:
+            status = "✓ {}: <green>Installed<reset>".format(info)
+            _write_status(progress, ansi_tran, status)
+            installed.append(tmp_cloner.local_dir)
+            index.update(os.path.relpath(tmp_cloner.local_dir, vimpckrc.pack_path),
+                         remote_url, _head(tmp_cloner.local_dir))
+        else:
+            _print_fail(progress, ansi_tran, info, tmp_cloner)
+        # TODO: more beautiful output info, see zplug update, also show the
+        # pack path
+    return installed
+
+
+def _install_plan(vimpckrc, pluglist, dry_run):
+    """Plan the install, only print it on a dry run
+
+    Return:
+        todo (Plan instance): None on a dry run
+    """
 
-def install_cmd():
+    with trace.span('plan'):
+        todo = plan.Plan(vimpckrc.repos, pluglist.all_plug)
+    if dry_run:
+        _print_plan(todo.relocates + todo.installs, 'no plugin to install !')
+        return None
+    return todo
+
+
+@trace.span('install')
+def install_cmd(**kwargs):
     """Install function. This function is launched when the ``vimpck install``
     command is invoked.
+
+    Arg:
+        **kwarg: kwargs['jobs'] (int) number of concurrent clones, default to
+        the jobs setting of the configuration file. kwargs['from_bundles']
+        (str) directory written by ``vimpck bundle export`` to clone from
+        without network. kwargs['locked'] (bool) install the commits
+        recorded in the lockfile, that is then left untouched.
+        kwargs['dry_run'] (bool) only print the plugins that would be
+        installed or moved
     """
 
-    vimpckrc = utils.ConfigFile()
+    with trace.span('config'):
+        vimpckrc = utils.ConfigFile()
+    _configure_git(vimpckrc)
+    bundles, lock = _install_sources(vimpckrc, kwargs.get('from_bundles'),
+                                     kwargs.get('locked'))
     os.makedirs(vimpckrc.pack_path, exist_ok=True)
-    pluglist = utils.DiskPlugin(vimpckrc.pack_path)
+    with trace.span('scan'):
+        pluglist = utils.DiskPlugin(vimpckrc.pack_path, kwargs.get('rescan', False))
+    jobs = _get_jobs(vimpckrc, kwargs.get('jobs'))
 
-    diff = set(vimpckrc.freeze_false()).symmetric_difference(set(pluglist.all_plug.values()))
+    todo = _install_plan(vimpckrc, pluglist, kwargs.get('dry_run'))
+    if todo is None:
+        return
+    diff = [action.remote_url for action in todo.installs]
 
-    if not diff:
+    if not diff and not todo.relocates:
         print('no plugin to install !')
     else:
-        ansi_tran = ansi.Parser(const.LHS, const.RHS)
+        ansi_tran = _ansi_parser()
         title = "<bold>:: Installing plugins...<reset>"
         print(ansi_tran.sub(title))
-        for remote_url in diff:
-            info = "{}".format(remote_url)
-            a_spinner = spinner.Spinner(info, const.INTERVAL,
-                                        const.SEQUENCE, const.OFFSET)
-            local_dir = os.path.join(vimpckrc.pack_path,
-                                     vimpckrc.config[const.SECT_2][remote_url][const.PKG_NAME],
-                                     vimpckrc.config[const.SECT_2][remote_url][const.TYPE_NAME])
-            os.makedirs(local_dir, exist_ok=True)
-            tmp_cloner = git.Clone(remote_url, local_dir)
-            a_spinner.start()
-            out = tmp_cloner.git_cmd()
-            a_spinner.stop()
+        with _progress(len(diff) + len(todo.relocates)) as progress:
+            for action in todo.relocates:
+                _write_status(progress, ansi_tran,
+                              _relocate(vimpckrc, pluglist.index, action))
+            diff = _install_targets(diff, bundles, lock, progress, ansi_tran)
+            results = _run_jobs(functools.partial(_clone, vimpckrc, bundles=bundles,
+                                                  lock=lock),
+                                diff, jobs, progress, phase='clone')
+            installed = _install_results(vimpckrc, pluglist.index, results,
+                                         progress, ansi_tran)
+            _helptags(vimpckrc, installed, jobs, progress, ansi_tran)
+        pluglist.index.save()
+    if lock is None:
+        _write_lock(vimpckrc, pluglist.index)
+    _merge(vimpckrc, pluglist.index, kwargs.get('rescan', False))
+
+
+@trace.span('bundle export')
+def bundle_export_cmd(**kwargs):
+    """Bundle export function. This function is launched when the ``vimpck
+    bundle export`` command is invoked.
+
+    Write a git bundle for each installed plugin of the configuration file
+    and for each of its submodules, plus a manifest, in a directory that
+    ``vimpck install --from-bundles`` can install from without network.
+
+    Arg:
+        **kwarg: kwargs['dir'] (str) bundle directory, kwargs['jobs'] (int)
+        number of concurrent exports, default to the jobs setting of the
+        configuration file
+    """
+
+    vimpckrc = utils.ConfigFile()
+    pluglist = utils.DiskPlugin(vimpckrc.pack_path, kwargs.get('rescan', False))
+    jobs = _get_jobs(vimpckrc, kwargs.get('jobs'))
+    bundles = utils.BundleDir(kwargs['dir'])
+    try:
+        bundles.load()
+    except ValueError:
+        # a new bundle directory
+        pass
+
+    installed = {v: k for k, v in pluglist.all_plug.items() if v in vimpckrc.repos}
+    # a snapshot has no history to bundle
+    snapshots = [url for url, path in installed.items()
+                 if git.read_snapshot(os.path.join(vimpckrc.pack_path, path)) is not None]
+    for remote_url in snapshots:
+        del installed[remote_url]
+    if not installed:
+        sys.exit('no plugin to export!')
+    os.makedirs(bundles.path, exist_ok=True)
+
+    ansi_tran = _ansi_parser()
+    title = "<bold>:: Exporting plugins to {}...<reset>".format(bundles.path)
+    print(ansi_tran.sub(title))
+    with _progress(len(vimpckrc.rem_urls)) as progress:
+        for remote_url in [url for url in vimpckrc.rem_urls if url not in installed]:
+            if remote_url in snapshots:
+                status = "✗ {}: <red>Snapshot, not exported<reset>".format(remote_url)
+            else:
+                status = "✗ {}: <red>Not installed<reset>".format(remote_url)
+            _write_status(progress, ansi_tran, status)
+        results = _run_jobs(functools.partial(_export, vimpckrc, bundles, installed, set()),
+                            list(installed), jobs, progress, phase='export')
+        for remote_url, (out, tmp_bundler, head, submodules) in results:
             if out == 0:
-                status = "✓ {}: <green>Installed<reset>".format(info)
-                status = status.rjust(len(status) + const.OFFSET)
-                status = ansi_tran.sub(status)
-                print(status)
+                bundles.add(remote_url, head, submodules)
+                status = "✓ {}: <green>Exported<reset>".format(remote_url)
+                _write_status(progress, ansi_tran, status)
             else:
-                status = "✗ {}: <red>Fail<reset>".format(info)
-                status = status.rjust(len(status) + const.OFFSET)
-                status = ansi_tran.sub(status)
-                print(status)
-                err_status = tmp_cloner.error_proc.stderr.decode('UTF-8')
-                # TODO: duplicate the retrieve_stdout method, merge them
-                err_status = err_status.rjust(len(err_status) + const.OFFSET + 2)
-                print(err_status)
-            del a_spinner
-            del tmp_cloner
-            # TODO: more beautiful output info, see zplug update, also show the
-            # pack path
+                _print_fail(progress, ansi_tran, remote_url, tmp_bundler)
+    bundles.save()
 
 
 def ls_cmd(**kwargs):
@@ -68,14 +643,15 @@ def ls_cmd(**kwargs):
 
     Arg:
         **kwarg (str) : an argument is present, kwargs['start']/kwarg['opt'] to
-        filter autostart/optional plugins
+        filter autostart/optional plugins, kwargs['hash'] to display the
+        abbreviated hash of HEAD after each plugin
     """
 
     vimpckrc = utils.ConfigFile()
     if not os.path.isdir(vimpckrc.pack_path):
         sys.exit("{} does not exist. Use vimpck install".format(vimpckrc.pack_path))
 
-    plugls = utils.DiskPlugin(vimpckrc.pack_path)
+    plugls = utils.DiskPlugin(vimpckrc.pack_path, kwargs.get('rescan', False))
 
     if kwargs['start']:
         plug = plugls.filt_plug('start')
@@ -84,138 +660,381 @@ def ls_cmd(**kwargs):
     else:
         plug = plugls.all_plug.keys()
 
+    if kwargs.get('hash'):
+        plug = ["{} {}".format(elem, (_head(os.path.join(vimpckrc.pack_path, elem)) or '')[:7])
+                for elem in plug]
+
     return plug
 # TODO: display something if pack exists but no plugins inside
 
 
+# key = --sort value, value = (key of the stats, sort in decreasing order)
+STATS_SORT = {'name': ('plugin', False),
+              'size': ('worktree_bytes', True),
+              'files': ('files', True),
+              'git': ('git_bytes', True),
+              'loose': ('loose_bytes', True),
+              'packed': ('packed_bytes', True),
+              'submodules': ('submodules', True),
+              'depth': ('depth', True)}
+
+
+def _usage(local_dir):
+    """Measure the disk usage of a plugin, see _stats"""
+
+    worktree, files = utils.dir_usage(local_dir, skip=('.git',))
+    loose, packed = utils.object_usage(local_dir)
+    # the objects are only walked once
+    meta = utils.dir_usage(os.path.join(local_dir, '.git'), skip=('objects',))[0]
+    return worktree, files, meta + loose + packed, loose, packed
+
+
+async def _stats(vimpckrc, index, path):
+    """Measure a plugin located at <pack_path>/path
+
+    The directories are walked in a thread while the commits are counted.
+    The number of commits is cached in the index until HEAD moves.
+
+    Return:
+        stats (dict): sizes in bytes, depth is None when the commits could
+        not be counted
+    """
+
+    import asyncio
+
+    local_dir = os.path.join(vimpckrc.pack_path, path)
+    usage = asyncio.get_event_loop().run_in_executor(None, _usage, local_dir)
+    head = _head(local_dir)
+    depth = index.depth(path, head)
+    # a snapshot has no history
+    if depth is None and git.read_snapshot(local_dir) is None:
+        tmp_counter = git.CountCommits(local_dir)
+        if await tmp_counter.git_cmd_async() == 0:
+            depth = int(tmp_counter.retrieve_stdout())
+            index.set_depth(path, head, depth)
+    try:
+        submodules = len(git.parse_gitmodule(local_dir))
+    except OSError:
+        submodules = 0
+    worktree, files, git_size, loose, packed = await usage
+    return {'plugin': path, 'url': index.plugins.get(path, {}).get('url'),
+            'worktree_bytes': worktree, 'files': files, 'git_bytes': git_size,
+            'loose_bytes': loose, 'packed_bytes': packed,
+            'submodules': submodules, 'depth': depth}
+
+
+def _human_size(size):
+    """Format a size in bytes, ex: 1.5M"""
+
+    for unit in ['B', 'K', 'M', 'G']:
+        if size < 1024 or unit == 'G':
+            break
+        size /= 1024
+    if unit == 'B':
+        return "{}B".format(size)
+    return "{:.1f}{}".format(size, unit)
+
+
+@trace.span('stats')
+def stats_cmd(**kwargs):
+    """stats function. This function is launched when the ``vimpck stats``
+    command is invoked.
+
+    Arg:
+        **kwarg: kwargs['sort'] (str) column to sort by, see STATS_SORT, the
+        sizes and counts are sorted in decreasing order. kwargs['json']
+        (bool) output a json list instead of a table. kwargs['jobs'] (int)
+        number of plugins measured at the same time, default to
+        const.STATS_JOBS
+
+    Return:
+        lines (list(str))
+    """
+
+    vimpckrc = utils.ConfigFile()
+    if not os.path.isdir(vimpckrc.pack_path):
+        sys.exit("{} does not exist. Use vimpck install".format(vimpckrc.pack_path))
+    pluglist = utils.DiskPlugin(vimpckrc.pack_path, kwargs.get('rescan', False))
+    jobs = kwargs.get('jobs') or const.STATS_JOBS
+
+    stats = [result for path, result in
+             _run_jobs(functools.partial(_stats, vimpckrc, pluglist.index),
+                       list(pluglist.all_plug), jobs, phase='measure')]
+    pluglist.index.save()
+
+    key, reverse = STATS_SORT[kwargs.get('sort') or 'name']
+    stats.sort(key=lambda elem: elem['plugin'])
+    if reverse:
+        # plugins whose depth is unknown come last
+        stats.sort(key=lambda elem: (elem[key] is not None, elem[key] or 0),
+                   reverse=True)
+    if kwargs.get('json'):
+        import json
+        return [json.dumps(stats, indent=2)]
+
+    row = "{:>9} {:>7} {:>9} {:>9} {:>9} {:>5} {:>7}  {}"
+    lines = [row.format('worktree', 'files', 'git', 'loose', 'packed', 'subm',
+                        'depth', 'plugin')]
+    for elem in stats:
+        lines.append(row.format(
+            _human_size(elem['worktree_bytes']), elem['files'],
+            _human_size(elem['git_bytes']), _human_size(elem['loose_bytes']),
+            _human_size(elem['packed_bytes']), elem['submodules'],
+            '-' if elem['depth'] is None else elem['depth'], elem['plugin']))
+    lines.append(row.format(
+        _human_size(sum(elem['worktree_bytes'] for elem in stats)),
+        sum(elem['files'] for elem in stats),
+        _human_size(sum(elem['git_bytes'] for elem in stats)),
+        _human_size(sum(elem['loose_bytes'] for elem in stats)),
+        _human_size(sum(elem['packed_bytes'] for elem in stats)),
+        sum(elem['submodules'] for elem in stats), '',
+        'total ({} plugins)'.format(len(stats))))
+    return lines
+
+
+def _print_submodules(progress, ansi_tran, submodules):
+    """Write the status of the submodules that changed during a pull
+
+    Arguments:
+            - submodules (dict): see Pull.submodules
+    """
+
+    for path, (head_bef, head_aft) in sorted(submodules.items()):
+        if head_aft is None:
+            status = "✗ {}: <red>Not checked out<reset>".format(path)
+        elif head_bef is None:
+            status = "✓ {}: <green>Checked out<reset>".format(path)
+        elif head_bef != head_aft:
+            status = "✓ {}: <green>Updated {}..{}<reset>".format(
+                path, head_bef[:7], head_aft[:7])
+        else:
+            continue
+        _write_status(progress, ansi_tran, status.rjust(len(status) + 2))
+
+
+@trace.span('upgrade')
 def upgrade_cmd(**kwargs):
     """Upgrade function. This function is launched when the ``vimpck upgrade``
     command is invoked.
+
+    Before pulling, the remote tip of every plugin is fetched concurrently
+    with git ls-remote. Plugins whose upstream did not move are reported as
+    already up to date without touching their worktree.
+
+    Arg:
+        **kwarg: kwargs['plug'] (list(str)) plugins to upgrade, all plugins
+        when empty. kwargs['jobs'] (int) number of concurrent pulls, default
+        to the jobs setting of the configuration file. kwargs['force'] (bool)
+        skip the git ls-remote pre-check and pull every plugin.
+        kwargs['dry_run'] (bool) only print the plugins that would be pulled
     """
 
-    vimpckrc = utils.ConfigFile()
+    with trace.span('config'):
+        vimpckrc = utils.ConfigFile()
+    _configure_git(vimpckrc)
     os.makedirs(vimpckrc.pack_path, exist_ok=True)
-    pluglist = utils.DiskPlugin(vimpckrc.pack_path)
-
-    plug = {k: v for k, v in pluglist.all_plug.items() if v in vimpckrc.freeze_false()}
+    with trace.span('scan'):
+        pluglist = utils.DiskPlugin(vimpckrc.pack_path, kwargs.get('rescan', False))
+    jobs = _get_jobs(vimpckrc, kwargs.get('jobs'))
 
     if kwargs['plug']:
-        plug = {k: v for k, v in pluglist.all_plug.items() if k in kwargs['plug']}
+        plug = {k: pluglist.all_plug[k] for k in kwargs['plug'] if k in pluglist.all_plug}
+    else:
+        with trace.span('plan'):
+            todo = plan.Plan(vimpckrc.repos, pluglist.all_plug)
+        plug = {action.path: action.remote_url for action in todo.upgrades}
 
+    if kwargs.get('dry_run'):
+        _print_plan([plan.Action(plan.Kind.upgrade, url, path, None)
+                     for path, url in plug.items()], 'no plugins to be upgraded!')
+        return
     if not plug:
         sys.exit('no plugins to be upgraded!')
 
-    ansi_tran = ansi.Parser(const.LHS, const.RHS)
+    ansi_tran = _ansi_parser()
     title = "<bold>:: Upgrading plugins...<reset>"
     print(ansi_tran.sub(title))
-    for path in plug.keys():
-        info = "{}".format(plug[path])
-        a_spinner = spinner.Spinner(info, const.INTERVAL,
-                                    const.SEQUENCE, const.OFFSET)
-        local_dir = os.path.join(vimpckrc.pack_path, path)
-
-        tmp_puller = git.Pull(local_dir)
-        tmp_hasher = [git.Hash(local_dir) for i in range(2)]
-        tmp_hasher[0].git_cmd()
-        hash_bef = tmp_hasher[0].retrieve_stdout()
-        a_spinner.start()
-        out = tmp_puller.git_cmd()
-        a_spinner.stop()
-        tmp_hasher[1].git_cmd()
-        hash_aft = tmp_hasher[1].retrieve_stdout()
-        if out == 0:
-            if hash_bef == hash_aft:
-                message = "<yellow>Already up to date<reset>"
+
+    to_pull = list(plug.keys())
+    up_to_date = {}
+    with _progress(len(plug)) as progress:
+        if not kwargs.get('force'):
+            precheck = _run_jobs(functools.partial(_is_up_to_date, vimpckrc),
+                                 to_pull, max(jobs, const.PRECHECK_JOBS),
+                                 describe=plug.get, phase='precheck')
+            up_to_date = {path: head for path, head in precheck if head is not None}
+            to_pull = [path for path in to_pull if path not in up_to_date]
+
+        results = itertools.chain(
+            ((path, (0, None, head, head)) for path, head in up_to_date.items()),
+            _run_jobs(functools.partial(_pull, vimpckrc, plug), to_pull, jobs,
+                      progress, lambda path: "{}".format(plug[path]), phase='pull'))
+        updated = []
+        for path, (out, tmp_puller, hash_bef, hash_aft) in results:
+            info = "{}".format(plug[path])
+            if out == 0:
+                if hash_bef == hash_aft:
+                    message = "<yellow>Already up to date<reset>"
+                else:
+                    message = "<green>Updated"
+                    updated.append(os.path.join(vimpckrc.pack_path, path))
+                status = "✓ {}: <green>{}<reset>".format(info, message)
+                _write_status(progress, ansi_tran, status)
+                if tmp_puller is not None:
+                    _print_submodules(progress, ansi_tran, tmp_puller.submodules)
+                pluglist.index.update(path, plug[path], hash_aft)
             else:
-                message = "<green>Updated"
-            status = "✓ {}: <green>{}<reset>".format(info, message)
-            status = status.rjust(len(status) + const.OFFSET)
-            status = ansi_tran.sub(status)
-            print(status)
+                _print_fail(progress, ansi_tran, info, tmp_puller)
+            # TODO: Add a verbose flag that allow to see the hash range
+        _helptags(vimpckrc, updated, jobs, progress, ansi_tran)
+    pluglist.index.save()
+    _write_lock(vimpckrc, pluglist.index)
+    _merge(vimpckrc, pluglist.index, kwargs.get('rescan', False))
+
+
+def _helptags(vimpckrc, local_dirs, jobs, progress, ansi_tran):
+    """Generate the doc/tags files of the plugins that were installed or
+    updated, unless the helptags setting is off
+    """
+
+    if not local_dirs or not vimpckrc.settings[const.HELPTAGS_NAME]:
+        return
+    from vim_pck import helptags
+
+    with trace.span('helptags'):
+        errors = helptags.generate(local_dirs, jobs)
+    for local_dir in local_dirs:
+        for error in errors.get(local_dir, []):
+            status = "✗ {}: <red>helptags: {}<reset>".format(
+                os.path.relpath(local_dir, vimpckrc.pack_path), error)
+            _write_status(progress, ansi_tran, status)
+
+
+def _merge(vimpckrc, index, rescan=False):
+    """Update the merged runtime directory of the start plugins, unless the
+    merge setting is off, see merge.Runtime
+
+    Arguments:
+            - index (StateIndex instance): installed plugins
+            - rescan (bool): list the files of every plugin again
+    """
+
+    root = vimpckrc.merge_path()
+    if root is None:
+        return
+    from vim_pck import merge
+
+    ansi_tran = _ansi_parser()
+    title = "<bold>:: Merging the start plugins in {}...<reset>".format(root)
+    print(ansi_tran.sub(title))
+    heads = {path: entry['head'] or _head(os.path.join(vimpckrc.pack_path, path))
+             for path, entry in index.plugins.items()}
+    with trace.span('merge'):
+        report = merge.Runtime(root, vimpckrc.pack_path,
+                               vimpckrc.settings[const.MERGE_NAME]).build(heads, rescan)
+    statuses = ["✗ {}: <red>Conflict, {} is kept, {} is ignored<reset>".format(*conflict)
+                for conflict in report['conflicts']]
+    statuses += ["✗ <red>{}<reset>".format(error) for error in report['errors']]
+    statuses.append("✓ {} start plugins: <green>{} -> {} runtimepath entries<reset>, "
+                    "{} links added, {} removed".format(
+                        report['start'], report['before'], report['after'],
+                        report['added'], report['removed']))
+    for status in statuses:
+        print(ansi_tran.sub(status.rjust(len(status) + const.OFFSET)))
+
+
+def _remove(vimpckrc, index, plugs, progress, ansi_tran):
+    """Move plugins to the trash, see remove_cmd
+
+    Arguments:
+            - index (StateIndex instance): the removed plugins are forgotten
+            - plugs (list(str)): paths of the plugins relative to the pack
+              path
+
+    Return:
+        trash (Trash instance): holds the removed plugins
+    """
+
+    trash = utils.Trash(vimpckrc.pack_path)
+    for plug in plugs:
+        info = "Removing {}".format(plug)
+        try:
+            trash.move(os.path.join(vimpckrc.pack_path, plug))
+        except OSError:
+            status = "✗ {}: <red>Could not remove !<reset>".format(info)
         else:
-            status = "✗ {}: <red>Fail<reset>".format(info)
-            status = status.rjust(len(status) + const.OFFSET)
-            status = ansi_tran.sub(status)
-            print(status)
-            err_status = tmp_puller.error_proc.stderr.decode('UTF-8')
-            # TODO: duplicate the retrieve_stdout method, merge them
-            err_status = err_status.rjust(len(err_status) + const.OFFSET + 2)
-            print(err_status)
-        del a_spinner
-        del tmp_puller
-        del tmp_hasher
-        # TODO: Add a verbose flag that allow to see the hash range
+            status = "✓ {}: <green>Removed<reset>".format(info)
+            index.remove(plug)
+        _write_status(progress, ansi_tran, status)
+    return trash
 
 
+@trace.span('rm')
 def remove_cmd(**kwargs):
     """This function is launched when the ``vimpck remove``
     command is invoked.
+
+    The plugins are first moved to the trash, which is then emptied in a
+    detached process that the command does not wait for.
+    With kwargs['r'], the configuration file is written once at the end.
     """
 
     vimpckrc = utils.ConfigFile()
-    plugls = utils.DiskPlugin(vimpckrc.pack_path)
-    ansi_tran = ansi.Parser(const.LHS, const.RHS)
+    plugls = utils.DiskPlugin(vimpckrc.pack_path, kwargs.get('rescan', False))
+    ansi_tran = _ansi_parser()
 
     title = "<bold>:: Removing {} plugin(s)...<reset>".format(len(kwargs['plug']))
     print(ansi_tran.sub(title))
 
-    for plug in kwargs['plug']:
-        info = "Removing {}".format(plug)
-        a_spinner = spinner.Spinner(info, const.INTERVAL,
-                                    const.SEQUENCE, const.OFFSET)
-        a_spinner.start()
-        if plug in plugls.all_plug.keys():
-            try:
-                shutil.rmtree(os.path.join(vimpckrc.pack_path, plug))
-            except:
-                status = "✗ {}: <red>Could not remove !<reset>".format(info)
+    with _progress(len(kwargs['plug'])) as progress:
+        plugs = []
+        for plug in kwargs['plug']:
+            if plug in plugls.all_plug:
+                plugs.append(plug)
             else:
-                status = "Removed"
-                status = "✓ {}: <green>{}<reset>".format(info, status)
-
-            if kwargs['r']:
+                info = "Removing {}".format(plug)
+                status = "✗ {}: <red>Not a valid plugin !<reset>".format(info)
+                _write_status(progress, ansi_tran, status)
+        trash = _remove(vimpckrc, plugls.index, plugs, progress, ansi_tran)
+        if kwargs['r'] and plugs:
+            for plug in plugs:
                 vimpckrc.config[const.SECT_2].pop(plugls.all_plug[plug], None)
-                vimpckrc.config.write()
-        else:
-            status = "✗ {}: <red>Not a valid plugin !<reset>".format(info)
-        a_spinner.stop()
-        status = status.rjust(len(status) + const.OFFSET)
-        print(ansi_tran.sub(status))
-        del a_spinner
-# TODO: spinner class, stop the spinner thread when deleting the object.
-# __del__ method
+            vimpckrc.write()
+        plugls.index.save()
+    trash.empty_detached(max(_get_jobs(vimpckrc), const.TRASH_JOBS))
+    _merge(vimpckrc, plugls.index, kwargs.get('rescan', False))
 
 
-def clean_cmd():
+@trace.span('clean')
+def clean_cmd(**kwargs):
     """This function is launched when the ``vimpck clean``
     command is invoked.
+
+    Remove the plugins that are not in the configuration file and the extra
+    copies of the plugins installed twice. The plugins are first moved to the
+    trash, which is then emptied in the background, see remove_cmd.
+
+    Arg:
+        **kwarg: kwargs['dry_run'] (bool) only print the plugins that would be
+        removed
     """
     vimpckrc = utils.ConfigFile()
-    plugls = utils.DiskPlugin(vimpckrc.pack_path)
+    plugls = utils.DiskPlugin(vimpckrc.pack_path, kwargs.get('rescan', False))
 
-    diff = set(vimpckrc.rem_urls).symmetric_difference(set(plugls.all_plug.values()))
+    diff = plan.Plan(vimpckrc.repos, plugls.all_plug).removes
 
+    if kwargs.get('dry_run'):
+        _print_plan(diff, "no plugins to be removed!")
+        return
     if not diff:
         sys.exit("no plugins to be removed!")
 
-    ansi_tran = ansi.Parser(const.LHS, const.RHS)
+    ansi_tran = _ansi_parser()
     title = "<bold>:: Removing {} plugin(s)...<reset>".format(len(diff))
     print(ansi_tran.sub(title))
-    for rem_url in diff:
-        plug = [k for k, v in plugls.all_plug.items() if v == rem_url][0]
-        info = "Removing {}".format(plug)
-        a_spinner = spinner.Spinner(info, const.INTERVAL,
-                                    const.SEQUENCE, const.OFFSET)
-        a_spinner.start()
-        try:
-            shutil.rmtree(os.path.join(vimpckrc.pack_path, plug))
-            pass
-        except:
-            status = "✗ {}: <red>Could not remove!<reset>".format(info)
-        else:
-            status = "Removed"
-            status = "✓ {}: <green>{}<reset>".format(info, status)
-        a_spinner.stop()
-        status = status.rjust(len(status) + const.OFFSET)
-        print(ansi_tran.sub(status))
-        del a_spinner
+    with _progress(len(diff)) as progress:
+        trash = _remove(vimpckrc, plugls.index, [action.path for action in diff],
+                        progress, ansi_tran)
+        plugls.index.save()
+    trash.empty_detached(max(_get_jobs(vimpckrc), const.TRASH_JOBS))
+    _merge(vimpckrc, plugls.index, kwargs.get('rescan', False))
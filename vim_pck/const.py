@@ -14,6 +14,50 @@ SECT_2 = "REPOSITORY"
 PKG_NAME = "package"
 TYPE_NAME = "type"
 FRZ_NAME = "freeze"
+JOBS_NAME = "jobs"
+DEPTH_NAME = "depth"
+FILTER_NAME = "filter"
+MIRROR_NAME = "mirror"
+MIRROR_CACHE_NAME = "mirror_cache"
+SUBMODULE_JOBS_NAME = "submodule_jobs"
+RETRIES_NAME = "retries"
+HELPTAGS_NAME = "helptags"
+MODE_NAME = "mode"
+MERGE_NAME = "merge"
+MERGE_PATH_NAME = "merge_path"
+# key = git operation, value = name of its timeout setting
+TIMEOUT_NAMES = {"clone": "clone_timeout",
+                 "pull": "pull_timeout",
+                 "query": "query_timeout"}
+
+# sidecar file of the plugins installed without git metadata, see
+# git.Snapshot
+SNAPSHOT_FILE = ".vimpck-snapshot"
+
+# package of the merge root and manifest of the links, see merge.Runtime
+MERGE_PACKAGE = "vimpck"
+MERGE_MANIFEST = "vimpck-merge.json"
+
+# type directories of a package, see :help packages
+PLUG_TYPES = ("start", "opt")
+
+# minimum number of concurrent git ls-remote during the upgrade pre-check
+PRECHECK_JOBS = 16
+
+# delay before the first retry of a git command that failed on a transient
+# error and maximum delay between two attempts, in seconds
+RETRY_DELAY = 1.0
+RETRY_MAX_DELAY = 30.0
+
+# seconds given to a git command to exit after a timeout or an interruption
+# before it is killed
+KILL_DELAY = 2.0
+
+# number of plugins measured at the same time by vimpck stats
+STATS_JOBS = 16
+
+# minimum number of directories of the trash deleted at the same time
+TRASH_JOBS = 8
 
 # spinner.py constant
 INTERVAL = 0.10
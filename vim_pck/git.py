@@ -4,9 +4,35 @@
    command 'Clone', 'Pull',... using polymorphism principle of oop paradigm
 """
 
+import hashlib
+import json
+import random
+import shutil
+import signal
 import subprocess
 import re
 import os
+import time
+
+from vim_pck import const
+from vim_pck import trace
+
+# stderr of the failures worth retrying: name resolution, connection and
+# TLS errors, dropped transfers and temporary server errors
+TRANSIENT_ERRORS = re.compile(
+    r"Could not resolve host|Temporary failure in name resolution"
+    r"|Connection (timed out|reset|refused)|Operation timed out"
+    r"|Failed to connect|early EOF|unexpected disconnect"
+    r"|remote end hung up unexpectedly|RPC failed|gnutls_handshake"
+    r"|SSL_ERROR|TLS connection|returned error: (408|429|5[0-9][0-9])"
+    r"|was not closed cleanly", re.IGNORECASE)
+
+# stderr of the failures that another attempt would not fix, they take
+# precedence over TRANSIENT_ERRORS
+PERMANENT_ERRORS = re.compile(
+    r"not found|does not exist|Authentication failed|Permission denied"
+    r"|could not read (Username|Password)|terminal prompts disabled"
+    r"|not a git repository|already exists", re.IGNORECASE)
 
 
 def humanish(remote_url):
@@ -26,6 +52,45 @@ def humanish(remote_url):
     return result
 
 
+def canonical_url(remote_url):
+    """Get the canonical form of a remote url, used to identify the remote
+    repositories that are the same
+
+    ex: https://github.com/tpope/vim-commentary.git/ ->
+    https://github.com/tpope/vim-commentary
+    """
+
+    result = remote_url.strip().rstrip("/")
+    if result.endswith(".git"):
+        result = result[:-len(".git")]
+    return result
+
+
+def repo_id(remote_url):
+    """Get a file name identifying a remote url
+
+    The name is made of the humanish part and of a hash of the canonical url,
+    ex: vim-commentary-<sha1[:12]>
+    """
+
+    url = canonical_url(remote_url)
+    digest = hashlib.sha1(url.encode('UTF-8')).hexdigest()[:12]
+    return "{}-{}".format(humanish(url), digest)
+
+
+def mirror_dir(remote_url, mirrors_path):
+    """Get the path of the bare mirror repository of a remote url
+
+    ex: <mirrors_path>/vim-commentary-<sha1[:12]>.git
+
+    Arguments:
+            - remote_url (str)
+            - mirrors_path (str): directory of the mirror cache
+    """
+
+    return os.path.join(mirrors_path, repo_id(remote_url) + ".git")
+
+
 def parse_gitmodule(path):
     """Parse the .gitmodules file and return the relative path of submodule
 
@@ -47,11 +112,530 @@ def parse_gitmodule(path):
     return rel_path_subm
 
 
-def ex_subprocess(cmd):
+def git_dir(local_dir):
+    """Get the git directory of a local repository without spawning git
+
+    Follow the ``gitdir: <path>`` file used by submodules and worktrees.
+
+    Arguments:
+            - local_dir (str): root directory of the local repository
+
+    return:
+            path (str): the git directory, None if local_dir is not a git
+            repository
+    """
+
+    dot_git = os.path.join(local_dir, ".git")
+    if os.path.isdir(dot_git):
+        return dot_git
+    if not os.path.isfile(dot_git):
+        return None
+    with open(dot_git) as f:
+        content = f.readline().strip()
+    if not content.startswith("gitdir:"):
+        raise ValueError("invalid gitfile format: {}".format(dot_git))
+    return os.path.normpath(os.path.join(local_dir,
+                                         content[len("gitdir:"):].strip()))
+
+
+def common_dir(gitdir):
+    """Get the directory shared by all the worktrees of a git directory
+
+    The config, packed-refs and branches of a linked worktree are stored in
+    the directory pointed by its ``commondir`` file.
+    """
+
+    try:
+        with open(os.path.join(gitdir, "commondir")) as f:
+            path = f.readline().strip()
+    except FileNotFoundError:
+        return gitdir
+    return os.path.normpath(os.path.join(gitdir, path))
+
+
+def _parse_config_escape(line, i, lines):
+    """Parse a backslash in the value of a git config variable
+
+    Arguments:
+            - line (str), i (int): the line and the position of the backslash
+            - lines (iterator(str)): see _parse_config_value
+
+    return:
+            (line, i, char) (3-uple): the line and the position to go on
+            with, char = the escaped character, None for a line continuation
+    """
+
+    escapes = {'n': '\n', 't': '\t', 'b': '\b', '"': '"', '\\': '\\'}
+    if i + 1 >= len(line):
+        # line continuation
+        line = next(lines, None)
+        if line is None:
+            raise ValueError("line continuation at end of file")
+        return line.rstrip('\n'), 0, None
+    if line[i + 1] not in escapes:
+        raise ValueError("invalid escape sequence in config value")
+    return line, i + 2, escapes[line[i + 1]]
+
+
+def _parse_config_value(line, lines):
+    """Parse the value part of a git config variable
+
+    Handle double quotes, escape sequences, comments and line continuation.
+
+    Arguments:
+            - line (str): remainder of the line after the '=' sign
+            - lines (iterator(str)): following lines of the file, consumed
+              when the value continues on the next line
+
+    return:
+            value (str)
+    """
+
+    value = []
+    pending_space = ''
+    quoted = False
+    i = 0
+    line = line.rstrip('\n').lstrip()
+    while i < len(line):
+        char = line[i]
+        if char == '\\':
+            line, i, char = _parse_config_escape(line, i, lines)
+            if char is not None:
+                value.append(pending_space + char)
+                pending_space = ''
+            continue
+        if char == '"':
+            quoted = not quoted
+        elif not quoted and char in ';#':
+            return ''.join(value)
+        elif not quoted and char.isspace():
+            pending_space += char if value else ''
+        else:
+            value.append(pending_space + char)
+            pending_space = ''
+        i += 1
+    if quoted:
+        raise ValueError("unterminated quoted value")
+    return ''.join(value)
+
+
+def _parse_config_header(line, header):
+    """Parse the section header of a git config file
+
+    ``[includeIf]`` sections are not supported and raise a ValueError.
+
+    Arguments:
+            - line (str): a line that starts with '['
+            - header (re.Pattern): see read_config
+
+    return:
+            (section, line) (2-uple): section = <section>[.<subsection>],
+            line = remainder of the line after the header
+    """
+
+    match = header.match(line)
+    if not match:
+        raise ValueError("invalid section header: {}".format(line))
+    name, subsection = match.groups()
+    if subsection is None:
+        # deprecated [section.subsection] syntax
+        section = name.lower()
+    else:
+        section = "{}.{}".format(name.lower(),
+                                 re.sub(r'\\(.)', r'\1', subsection))
+    if section.startswith("includeif."):
+        raise ValueError("includeIf is not supported")
+    return section, line[match.end():].strip()
+
+
+def _read_include(conf_path, path, depth):
+    """Read the config file of an ``include.path`` variable, relative to
+    the config file that includes it. A missing file is ignored.
+    """
+
+    path = os.path.join(os.path.dirname(conf_path), os.path.expanduser(path))
+    if not os.path.isfile(path):
+        return {}
+    return read_config(path, depth + 1)
+
+
+def read_config(conf_path, _depth=0):
+    """Read a git config file without spawning git
+
+    ``[include]`` path are followed, ``[includeIf]`` are not supported and
+    raise a ValueError so that the caller can fall back to ``git config``.
+
+    Arguments:
+            - conf_path (str): path of the config file
+
+    return:
+            config (dict): key = <section>[.<subsection>].<name> where the
+            section and the name are lowercased, value = last value found
+    """
+
+    if _depth > 10:
+        raise ValueError("too many nested include in {}".format(conf_path))
+
+    config = {}
+    section = None
+    header = re.compile(r'\[\s*([A-Za-z0-9.-]+)(?:\s+"((?:[^"\\]|\\.)*)")?\s*\]')
+    variable = re.compile(r'([A-Za-z][A-Za-z0-9-]*)\s*(=?)(.*)', re.DOTALL)
+    with open(conf_path, encoding='UTF-8') as f:
+        lines = iter(f.readlines())
+    for line in lines:
+        line = line.strip()
+        if line[:1] == '[':
+            section, line = _parse_config_header(line, header)
+        if not line or line[0] in ';#':
+            continue
+        if section is None:
+            raise ValueError("variable outside of a section: {}".format(line))
+        match = variable.match(line)
+        if not match:
+            raise ValueError("invalid variable: {}".format(line))
+        name, equal, rest = match.groups()
+        value = _parse_config_value(rest, lines) if equal else 'true'
+        key = "{}.{}".format(section, name.lower())
+        if key == "include.path":
+            config.update(_read_include(conf_path, value, _depth))
+        else:
+            config[key] = value
+    return config
+
+
+def get_config(local_dir, key):
+    """In-process equivalent of ``git -C <local_dir> config --get <key>``
+
+    Only the repository config file is read.
+
+    Arguments:
+            - local_dir (str): root directory of the local repository
+            - key (str): ex, remote.origin.url
+
+    return:
+            value (str): None when the key is not set or local_dir is not a
+            git repository. A ValueError is raised if the config can not be
+            parsed.
+    """
+
+    gitdir = git_dir(local_dir)
+    if gitdir is None:
+        return None
+    conf_path = os.path.join(common_dir(gitdir), "config")
+    if not os.path.isfile(conf_path):
+        return None
+    section, _, name = key.rpartition('.')
+    head, dot, subsection = section.partition('.')
+    key = "{}{}{}.{}".format(head.lower(), dot, subsection, name.lower())
+    return read_config(conf_path).get(key)
+
+
+def resolve_ref(gitdir, ref):
+    """Resolve a reference to a commit hash without spawning git
+
+    Symbolic references are followed. Pseudo references and per-worktree
+    references are looked up in gitdir, the other ones in the common
+    directory, first as loose references then in packed-refs.
+
+    Arguments:
+            - gitdir (str): git directory of the repository
+            - ref (str): ex, HEAD, refs/heads/master
+
+    return:
+            sha (str): None if the reference does not exist. A ValueError is
+            raised when the references use an unsupported format.
+    """
+
+    commondir = common_dir(gitdir)
+    if os.path.isdir(os.path.join(commondir, "reftable")):
+        raise ValueError("reftable format is not supported")
+    sha_regex = re.compile(r"^[0-9a-f]{40}([0-9a-f]{24})?$")
+    for _ in range(10):
+        if "/" not in ref or ref.startswith(("refs/worktree/", "refs/bisect/")):
+            ref_dir = gitdir
+        else:
+            ref_dir = commondir
+        try:
+            with open(os.path.join(ref_dir, ref)) as f:
+                content = f.readline().strip()
+        except (FileNotFoundError, IsADirectoryError, NotADirectoryError):
+            content = _packed_ref(commondir, ref)
+            if content is None:
+                return None
+        if content.startswith("ref:"):
+            ref = content[len("ref:"):].strip()
+        elif sha_regex.match(content):
+            return content
+        else:
+            raise ValueError("invalid reference {}: {}".format(ref, content))
+    raise ValueError("too many levels of symbolic references")
+
+
+def _packed_ref(commondir, ref):
+    """Look up a reference in the packed-refs file"""
+
+    try:
+        with open(os.path.join(commondir, "packed-refs")) as f:
+            for line in f:
+                if line.startswith(("#", "^")):
+                    continue
+                sha, _, name = line.rstrip("\n").partition(" ")
+                if name == ref:
+                    return sha
+    except FileNotFoundError:
+        pass
+    return None
+
+
+def read_head(local_dir):
+    """In-process equivalent of ``git -C <local_dir> rev-list -1 HEAD``
+
+    return:
+            sha (str): None if local_dir is not a git repository or HEAD can
+            not be resolved
+    """
+
+    gitdir = git_dir(local_dir)
+    if gitdir is None:
+        return None
+    return resolve_ref(gitdir, "HEAD")
+
+
+def submodule_heads(local_dir):
+    """Get the hash of HEAD of the submodules listed in .gitmodules without
+    spawning git
+
+    return:
+            heads (dict): key = path of the submodule relative to local_dir,
+            value = hash of HEAD, None when the submodule is not checked out
+    """
+
+    heads = {}
+    for sub_dir in parse_gitmodule(local_dir):
+        try:
+            head = read_head(sub_dir)
+        except (OSError, ValueError):
+            head = None
+        heads[os.path.relpath(sub_dir, local_dir)] = head
+    return heads
+
+
+def read_snapshot(local_dir):
+    """Get the sidecar file of a plugin installed without git metadata, see
+    Snapshot
+
+    return:
+            snapshot (dict): remote url ('url'), hash of the materialised
+            commit ('commit'), its branch ('branch', None when HEAD was
+            detached) and the hash of the commit of each submodule
+            ('submodules'). None when local_dir is not a snapshot
+    """
+
+    try:
+        with open(os.path.join(local_dir, const.SNAPSHOT_FILE)) as f:
+            snapshot = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(snapshot, dict) or not snapshot.get('url') or not snapshot.get('commit'):
+        return None
+    return snapshot
+
+
+def submodule_options(jobs=1):
+    """Get the git submodule update options that clone or fetch jobs
+    submodules at the same time
+    """
+
+    if jobs > 1:
+        return ["--jobs", str(jobs)]
+    return []
+
+
+def clone_options(depth=0, filter_spec=""):
+    """Get the git clone/submodule update options of a shallow or partial
+    clone
+
+    Arguments:
+            - depth (int): history depth, 0 for the complete history
+            - filter_spec (str): partial clone filter, ex: blob:none
+
+    return:
+            options (list(str))
+    """
+
+    options = []
+    if depth:
+        options += ["--depth", str(depth)]
+    if filter_spec:
+        options.append("--filter={}".format(filter_spec))
+    return options
+
+
+def head_branch(local_dir):
+    """Get the name of the checked out branch without spawning git
+
+    return:
+            branch (str): ex, master, None when HEAD is detached or local_dir
+            is not a git repository
+    """
+
+    gitdir = git_dir(local_dir)
+    if gitdir is None:
+        return None
+    with open(os.path.join(gitdir, "HEAD")) as f:
+        content = f.readline().strip()
+    if not content.startswith("ref: refs/heads/"):
+        return None
+    return content[len("ref: refs/heads/"):]
+
+
+def upstream(local_dir):
+    """Get the upstream of the checked out branch without spawning git
+
+    return:
+            (remote, merge_ref, tracking_ref) (3-uple): ex, ('origin',
+            'refs/heads/master', 'refs/remotes/origin/master'), None when HEAD
+            is detached or the branch does not track a remote branch
+    """
+
+    branch = head_branch(local_dir)
+    if branch is None:
+        return None
+    remote = get_config(local_dir, "branch.{}.remote".format(branch))
+    merge_ref = get_config(local_dir, "branch.{}.merge".format(branch))
+    if not remote or remote == "." or not merge_ref or not merge_ref.startswith("refs/heads/"):
+        return None
+    tracking_ref = "refs/remotes/{}/{}".format(remote, merge_ref[len("refs/heads/"):])
+    return remote, merge_ref, tracking_ref
+
+
+def url_options(url_map):
+    """Get the git options that fetch remote urls from other locations, ex:
+    from git bundles, while the remote urls are kept in the configuration
+
+    git only rewrites urls, i.e. not the paths of local repositories.
+
+    Arguments:
+            - url_map (dict): key = remote url, value = location to fetch
+              from
+
+    return:
+            options (list(str)): to put before the git command
+    """
+
+    options = []
+    if url_map:
+        # the locations are local files, that git does not allow to clone
+        # submodules from by default
+        options += ["-c", "protocol.file.allow=always"]
+    for remote_url, location in sorted((url_map or {}).items()):
+        options += ["-c", "url.{}.insteadOf={}".format(location, remote_url)]
+    return options
+
+
+def git_env():
+    """Get the environment of the git processes
+
+    git must fail instead of prompting for credentials: the processes are
+    detached from the terminal and nobody would answer.
+    """
+
+    return dict(os.environ, GIT_TERMINAL_PROMPT="0")
+
+
+def is_transient(stderr):
+    """Check if a git command failed on an error worth retrying
+
+    Arguments:
+            - stderr (bytes): stderr of the failed command
+    """
+
+    stderr = stderr.decode('UTF-8', 'replace')
+    return (TRANSIENT_ERRORS.search(stderr) is not None
+            and PERMANENT_ERRORS.search(stderr) is None)
+
+
+def backoff(attempt):
+    """Get the delay before the next attempt of a command, in seconds
+
+    The delay doubles after each attempt, up to const.RETRY_MAX_DELAY, and
+    is drawn at random in its upper half so that the commands failing
+    together do not retry together.
+    """
+
+    delay = min(const.RETRY_MAX_DELAY, const.RETRY_DELAY * 2 ** attempt)
+    return random.uniform(delay / 2, delay)
+
+
+def _signal_group(proc, sig):
+    """Send a signal to the process group of a subprocess started in a new
+    session
+    """
+
+    try:
+        os.killpg(proc.pid, sig)
+    except OSError:
+        # already exited
+        pass
+
+
+def _terminate(proc):
+    """Terminate a subprocess and its children, they are killed when they
+    outlive const.KILL_DELAY
+    """
+
+    _signal_group(proc, signal.SIGTERM)
+    try:
+        proc.wait(const.KILL_DELAY)
+    except subprocess.TimeoutExpired:
+        pass
+    _signal_group(proc, signal.SIGKILL)
+    proc.wait()
+
+
+async def _terminate_async(proc):
+    """asyncio equivalent of _terminate"""
+
+    import asyncio
+
+    _signal_group(proc, signal.SIGTERM)
+    try:
+        await asyncio.wait_for(proc.wait(), const.KILL_DELAY)
+    except asyncio.TimeoutError:
+        pass
+    _signal_group(proc, signal.SIGKILL)
+    await proc.wait()
+
+
+def _timeout_error(cmd, timeout, stdout, stderr):
+    """Get the error of a command that was terminated after timeout
+    seconds
+    """
+
+    stderr = (stderr or b"") + "vimpck: git timed out after {}s\n".format(
+        timeout).encode('UTF-8')
+    return subprocess.TimeoutExpired(cmd, timeout, stdout, stderr)
+
+
+def _launch_error(cmd, err):
+    """Get the CalledProcessError of a command that could not be started,
+    ex: git is not installed or too many files are open
+    """
+
+    stderr = "vimpck: could not run {}: {}\n".format(cmd[0], err.strerror or err)
+    return subprocess.CalledProcessError(127, cmd, b"", stderr.encode('UTF-8'))
+
+
+def ex_subprocess(cmd, timeout=None):
     """subprocess wrapper function
 
+    The subprocess is started in a new session. When it outlives timeout or
+    when vimpck is interrupted, the subprocess and its children, ex: git
+    remote-https or ssh, are terminated.
+
     Arguments:
             - cmd (list(str)): the command to feed the subprocess
+            - timeout (float): seconds, None to wait forever
 
     Return:
         (out, compl_proc, error_proc) (3-uple):
@@ -59,27 +643,104 @@ def ex_subprocess(cmd):
             - compl_proc (subprocess.CompletedProcess instance): return value
               of the subprocess when it has succeeded
             - error_proc (subprocess.CalledProcessError instance): value of the
-              subprocess when an Exception has occured
+              subprocess when an Exception has occured, also when it could
+              not be started, subprocess.TimeoutExpired instance when it
+              timed out
     """
 
     out = 1
     compl_proc = None
     error_proc = None
 
+    start = time.perf_counter()
+    try:
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE, env=git_env(),
+                                start_new_session=True)
+    except OSError as err:
+        error_proc = _launch_error(cmd, err)
+        trace.command(cmd, start, (out, compl_proc, error_proc))
+        return out, compl_proc, error_proc
     try:
-        compl_proc = subprocess.run(cmd, stdout=subprocess.PIPE,
-                                    stderr=subprocess.PIPE, check=True)
-    except subprocess.CalledProcessError as error:
-        error_proc = error
+        stdout, stderr = proc.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        _terminate(proc)
+        stdout, stderr = proc.communicate()
+        error_proc = _timeout_error(cmd, timeout, stdout, stderr)
+    except BaseException:
+        _terminate(proc)
+        raise
     else:
-        out = 0
-    finally:
+        if proc.returncode:
+            error_proc = subprocess.CalledProcessError(proc.returncode, cmd,
+                                                       stdout, stderr)
+        else:
+            compl_proc = subprocess.CompletedProcess(cmd, proc.returncode,
+                                                     stdout, stderr)
+            out = 0
+    trace.command(cmd, start, (out, compl_proc, error_proc))
+    return out, compl_proc, error_proc
+
+
+async def ex_subprocess_async(cmd, timeout=None):
+    """asyncio equivalent of ex_subprocess
+
+    The subprocess is also terminated when the task is cancelled.
+
+    Arguments:
+            - cmd (list(str)): the command to feed the subprocess
+            - timeout (float): seconds, None to wait forever
+
+    Return:
+        (out, compl_proc, error_proc) (3-uple): same as ex_subprocess
+    """
+
+    # asyncio is slow to import, only commands that spawn jobs pay for it
+    import asyncio
+
+    out = 1
+    compl_proc = None
+    error_proc = None
+
+    start = time.perf_counter()
+    try:
+        proc = await asyncio.create_subprocess_exec(*cmd,
+                                                    stdout=subprocess.PIPE,
+                                                    stderr=subprocess.PIPE,
+                                                    env=git_env(),
+                                                    start_new_session=True)
+    except OSError as err:
+        error_proc = _launch_error(cmd, err)
+        trace.command(cmd, start, (out, compl_proc, error_proc))
         return out, compl_proc, error_proc
+    try:
+        stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout)
+    except asyncio.TimeoutError:
+        await _terminate_async(proc)
+        error_proc = _timeout_error(cmd, timeout, None, None)
+    except BaseException:
+        await _terminate_async(proc)
+        raise
+    else:
+        if proc.returncode:
+            error_proc = subprocess.CalledProcessError(proc.returncode, cmd,
+                                                       stdout, stderr)
+        else:
+            compl_proc = subprocess.CompletedProcess(cmd, proc.returncode,
+                                                     stdout, stderr)
+            out = 0
+    trace.command(cmd, start, (out, compl_proc, error_proc))
+    return out, compl_proc, error_proc
 
 
 class Git:
     """The base Git class
 
+    The commands that access a remote are bounded by the timeout of their
+    operation and are launched again, up to retries times, when they fail
+    on a transient error, see is_transient. A command that timed out is not
+    launched again: it already used its share of the run.
+
     Attributs:
         - remote_url (str):  ex, https://github.com/nicodebo/vimpck
         - local_dir (str): local root directory of the copy of the remote
@@ -88,17 +749,81 @@ class Git:
           of the subprocess when it has succeeded
         - error_proc (subprocess.CalledProcessError instance): value of the
           subprocess when an Exception has occured
+        - operation (str): clone, pull or query for the commands that access
+          a remote, None for the local commands
+        - timeouts (dict): key = operation, value = timeout in seconds, see
+          configure
+        - retries (int): number of attempts after the first one
     """
 
+    operation = None
+    timeouts = {}
+    retries = 0
+
     def __init__(self, local_dir):
         self.local_dir = local_dir
         self.error_proc = None
         self.compl_proc = None
 
-    def git_cmd(self):
-        """Polymorph method that implement different git command"""
+    @classmethod
+    def configure(cls, timeouts, retries):
+        """Set the timeouts and the number of retries of every command
+
+        Arguments:
+                - timeouts (dict): key = operation, value = timeout in
+                  seconds, None or 0 to wait forever
+                - retries (int)
+        """
+
+        Git.timeouts = dict(timeouts)
+        Git.retries = retries
+
+    def command(self):
+        """Polymorph method that return the different git command"""
         raise NotImplementedError("Git command method not defined")
 
+    def _timeout(self):
+        return self.timeouts.get(self.operation) or None
+
+    def _can_retry(self, out, attempt):
+        """Check if the command has to be launched again after a failure"""
+
+        return (out != 0 and self.operation is not None
+                and attempt < self.retries
+                and isinstance(self.error_proc, subprocess.CalledProcessError)
+                and is_transient(self.error_proc.stderr or b""))
+
+    def _retry_cleanup(self):
+        """Remove what a failed attempt left behind, before the next one"""
+
+    def git_cmd(self):
+        """launch the git command"""
+
+        attempt = 0
+        while True:
+            out, self.compl_proc, self.error_proc = ex_subprocess(
+                self.command(), self._timeout())
+            if not self._can_retry(out, attempt):
+                return out
+            self._retry_cleanup()
+            time.sleep(backoff(attempt))
+            attempt += 1
+
+    async def git_cmd_async(self):
+        """launch the git command from an asyncio event loop"""
+
+        import asyncio
+
+        attempt = 0
+        while True:
+            out, self.compl_proc, self.error_proc = await ex_subprocess_async(
+                self.command(), self._timeout())
+            if not self._can_retry(out, attempt):
+                return out
+            self._retry_cleanup()
+            await asyncio.sleep(backoff(attempt))
+            attempt += 1
+
     def retrieve_stdout(self):
         """Get the stdout from a completed process instance
 
@@ -109,6 +834,30 @@ class Git:
 
         return self.compl_proc.stdout.decode('UTF-8').rstrip()
 
+    def _has_submodule(self, out):
+        """Check if the submodule command has to be launched after a
+        successful command
+        """
+
+        git_mod_path = os.path.join(self.local_dir, ".gitmodules")
+        return os.path.isfile(git_mod_path) & (out == 0)
+
+    def _submodule_result(self, out):
+        """Report the result of the submodule command as the result of the
+        current command
+        """
+
+        return self._chained_result(self.cmd_sub[0], out)
+
+    def _chained_result(self, git_inst, out):
+        """Report the result of a command launched after the current one as
+        the result of the current command
+        """
+
+        self.compl_proc = git_inst.compl_proc
+        self.error_proc = git_inst.error_proc
+        return out
+
 
 class Clone(Git):
     """git clone command
@@ -117,36 +866,477 @@ class Clone(Git):
 
     Attributs:
             - root_dir (str): directory to clone into
+            - depth (int): history depth of the clone and of its submodules,
+              0 for the complete history
+            - filter_spec (str): partial clone filter, ex: blob:none, empty
+              for a complete clone
+            - reference (str): local repository, ex: a mirror, whose objects
+              are borrowed instead of being downloaded. Ignored if it does not
+              exist
+            - dissociate (bool): copy the borrowed objects instead of
+              referencing the repository through objects/info/alternates
+            - url_map (dict): remote urls of the plugin and of its
+              submodules fetched from other locations, see url_options. The
+              plugin is cloned from its location then its remote url is set
+              back to remote_url
+            - submodule_jobs (int): number of submodules cloned at the same
+              time
     """
 
-    def __init__(self, remote_url, root_dir):
+    operation = "clone"
+
+    def __init__(self, remote_url, root_dir, depth=0, filter_spec="",
+                 reference=None, dissociate=False, url_map=None, submodule_jobs=1):
         tmp_path = os.path.join(root_dir, humanish(remote_url))
         super().__init__(tmp_path)
         self.remote_url = remote_url
-        self.cmd_sub = [InitSubmodule(tmp_path)]  # object container
+        self.depth = depth
+        self.filter_spec = filter_spec
+        self.reference = reference
+        self.dissociate = dissociate
+        self.url_map = url_map
+        self.source = (url_map or {}).get(remote_url, remote_url)
+        self.cmd_sub = [InitSubmodule(tmp_path, depth, filter_spec, url_map,
+                                      submodule_jobs)]  # object container
+        self.cmd_remote = None
+        if self.source != remote_url:
+            self.cmd_remote = SetRemoteUrl(tmp_path, remote_url)
         self.root_dir = root_dir
 
+    def command(self):
+        cmd = ["git", "clone"] + clone_options(self.depth, self.filter_spec)
+        if (self.depth or self.filter_spec) and os.path.isdir(self.source):
+            # depth and filter are ignored by the local clone optimization
+            cmd.append("--no-local")
+        if self.reference:
+            cmd += ["--reference-if-able", self.reference]
+            if self.dissociate:
+                cmd.append("--dissociate")
+        return cmd + [self.source, self.local_dir]
+
+    def _retry_cleanup(self):
+        """Remove the directory of an interrupted clone"""
+
+        shutil.rmtree(self.local_dir, ignore_errors=True)
+
     def git_cmd(self):
         """launch git clone command"""
 
-        cmd = ["git", "clone", self.remote_url, self.local_dir]
-        out, self.compl_proc, self.error_proc = ex_subprocess(cmd)
+        out = super().git_cmd()
+        if out == 0 and self.cmd_remote is not None:
+            out = self._chained_result(self.cmd_remote, self.cmd_remote.git_cmd())
+        if self._has_submodule(out):
+            out = self._submodule_result(self.cmd_sub[0].git_cmd())
+        return out
 
-        git_mod_path = os.path.join(self.local_dir, ".gitmodules")
+    async def git_cmd_async(self):
+        """launch git clone command from an asyncio event loop"""
 
-        if os.path.isfile(git_mod_path) & (out == 0):
-            out = self.cmd_sub[0].git_cmd()
-            self.compl_proc = self.cmd_sub[0].compl_proc
-            self.error_proc = self.cmd_sub[0].error_proc
+        out = await super().git_cmd_async()
+        if out == 0 and self.cmd_remote is not None:
+            out = self._chained_result(self.cmd_remote,
+                                       await self.cmd_remote.git_cmd_async())
+        if self._has_submodule(out):
+            out = self._submodule_result(await self.cmd_sub[0].git_cmd_async())
         return out
 
 
+class LockedClone(Git):
+    """git init + git fetch <commit> + git checkout
+
+    Install the commit recorded in the lockfile. Only this commit is fetched
+    when the server allows it, otherwise the branches are fetched. The branch
+    is then reset to the commit and tracks the remote branch, so that the
+    plugin can be upgraded as if it had been cloned.
+
+    As git clone, it refuses to install in a directory that exists and is not
+    empty. A failed install only removes what it created.
+
+    Attributs:
+            - commit (str): hash of the commit to check out
+            - branch (str): branch to check out, None to detach HEAD
+            - depth (int): history depth, 1 when not set
+            - filter_spec (str): partial clone filter
+            - cmd_sub (list(Git instance)): commands launched one after the
+              other after git init
+            - created (bool): local_dir did not exist before git init
+    """
+
+    def __init__(self, remote_url, root_dir, commit, branch=None, depth=0,
+                 filter_spec="", submodule_jobs=1):
+        tmp_path = os.path.join(root_dir, humanish(remote_url))
+        super().__init__(tmp_path)
+        self.remote_url = remote_url
+        self.root_dir = root_dir
+        self.commit = commit
+        self.branch = branch
+        self.depth = depth or 1
+        self.filter_spec = filter_spec
+        self.created = False
+        refspec = commit
+        if branch is not None:
+            refspec = "{}:refs/remotes/origin/{}".format(commit, branch)
+        self.cmd_fetch = [Fetch(tmp_path, "origin", [refspec], self.depth, filter_spec),
+                          # the server does not allow to fetch a commit
+                          Fetch(tmp_path, "origin", [], depth, filter_spec)]
+        self.cmd_sub = [RemoteAdd(tmp_path, "origin", remote_url),
+                        self.cmd_fetch,
+                        Checkout(tmp_path, commit, branch)]  # object container
+        if branch is not None:
+            self.cmd_sub.append(SetUpstream(tmp_path, "origin", branch))
+        self.cmd_sub.append(InitSubmodule(tmp_path, depth, filter_spec,
+                                          jobs=submodule_jobs))
+
+    def command(self):
+        return ["git", "init", "-q", self.local_dir]
+
+    def _steps(self):
+        """Get the commands launched after git init, a list of commands is
+        a command with its fallbacks
+        """
+
+        for cmd in self.cmd_sub:
+            if isinstance(cmd, InitSubmodule) and not os.path.isfile(
+                    os.path.join(self.local_dir, ".gitmodules")):
+                continue
+            yield cmd if isinstance(cmd, list) else [cmd]
+
+    def _check_target(self):
+        """Check that local_dir does not exist or is an empty directory
+
+        return:
+                out (int): 0 when the plugin can be installed in local_dir
+        """
+
+        try:
+            entries = os.listdir(self.local_dir)
+        except FileNotFoundError:
+            self.created = True
+            return 0
+        except OSError:
+            entries = None
+        self.created = False
+        if entries == []:
+            return 0
+        self.compl_proc = None
+        self.error_proc = subprocess.CalledProcessError(
+            128, self.command(), b"",
+            "fatal: destination path '{}' already exists and is not an empty "
+            "directory.\n".format(self.local_dir).encode('UTF-8'))
+        return 128
+
+    def _cleanup(self, out):
+        """Remove a partially installed plugin, an empty directory that
+        existed before is emptied again
+        """
+
+        if out != 0:
+            shutil.rmtree(self.local_dir, ignore_errors=True)
+            if not self.created:
+                try:
+                    os.makedirs(self.local_dir, exist_ok=True)
+                except OSError:
+                    pass
+        return out
+
+    def git_cmd(self):
+        """launch git init, fetch and checkout"""
+
+        if self._check_target() != 0:
+            return 128
+        out = super().git_cmd()
+        for step in self._steps():
+            if out != 0:
+                break
+            for cmd in step:
+                out = self._chained_result(cmd, cmd.git_cmd())
+                if out == 0:
+                    break
+        return self._cleanup(out)
+
+    async def git_cmd_async(self):
+        """launch git init, fetch and checkout from an asyncio event loop"""
+
+        if self._check_target() != 0:
+            return 128
+        out = await super().git_cmd_async()
+        for step in self._steps():
+            if out != 0:
+                break
+            for cmd in step:
+                out = self._chained_result(cmd, await cmd.git_cmd_async())
+                if out == 0:
+                    break
+        return self._cleanup(out)
+
+
+class Mirror(Git):
+    """git clone --mirror / git fetch --prune
+
+    Create or refresh the bare mirror of a remote repository. A new mirror is
+    cloned in a temporary directory then moved in place, so that a mirror
+    that exists is always complete.
+
+    Attributs:
+            - remote_url (str)
+            - tmp_dir (str): directory a new mirror is cloned into
+    """
+
+    operation = "clone"
+
+    def __init__(self, remote_url, local_dir):
+        super().__init__(local_dir)
+        self.remote_url = remote_url
+        self.tmp_dir = "{}.tmp-{}".format(local_dir, os.getpid())
+
+    def command(self):
+        if os.path.isdir(self.local_dir):
+            return ["git", "--git-dir", self.local_dir, "fetch", "--prune",
+                    "--quiet", "origin"]
+        return ["git", "clone", "--mirror", "--quiet", self.remote_url,
+                self.tmp_dir]
+
+    def _publish(self, out):
+        """Move a newly cloned mirror in place"""
+
+        if os.path.isdir(self.tmp_dir):
+            try:
+                if out == 0:
+                    os.rename(self.tmp_dir, self.local_dir)
+            except OSError:
+                # created at the same time by another vimpck process
+                pass
+            shutil.rmtree(self.tmp_dir, ignore_errors=True)
+        return out
+
+    def _retry_cleanup(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def git_cmd(self):
+        """launch git clone --mirror or git fetch"""
+
+        os.makedirs(os.path.dirname(self.local_dir), exist_ok=True)
+        return self._publish(super().git_cmd())
+
+    async def git_cmd_async(self):
+        """launch git clone --mirror or git fetch from an asyncio event loop"""
+
+        os.makedirs(os.path.dirname(self.local_dir), exist_ok=True)
+        return self._publish(await super().git_cmd_async())
+
+
+class Snapshot(Git):
+    """git clone --depth 1, then the git metadata is removed
+
+    Materialise the tree of a plugin, submodules included, without any .git.
+    The plugin is cloned in a staging directory next to local_dir, the .git
+    of the plugin and of its submodules are removed and the remote url and
+    the commits are recorded in the const.SNAPSHOT_FILE sidecar file, see
+    read_snapshot. The staging directory then replaces local_dir, so that a
+    snapshot that exists is always complete.
+
+    As git clone, it refuses to install in a directory that exists and is not
+    empty. When replace is set, only a snapshot of the same remote url is
+    replaced.
+
+    Attributs:
+            - remote_url (str)
+            - staging_dir (str): directory the plugin is cloned into
+            - replace (bool): replace an existing snapshot of remote_url
+            - cloner (Clone or LockedClone instance): the clone in
+              staging_dir, a LockedClone when commit is set
+            - submodules (dict): key = path of the submodule, value = hash of
+              its commit in the previous and in the new snapshot (2-uple),
+              only the submodules that changed
+    """
+
+    def __init__(self, remote_url, local_dir, commit=None, branch=None,
+                 filter_spec="", reference=None, url_map=None, submodule_jobs=1,
+                 replace=False):
+        super().__init__(local_dir)
+        self.remote_url = remote_url
+        self.replace = replace
+        self.staging_dir = os.path.join(os.path.dirname(local_dir), ".{}.tmp-{}".format(
+            os.path.basename(local_dir), os.getpid()))
+        if commit is None:
+            self.cloner = Clone(remote_url, self.staging_dir, 1, filter_spec, reference,
+                                url_map=url_map, submodule_jobs=submodule_jobs)
+        else:
+            self.cloner = LockedClone(remote_url, self.staging_dir, commit, branch, 1,
+                                      filter_spec, submodule_jobs)
+        self.submodules = {}
+
+    def command(self):
+        return self.cloner.command()
+
+    def _target_error(self):
+        """Check that local_dir can receive the snapshot
+
+        return:
+                error (str): why local_dir cannot be replaced, None when it
+                can
+        """
+
+        try:
+            entries = os.listdir(self.local_dir)
+        except FileNotFoundError:
+            return None
+        except OSError:
+            entries = None
+        if entries == []:
+            return None
+        if not self.replace:
+            return ("fatal: destination path '{}' already exists and is not an "
+                    "empty directory.".format(self.local_dir))
+        snapshot = read_snapshot(self.local_dir)
+        if snapshot is None or snapshot['url'] != self.remote_url:
+            return "fatal: '{}' is not a snapshot of {}".format(self.local_dir,
+                                                                self.remote_url)
+        return None
+
+    def _fail(self, message):
+        """Report a failure that is not the one of a git command"""
+
+        self.compl_proc = None
+        self.error_proc = subprocess.CalledProcessError(
+            1, self.command(), b"", "{}\n".format(message).encode('UTF-8'))
+        return 1
+
+    def _strip(self, local_dir):
+        """Remove the .git of a clone and of its submodules
+
+        return:
+                heads (dict): key = path of the submodule relative to the
+                clone, value = hash of its HEAD, recursively
+        """
+
+        heads = {}
+        if os.path.isfile(os.path.join(local_dir, ".gitmodules")):
+            # the submodules point to the .git of their parent
+            for sub_dir in parse_gitmodule(local_dir):
+                head = read_head(sub_dir)
+                if head is not None:
+                    heads[os.path.relpath(sub_dir, self.cloner.local_dir)] = head
+                    heads.update(self._strip(sub_dir))
+        dot_git = os.path.join(local_dir, ".git")
+        if os.path.isdir(dot_git) and not os.path.islink(dot_git):
+            shutil.rmtree(dot_git)
+        else:
+            os.remove(dot_git)
+        return heads
+
+    def _replace(self, clone_dir):
+        """Move the stripped clone to local_dir"""
+
+        if not os.path.lexists(self.local_dir):
+            os.rename(clone_dir, self.local_dir)
+            return
+        previous_dir = clone_dir + ".previous"
+        os.rename(self.local_dir, previous_dir)
+        try:
+            os.rename(clone_dir, self.local_dir)
+        except OSError:
+            os.rename(previous_dir, self.local_dir)
+            raise
+
+    def _publish(self, out):
+        """Strip the clone, write the sidecar file and move it in place"""
+
+        clone_dir = self.cloner.local_dir
+        # local_dir may have changed during the clone
+        error = self._target_error() if out == 0 else None
+        try:
+            if error is not None:
+                out = self._fail(error)
+            elif out == 0:
+                before = (read_snapshot(self.local_dir) or {}).get('submodules', {})
+                snapshot = {'url': self.remote_url, 'commit': read_head(clone_dir),
+                            'branch': head_branch(clone_dir)}
+                snapshot['submodules'] = self._strip(clone_dir)
+                with open(os.path.join(clone_dir, const.SNAPSHOT_FILE), 'w') as f:
+                    json.dump(snapshot, f, indent=2, sort_keys=True)
+                self._replace(clone_dir)
+                self.submodules = {path: (before.get(path), head)
+                                   for path, head in snapshot['submodules'].items()
+                                   if before.get(path) != head}
+        except (OSError, ValueError) as err:
+            out = self._fail(err)
+        shutil.rmtree(self.staging_dir, ignore_errors=True)
+        return out
+
+    def git_cmd(self):
+        """launch the clone and materialise the snapshot"""
+
+        error = self._target_error()
+        if error is not None:
+            return self._fail(error)
+        shutil.rmtree(self.staging_dir, ignore_errors=True)
+        return self._publish(self._chained_result(self.cloner, self.cloner.git_cmd()))
+
+    async def git_cmd_async(self):
+        """launch the clone and materialise the snapshot from an asyncio
+        event loop
+        """
+
+        error = self._target_error()
+        if error is not None:
+            return self._fail(error)
+        shutil.rmtree(self.staging_dir, ignore_errors=True)
+        return self._publish(self._chained_result(self.cloner,
+                                                  await self.cloner.git_cmd_async()))
+
+
 class Pull(Git):
-    """git pull"""
+    """git pull
 
-    def __init__(self, local_dir):
+    The submodules are only updated when the pull moved HEAD or changed
+    .gitmodules, or when a submodule is not checked out.
+
+    Attributs:
+            - submodules (dict): key = path of the submodule, value = hash of
+              its HEAD before and after the submodule update (2-uple), empty
+              when the submodules were not updated
+    """
+
+    operation = "pull"
+
+    def __init__(self, local_dir, submodule_jobs=1):
         super().__init__(local_dir)
-        self.cmd_sub = [UpdateSubmodule(local_dir)]  # object container
+        self.cmd_sub = [UpdateSubmodule(local_dir, submodule_jobs)]  # object container
+        self.submodules = {}
+
+    def command(self):
+        return ["git", "-C", self.local_dir, "pull"]
+
+    def _snapshot(self):
+        """Get what the submodule update depends on: HEAD and .gitmodules"""
+
+        try:
+            head = read_head(self.local_dir)
+        except (OSError, ValueError):
+            head = None
+        try:
+            with open(os.path.join(self.local_dir, ".gitmodules"), "rb") as f:
+                gitmodules = f.read()
+        except OSError:
+            gitmodules = None
+        return head, gitmodules
+
+    def _need_submodule(self, out, before):
+        """Check if the submodules have to be updated after the pull
+
+        return:
+                heads (dict): hash of HEAD of each submodule, see
+                submodule_heads, None when the update can be skipped
+        """
+
+        if not self._has_submodule(out):
+            return None
+        heads = submodule_heads(self.local_dir)
+        if (before[0] is None or self._snapshot() != before
+                or None in heads.values()):
+            return heads
+        return None
 
     def git_cmd(self):
         """launch git pull command
@@ -154,14 +1344,25 @@ class Pull(Git):
         Update local repository
         """
 
-        cmd = ["git", "-C", self.local_dir, "pull"]
-        out, self.compl_proc, self.error_proc = ex_subprocess(cmd)
+        before = self._snapshot()
+        out = super().git_cmd()
+        heads = self._need_submodule(out, before)
+        if heads is not None:
+            out = self._submodule_result(self.cmd_sub[0].git_cmd())
+            self.submodules = {path: (head, after) for (path, head), after in
+                               zip(heads.items(), submodule_heads(self.local_dir).values())}
+        return out
 
-        git_mod_path = os.path.join(self.local_dir, ".gitmodules")
-        if os.path.isfile(git_mod_path) & (out == 0):
-            out = self.cmd_sub[0].git_cmd()
-            self.compl_proc = self.cmd_sub[0].compl_proc
-            self.error_proc = self.cmd_sub[0].error_proc
+    async def git_cmd_async(self):
+        """launch git pull command from an asyncio event loop"""
+
+        before = self._snapshot()
+        out = await super().git_cmd_async()
+        heads = self._need_submodule(out, before)
+        if heads is not None:
+            out = self._submodule_result(await self.cmd_sub[0].git_cmd_async())
+            self.submodules = {path: (head, after) for (path, head), after in
+                               zip(heads.items(), submodule_heads(self.local_dir).values())}
         return out
 
 
@@ -174,12 +1375,108 @@ class Hash(Git):
     def __init__(self, local_dir):
         super().__init__(local_dir)
 
+    def command(self):
+        return ["git", "-C", self.local_dir, "rev-list", "-1", "HEAD"]
+
+
+class CountCommits(Git):
+    """git rev-list --count HEAD
+
+    Count the commits of the history of HEAD, only the fetched ones in a
+    shallow clone
+    """
+
+    def command(self):
+        return ["git", "-C", self.local_dir, "rev-list", "--count", "HEAD"]
+
+
+class LocalHash(Hash):
+    """Drop-in alternative to Hash that does not spawn git
+
+    HEAD is resolved by reading the git directory, see read_head. git rev-list
+    is only launched when this fails.
+    """
+
+    def _read_head(self):
+        """Resolve HEAD in-process, return 0 on success"""
+
+        try:
+            sha = read_head(self.local_dir)
+        except (OSError, ValueError):
+            sha = None
+        if sha is None:
+            return 1
+        self.compl_proc = subprocess.CompletedProcess(self.command(), 0,
+                                                      stdout=(sha + "\n").encode('UTF-8'),
+                                                      stderr=b"")
+        self.error_proc = None
+        return 0
+
     def git_cmd(self):
-        """launch git rev-list -1 HEAD command"""
+        """resolve HEAD"""
+
+        if self._read_head() == 0:
+            return 0
+        return super().git_cmd()
+
+    async def git_cmd_async(self):
+        """resolve HEAD, git rev-list is launched from an asyncio event loop
+        when needed
+        """
+
+        if self._read_head() == 0:
+            return 0
+        return await super().git_cmd_async()
 
-        cmd = ["git", "-C", self.local_dir, "rev-list", "-1", "HEAD"]
-        out, self.compl_proc, self.error_proc = ex_subprocess(cmd)
-        return out
+
+class LsRemote(Git):
+    """git ls-remote <remote> <ref>
+
+    Retrieve the commit a reference points to in the remote repository
+    without fetching anything
+
+    Attributs:
+            - remote (str): name of the remote, ex: origin
+            - ref (str): ex, refs/heads/master
+    """
+
+    operation = "query"
+
+    def __init__(self, local_dir, remote, ref):
+        super().__init__(local_dir)
+        self.remote = remote
+        self.ref = ref
+
+    def command(self):
+        return ["git", "-C", self.local_dir, "ls-remote", self.remote, self.ref]
+
+    def remote_tip(self):
+        """Get the hash of the remote reference, None if it does not exist"""
+
+        for line in self.retrieve_stdout().splitlines():
+            sha, _, name = line.partition("\t")
+            if name == self.ref:
+                return sha
+        return None
+
+
+class Bundle(Git):
+    """git bundle create <file> HEAD --branches --tags
+
+    Write the checked out commit, the branches and the tags of a local
+    repository in a single file that can be cloned without network
+
+    Attributs:
+            - bundle_path (str): absolute path of the bundle file
+    """
+
+    def __init__(self, local_dir, bundle_path):
+        super().__init__(local_dir)
+        self.bundle_path = bundle_path
+
+    def command(self):
+        return ["git", "-C", self.local_dir, "bundle", "create",
+                self.bundle_path, "HEAD", "--branches", "--tags"]
 
 
 class HistRange(Git):
@@ -193,17 +1490,13 @@ class HistRange(Git):
         self.early_sha = early_sha
         self.later_sha = later_sha
 
-    def git_cmd(self):
-        """launch git log --graph --online --decorate sha(n-x)..sha(n+y)
-        command
-        """
+    def command(self):
+        """git log --graph --online --decorate sha(n-x)..sha(n+y) command"""
 
-        cmd = ["git", "--no-pager", "-C",
-               self.local_dir, "log", "--color",
-               "--graph", "--oneline", "--decorate",
-               "{0}..{1}".format(self.early_sha, self.later_sha)]
-        out, self.compl_proc, self.error_proc = ex_subprocess(cmd)
-        return out
+        return ["git", "--no-pager", "-C",
+                self.local_dir, "log", "--color",
+                "--graph", "--oneline", "--decorate",
+                "{0}..{1}".format(self.early_sha, self.later_sha)]
 
 
 class IsGitWorkTree(Git):
@@ -215,12 +1508,9 @@ class IsGitWorkTree(Git):
     def __init__(self, local_dir):
         super().__init__(local_dir)
 
-    def git_cmd(self):
-        """launch command"""
-        cmd = ["git", "-C", self.local_dir,
-               "rev-parse", "--is-inside-work-tree"]
-        out, self.compl_proc, self.error_proc = ex_subprocess(cmd)
-        return out
+    def command(self):
+        return ["git", "-C", self.local_dir,
+                "rev-parse", "--is-inside-work-tree"]
 
 
 class GetRemote(Git):
@@ -232,50 +1522,147 @@ class GetRemote(Git):
     def __init__(self, local_dir):
         super().__init__(local_dir)
 
-    def git_cmd(self):
-        """launch command"""
-        cmd = ["git", "-C", self.local_dir,
-               "config", "--get", "remote.origin.url"]
-        out, self.compl_proc, self.error_proc = ex_subprocess(cmd)
-        return out
+    def command(self):
+        return ["git", "-C", self.local_dir,
+                "config", "--get", "remote.origin.url"]
+
+
+class RemoteAdd(Git):
+    """git remote add <name> <remote_url>"""
+
+    def __init__(self, local_dir, name, remote_url):
+        super().__init__(local_dir)
+        self.name = name
+        self.remote_url = remote_url
+
+    def command(self):
+        return ["git", "-C", self.local_dir, "remote", "add", self.name,
+                self.remote_url]
+
+
+class Fetch(Git):
+    """git fetch <remote> <refspec>...
+
+    Attributs:
+            - remote (str): name of the remote, ex: origin
+            - refspecs (list(str)): ex, <commit>:refs/remotes/origin/master,
+              the configured refspecs when empty
+            - depth (int): history depth, 0 for the complete history
+            - filter_spec (str): partial clone filter
+    """
+
+    operation = "clone"
+
+    def __init__(self, local_dir, remote, refspecs, depth=0, filter_spec=""):
+        super().__init__(local_dir)
+        self.remote = remote
+        self.refspecs = refspecs
+        self.depth = depth
+        self.filter_spec = filter_spec
+
+    def command(self):
+        return (["git", "-C", self.local_dir, "fetch", "-q"]
+                + clone_options(self.depth, self.filter_spec)
+                + [self.remote] + self.refspecs)
+
+
+class Checkout(Git):
+    """git checkout -B <branch> <commit>
+
+    Attributs:
+            - commit (str): hash of the commit
+            - branch (str): branch created or reset to the commit, None to
+              detach HEAD
+    """
+
+    def __init__(self, local_dir, commit, branch=None):
+        super().__init__(local_dir)
+        self.commit = commit
+        self.branch = branch
+
+    def command(self):
+        if self.branch is None:
+            return ["git", "-C", self.local_dir, "checkout", "-q", "--detach",
+                    self.commit]
+        return ["git", "-C", self.local_dir, "checkout", "-q", "-B",
+                self.branch, self.commit]
+
+
+class SetUpstream(Git):
+    """git branch --set-upstream-to=<remote>/<branch> <branch>"""
+
+    def __init__(self, local_dir, remote, branch):
+        super().__init__(local_dir)
+        self.remote = remote
+        self.branch = branch
+
+    def command(self):
+        return ["git", "-C", self.local_dir, "branch", "-q",
+                "--set-upstream-to={}/{}".format(self.remote, self.branch),
+                self.branch]
+
+
+class SetRemoteUrl(Git):
+    """git remote set-url origin <remote_url>"""
+
+    def __init__(self, local_dir, remote_url):
+        super().__init__(local_dir)
+        self.remote_url = remote_url
+
+    def command(self):
+        return ["git", "-C", self.local_dir, "remote", "set-url", "origin",
+                self.remote_url]
 
 
 class InitSubmodule(Git):
     """git submodule update --init --recursive
 
     install submodule in a already cloned repository
+
+    Attributs:
+            - depth (int): history depth, 0 for the complete history
+            - filter_spec (str): partial clone filter, empty for a complete
+              clone
+            - url_map (dict): submodule urls fetched from other locations,
+              see url_options
+            - jobs (int): number of submodules cloned at the same time
     """
 
-    def __init__(self, local_dir):
-        super().__init__(local_dir)
+    operation = "clone"
 
-    def git_cmd(self):
-        """launch command
-        """
+    def __init__(self, local_dir, depth=0, filter_spec="", url_map=None, jobs=1):
+        super().__init__(local_dir)
+        self.depth = depth
+        self.filter_spec = filter_spec
+        self.url_map = url_map
+        self.jobs = jobs
 
-        cmd = ["git", "-C", self.local_dir, "submodule", "update", "--init",
-               "--recursive"]
-        out, self.compl_proc, self.error_proc = ex_subprocess(cmd)
-        return out
+    def command(self):
+        return (["git", "-C", self.local_dir] + url_options(self.url_map)
+                + ["submodule", "update", "--init", "--recursive"]
+                + clone_options(self.depth, self.filter_spec)
+                + submodule_options(self.jobs))
 
 
 class UpdateSubmodule(Git):
-    """git submodule update --recursive
+    """git submodule update --init --recursive
+
+    update submodule in a already cloned repository, the submodules added
+    upstream are cloned
 
-    update submodule in a already cloned repository
+    Attributs:
+            - jobs (int): number of submodules fetched at the same time
     """
 
-    def __init__(self, local_dir):
-        super().__init__(local_dir)
+    operation = "pull"
 
-    def git_cmd(self):
-        """launch command
-        """
+    def __init__(self, local_dir, jobs=1):
+        super().__init__(local_dir)
+        self.jobs = jobs
 
-        cmd = ["git", "-C", self.local_dir, "submodule", "update",
-               "--recursive"]
-        out, self.compl_proc, self.error_proc = ex_subprocess(cmd)
-        return out
+    def command(self):
+        return ["git", "-C", self.local_dir, "submodule", "update", "--init",
+                "--recursive"] + submodule_options(self.jobs)
 
 
 # Quick testing
@@ -0,0 +1,281 @@
+"""Generation of the help tags files of the plugins, like vim's :helptags
+
+The doc/*.txt files of a plugin give doc/tags, the translated doc/*.{xx}x
+files give doc/tags-xx. The files are written byte for byte as vim writes
+them: one ``tag<Tab>file<Tab>/*tag*`` line per tag, sorted with strcmp, with
+'\\' and '/' escaped in the search pattern, after a
+``!_TAG_FILE_ENCODING<Tab>utf-8<Tab>//`` line when the help files are
+utf-8.
+
+The tags of each help file are cached by the hash of its content, so that
+unchanged help files are not parsed again.
+"""
+
+import hashlib
+import json
+import os
+import re
+
+from vim_pck import utils
+
+# characters that can not be part of a tag
+_TAG_STOP = re.compile(rb"[ \t|]")
+
+# extension of the translated help files, ex: jax for japanese
+_TRANSLATED = re.compile(r"^[a-z]{2}x$")
+
+# length of the lines read by vim, the end of longer lines is ignored
+LINE_SIZE = 1024
+
+ENCODING_LINE = b"!_TAG_FILE_ENCODING\tutf-8\t//\n"
+
+
+def find_tags(line):
+    """Get the tags defined in a line of a help file
+
+    A tag is a *tag* surrounded by white space, or starting the line, and
+    made of characters other than space, tab and '|'.
+
+    Arguments:
+            - line (bytes)
+
+    return:
+            tags (list(bytes))
+    """
+
+    tags = []
+    start = line.find(b"*")
+    while start != -1:
+        end = line.find(b"*", start + 1)
+        if end > start + 1:
+            name = line[start + 1:end]
+            if (_TAG_STOP.search(name) is None
+                    and (start == 0 or line[start - 1] in b" \t")
+                    and (end + 1 == len(line) or line[end + 1] in b" \t\n\r")):
+                tags.append(name)
+                end = line.find(b"*", end + 1)
+        start = end
+    return tags
+
+
+def is_utf8(line):
+    """Tell if a help file is utf-8 from its first line, as vim does
+
+    return:
+            utf8 (bool): True when the line has valid non-ASCII utf-8
+            characters
+    """
+
+    if max(line, default=0) < 0x80:
+        return False
+    try:
+        line.decode("UTF-8")
+    except UnicodeDecodeError:
+        return False
+    return True
+
+
+def parse(content):
+    """Get the tags of a help file
+
+    return:
+            (utf8, tags) (2-uple): encoding of the first line, see is_utf8,
+            None for an empty file. The tags are in order of appearance
+    """
+
+    utf8 = None
+    tags = []
+    for index, line in enumerate(content.splitlines(True)):
+        # vim reads lines as C strings, truncated to LINE_SIZE bytes
+        line = line.split(b"\0", 1)[0][:LINE_SIZE]
+        if index == 0:
+            utf8 = is_utf8(line)
+        if b"*" in line:
+            tags.extend(find_tags(line))
+    return utf8, tags
+
+
+def languages(doc_dir):
+    """Get the help files of a doc directory by language
+
+    return:
+            files (dict): key = name of the tags file, tags or tags-xx,
+            value = sorted names of the help files
+    """
+
+    files = {}
+    try:
+        names = os.listdir(doc_dir)
+    except OSError:
+        return files
+    for name in sorted(names):
+        if len(name) <= 4 or name[-4] != ".":
+            continue
+        ext = name[-3:]
+        if ext == "txt":
+            files.setdefault("tags", []).append(name)
+        elif _TRANSLATED.match(ext):
+            files.setdefault("tags-" + ext[:2], []).append(name)
+    return files
+
+
+def tags_file(entries, utf8):
+    """Get the content of a tags file
+
+    Arguments:
+            - entries (list((bytes, str))): (tag, name of the help file)
+            - utf8 (bool): write the encoding line
+
+    return:
+            content (bytes)
+    """
+
+    lines = sorted(tag + b"\t" + name.encode("UTF-8") for tag, name in entries)
+    out = [ENCODING_LINE] if utf8 else []
+    for line in lines:
+        tag = line.split(b"\t", 1)[0]
+        pattern = tag.replace(b"\\", b"\\\\").replace(b"/", b"\\/")
+        out.append(line + b"\t/*" + pattern + b"*\n")
+    return b"".join(out)
+
+
+def _duplicates(entries):
+    """Get the tags defined twice"""
+
+    seen = set()
+    dups = set()
+    for tag, name in entries:
+        if tag in seen:
+            dups.add(tag)
+        seen.add(tag)
+    return sorted(dups)
+
+
+class TagCache:
+    """Tags of the help files, cached by the hash of their content
+
+    Attributs:
+            - path (str): json cache file
+            - files (dict): key = path of the help file, value = [sha1 of the
+              content, utf8, tags decoded as latin-1], see parse
+    """
+
+    VERSION = 1
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(utils.cache_dir(), 'helptags.json')
+        self.files = {}
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if data.get('version') == self.VERSION:
+            self.files = data['files']
+
+    def parse(self, path):
+        """Get the tags of a help file, it is only parsed when its content
+        changed
+
+        return:
+                (utf8, tags) (2-uple): see parse
+        """
+
+        with open(path, 'rb') as f:
+            content = f.read()
+        digest = hashlib.sha1(content).hexdigest()
+        entry = self.files.get(path)
+        if entry is not None and entry[0] == digest:
+            return entry[1], [tag.encode('latin-1') for tag in entry[2]]
+        utf8, tags = parse(content)
+        self.files[path] = [digest, utf8, [tag.decode('latin-1') for tag in tags]]
+        return utf8, tags
+
+    def save(self):
+        """Write the cache, the help files that were removed are forgotten.
+        Failing to do so is not an error.
+        """
+
+        files = {path: entry for path, entry in self.files.items()
+                 if os.path.isfile(path)}
+        try:
+            utils.write_json(self.path, {'version': self.VERSION, 'files': files})
+        except OSError:
+            pass
+
+
+def helptags(doc_dir, cache):
+    """Write the tags files of a doc directory
+
+    As vim, an empty tags file is written when utf-8 and non utf-8 help
+    files are mixed, the tags defined twice are reported but kept.
+
+    Arguments:
+            - cache (TagCache instance)
+
+    return:
+            errors (list(str))
+    """
+
+    errors = []
+    for tags_name, names in languages(doc_dir).items():
+        entries = []
+        encoding = None
+        mixed = False
+        for name in names:
+            utf8, tags = cache.parse(os.path.join(doc_dir, name))
+            if utf8 is None:
+                continue
+            if encoding is None:
+                encoding = utf8
+            elif utf8 != encoding:
+                errors.append("mix of help file encodings within a language: {}".format(name))
+                mixed = True
+                break
+            entries.extend((tag, name) for tag in tags)
+        if mixed:
+            content = b""
+        else:
+            content = tags_file(entries, encoding)
+            errors.extend("duplicate tag {}".format(tag.decode('UTF-8', 'replace'))
+                          for tag in _duplicates(entries))
+        tags_path = os.path.join(doc_dir, tags_name)
+        try:
+            with open(tags_path, 'rb') as f:
+                if f.read() == content:
+                    continue
+        except OSError:
+            pass
+        with open(tags_path, 'wb') as f:
+            f.write(content)
+    return errors
+
+
+def generate(plugin_dirs, jobs=1, cache=None):
+    """Write the tags files of the doc directory of plugins, jobs plugins at
+    the same time
+
+    return:
+            errors (dict): key = plugin directory, value = list of errors,
+            only the plugins with errors are listed
+    """
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    if cache is None:
+        cache = TagCache()
+
+    def run(plugin_dir):
+        try:
+            return helptags(os.path.join(plugin_dir, 'doc'), cache)
+        except OSError as err:
+            return [str(err)]
+
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        results = list(executor.map(run, plugin_dirs))
+    cache.save()
+    return {plugin_dir: errors for plugin_dir, errors in zip(plugin_dirs, results)
+            if errors}
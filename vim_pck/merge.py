@@ -0,0 +1,384 @@
+"""Merged runtime directory of the start plugins
+
+Vim adds every pack/*/start/* directory, and its after directory, to the
+runtimepath at startup. The files of the start plugins are instead linked in
+a single directory, pack/vimpck/start/vimpck of the merge root, so that vim
+only loads one runtimepath entry. The opt plugins are linked in
+pack/vimpck/opt so that :packadd still finds them when the merge root
+replaces the pack path in 'packpath'.
+
+Plugins are merged in the order vim loads them, a file provided by several
+plugins is only linked from the first one and reported as a conflict. With
+symbolic links, a directory provided by a single plugin is linked as a whole.
+The help files are merged and their tags files generated, see helptags.
+
+A manifest records the links and the files of each plugin with the hash of
+its HEAD: the next build only lists the plugins whose HEAD changed and only
+adds or removes the links that changed.
+"""
+
+import json
+import os
+
+from vim_pck import const
+from vim_pck import helptags
+from vim_pck import utils
+
+
+def plugin_files(plugin_dir):
+    """Get the files of a plugin that are merged
+
+    The entries of the plugin directory itself other than directories, the
+    hidden entries, ex: .git, and the tags files of the doc directory are
+    left out. A symbolic link to a directory is a file.
+
+    return:
+            files (list(str)): sorted paths relative to plugin_dir
+    """
+
+    files = []
+    stack = [""]
+    while stack:
+        rel_dir = stack.pop()
+        try:
+            with os.scandir(os.path.join(plugin_dir, rel_dir)) as it:
+                entries = list(it)
+        except OSError:
+            continue
+        for entry in entries:
+            path = os.path.join(rel_dir, entry.name)
+            if not rel_dir and entry.name.startswith("."):
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                stack.append(path)
+            elif not rel_dir:
+                continue
+            elif rel_dir == "doc" and (entry.name == "tags" or entry.name.startswith("tags-")):
+                continue
+            else:
+                files.append(path)
+    return sorted(files)
+
+
+def _parents(path):
+    """Get the parent directories of a relative path, top-down"""
+
+    parts = path.split(os.sep)[:-1]
+    return [os.sep.join(parts[:i + 1]) for i in range(len(parts))]
+
+
+def _owner(path, parents, owners, dirs):
+    """Get the plugin a path of another plugin conflicts with
+
+    Arguments:
+            - parents (list(str)): see _parents
+            - owners (dict): key = path of a file, value = plugin that
+              provides it
+            - dirs (dict): key = path of a directory, value = set of the
+              plugins that provide files in it
+
+    return:
+            plugin (str): the plugin that provides the same file, files in
+            a directory of the same path, or a file that is a parent of the
+            path, None when there is no conflict
+    """
+
+    other = owners.get(path)
+    if other is None and path in dirs:
+        other = sorted(dirs[path])[0]
+    if other is None:
+        other = next((owners[parent] for parent in parents if parent in owners), None)
+    return other
+
+
+def layout(files_by_plugin, links="symlink"):
+    """Get the links of the merged directory
+
+    Arguments:
+            - files_by_plugin (list((str, list(str)))): path of each plugin
+              and its files, see plugin_files, in the order they are loaded
+            - links (str): symlink or hardlink, directories are only linked
+              as a whole with symbolic links
+
+    return:
+            (links, conflicts) (2-uple): links = dict, key = path of the
+            link, value = (plugin, link to a directory), conflicts = list of
+            (path, plugin kept, plugin ignored)
+    """
+
+    owners = {}
+    dirs = {}
+    conflicts = []
+    for plugin, files in files_by_plugin:
+        for path in files:
+            parents = _parents(path)
+            other = _owner(path, parents, owners, dirs)
+            if other is not None:
+                conflicts.append((path, other, plugin))
+                continue
+            owners[path] = plugin
+            for parent in parents:
+                dirs.setdefault(parent, set()).add(plugin)
+    result = {}
+    for path, plugin in owners.items():
+        link, is_dir = path, False
+        if links == "symlink":
+            for parent in _parents(path):
+                # the tags files of the merged help files are written in doc
+                if parent != "doc" and dirs[parent] == {plugin}:
+                    link, is_dir = parent, True
+                    break
+        result[link] = (plugin, is_dir)
+    return result, conflicts
+
+
+def rtp_entries(plugin_dirs):
+    """Count the runtimepath entries vim adds for start plugins: the plugin
+    directory and its after directory
+    """
+
+    return sum(1 + os.path.isdir(os.path.join(plugin_dir, "after"))
+               for plugin_dir in plugin_dirs)
+
+
+class Runtime:
+    """The merge root
+
+    Arguments:
+            - root (str): the merge root, meant to replace the parent of the
+              pack path in 'packpath'
+            - pack_path (str)
+            - links (str): symlink or hardlink
+
+    Attributs:
+            - start_dir (str): merged directory of the start plugins
+            - opt_dir (str): directory of the links to the opt plugins
+            - manifest_path (str)
+            - plugins (dict): key = <package>/start/<plugin>, value = {head,
+              files} of the last build
+            - links_made (dict): key = path of the link relative to root,
+              value = [plugin, path in the plugin, kind], kind is symlink or
+              hardlink
+    """
+
+    VERSION = 1
+
+    def __init__(self, root, pack_path, links="symlink"):
+        self.root = root
+        self.pack_path = pack_path
+        self.links = links
+        package = os.path.join(root, "pack", const.MERGE_PACKAGE)
+        self.start_dir = os.path.join(package, "start", const.MERGE_PACKAGE)
+        self.opt_dir = os.path.join(package, "opt")
+        self.manifest_path = os.path.join(root, const.MERGE_MANIFEST)
+        self.plugins = {}
+        self.links_made = {}
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.manifest_path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if data.get('version') != self.VERSION:
+            return
+        self.links_made = data['links']
+        if data.get('pack_path') == self.pack_path:
+            self.plugins = data['plugins']
+
+    def _save(self):
+        utils.write_json(self.manifest_path, {'version': self.VERSION,
+                                              'pack_path': self.pack_path,
+                                              'plugins': self.plugins,
+                                              'links': self.links_made})
+
+    def _wanted(self, start, opt, rescan):
+        """Get the links of the plugins, the files of the plugins whose HEAD
+        did not change are not listed again
+
+        return:
+                (wanted, conflicts, changed) (3-uple): wanted = dict, key =
+                path of the link relative to root, value = [plugin, path in
+                the plugin, kind], changed = set of the plugins whose HEAD
+                changed
+        """
+
+        plugins = {}
+        changed = set()
+        for plugin, head in start:
+            known = self.plugins.get(plugin)
+            if rescan or head is None or known is None or known['head'] != head:
+                known = {'head': head,
+                         'files': plugin_files(os.path.join(self.pack_path, plugin))}
+                changed.add(plugin)
+            plugins[plugin] = known
+        self.plugins = plugins
+        start_links, conflicts = layout([(plugin, plugins[plugin]['files'])
+                                         for plugin, head in start], self.links)
+        start_rel = os.path.relpath(self.start_dir, self.root)
+        wanted = {}
+        for path, (plugin, is_dir) in start_links.items():
+            kind = "symlink" if is_dir or self.links == "symlink" else "hardlink"
+            wanted[os.path.join(start_rel, path)] = [plugin, path, kind]
+        opt_rel = os.path.relpath(self.opt_dir, self.root)
+        for plugin, head in opt:
+            name = os.path.basename(plugin)
+            path = os.path.join(opt_rel, name)
+            if path in wanted:
+                conflicts.append((os.path.join("opt", name), wanted[path][0], plugin))
+            else:
+                wanted[path] = [plugin, "", "symlink"]
+        return wanted, conflicts, changed
+
+    def _prune(self, directory):
+        """Remove the directories left empty, up to the start and opt
+        directories
+        """
+
+        while directory not in (self.start_dir, self.opt_dir, self.root):
+            try:
+                os.rmdir(directory)
+            except OSError:
+                return
+            directory = os.path.dirname(directory)
+
+    def _link(self, path, plugin, inner, kind):
+        source = os.path.join(self.pack_path, plugin)
+        if inner:
+            source = os.path.join(source, inner)
+        if os.path.islink(path) and os.readlink(path) == source:
+            # made by a build whose manifest was lost
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.path.isdir(path) and not os.path.islink(path):
+            # left empty by a link that was removed, or not ours
+            os.rmdir(path)
+        if kind == "hardlink":
+            os.link(source, path)
+        else:
+            os.symlink(source, path)
+
+    def _doc(self):
+        """Write the tags files of the merged help files, remove the ones of
+        the languages that are gone
+
+        return:
+                errors (list(str))
+        """
+
+        doc_dir = os.path.join(self.start_dir, "doc")
+        errors = ["helptags: {}".format(error) for error in
+                  helptags.generate([self.start_dir]).get(self.start_dir, [])]
+        names = helptags.languages(doc_dir)
+        try:
+            entries = os.listdir(doc_dir)
+        except OSError:
+            return errors
+        for name in entries:
+            if (name == "tags" or name.startswith("tags-")) and name not in names:
+                os.remove(os.path.join(doc_dir, name))
+        self._prune(doc_dir)
+        return errors
+
+    def _remove_stale(self, wanted, changed, errors):
+        """Remove the links that are not wanted anymore, and the hard links
+        of the plugins whose HEAD changed
+
+        return:
+                stale (list(str)): paths of the links relative to root
+        """
+
+        stale = [path for path, link in self.links_made.items()
+                 if wanted.get(path) != link
+                 or (link[2] == "hardlink" and link[0] in changed)]
+        # deepest first, the parent of a link can be a link to remove
+        for path in sorted(stale, key=lambda path: path.count(os.sep), reverse=True):
+            full_path = os.path.join(self.root, path)
+            try:
+                os.unlink(full_path)
+            except FileNotFoundError:
+                pass
+            except OSError as err:
+                errors.append("{}: {}".format(path, err.strerror))
+                continue
+            del self.links_made[path]
+            self._prune(os.path.dirname(full_path))
+        return stale
+
+    def _add_links(self, wanted, errors):
+        """Make the wanted links that are missing
+
+        return:
+                added (list(str)): paths of the links relative to root
+        """
+
+        added = []
+        for path, link in sorted(wanted.items()):
+            full_path = os.path.join(self.root, path)
+            if path in self.links_made and os.path.lexists(full_path):
+                continue
+            try:
+                self._link(full_path, *link)
+            except OSError as err:
+                errors.append("{}: {}".format(path, err.strerror))
+                continue
+            self.links_made[path] = link
+            added.append(path)
+        return added
+
+    def _docs_changed(self, wanted, stale, added, changed):
+        """Check if the tags files of the merged help files have to be
+        generated again
+        """
+
+        doc_rel = os.path.join(os.path.relpath(self.start_dir, self.root), "doc") + os.sep
+        docs = [path for path in wanted if path.startswith(doc_rel)]
+        # the help files of the changed plugins may have changed behind their
+        # symbolic links
+        return (any(path.startswith(doc_rel) for path in stale + added)
+                or any(wanted[path][0] in changed for path in docs)
+                or (bool(docs) and not os.path.exists(os.path.join(self.start_dir, "doc", "tags"))))
+
+    def build(self, plugins, rescan=False):
+        """Bring the merge root up to date
+
+        Arguments:
+                - plugins (dict): key = <package>/{start|opt}/<plugin>, value
+                  = hash of HEAD, None when unknown
+                - rescan (bool): list the files of every plugin again
+
+        return:
+                report (dict): start = number of start plugins, before and
+                after = number of runtimepath entries of the start plugins
+                without and with the merged directory, added and removed =
+                number of links, conflicts = list of (path, plugin kept,
+                plugin ignored), errors = list(str)
+        """
+
+        start = sorted((plugin, head) for plugin, head in plugins.items()
+                       if plugin.split(os.sep)[1] == "start")
+        opt = sorted((plugin, head) for plugin, head in plugins.items()
+                     if plugin.split(os.sep)[1] == "opt")
+        wanted, conflicts, changed = self._wanted(start, opt, rescan)
+        errors = []
+        try:
+            os.makedirs(self.start_dir, exist_ok=True)
+            os.makedirs(self.opt_dir, exist_ok=True)
+        except OSError as err:
+            errors.append("{}: {}".format(self.root, err.strerror))
+
+        stale = self._remove_stale(wanted, changed, errors)
+        added = self._add_links(wanted, errors)
+        if self._docs_changed(wanted, stale, added, changed):
+            errors += self._doc()
+        try:
+            self._save()
+        except OSError as err:
+            errors.append("{}: {}".format(self.manifest_path, err.strerror))
+        return {'start': len(start),
+                'before': rtp_entries([os.path.join(self.pack_path, plugin)
+                                       for plugin, head in start]),
+                'after': rtp_entries([self.start_dir]) if start else 0,
+                'added': len(added), 'removed': len(stale),
+                'conflicts': conflicts, 'errors': errors}
@@ -0,0 +1,121 @@
+"""Reconciliation of the configuration file with the pack path
+
+The configuration file and the plugins found on disk are indexed once by
+remote url, then compared to get the actions that install, upgrade, clean
+and their --dry-run view work on.
+"""
+
+import os
+from collections import namedtuple
+from enum import Enum
+
+from vim_pck.git import canonical_url, humanish
+from vim_pck import const
+
+
+class Kind(Enum):
+    """Kind of the actions of a plan"""
+
+    install = "install"
+    upgrade = "upgrade"
+    remove = "remove"
+    relocate = "relocate"
+
+
+class Action(namedtuple('Action', ['kind', 'remote_url', 'path', 'target'])):
+    """An action of a plan
+
+    Attributs:
+            - kind (Kind)
+            - remote_url (str): remote url of the plugin, as written in the
+              configuration file when it is configured
+            - path (str): current directory of the plugin relative to the
+              pack path, None when it is not installed
+            - target (str): directory of the plugin relative to the pack path
+              according to the configuration file, None when it is not
+              configured
+    """
+
+    __slots__ = ()
+
+    def __str__(self):
+        if self.kind is Kind.install:
+            return "install  {} -> {}".format(self.remote_url, self.target)
+        if self.kind is Kind.relocate:
+            return "relocate {} -> {}".format(self.path, self.target)
+        return "{:<8} {}".format(self.kind.value, self.path)
+
+
+def target_path(spec, remote_url):
+    """Get the directory of a plugin relative to the pack path
+
+    Arguments:
+            - spec (dict): validated section of the remote url in the
+              configuration file
+    """
+
+    return os.path.join(spec[const.PKG_NAME], spec[const.TYPE_NAME],
+                        humanish(remote_url))
+
+
+class Plan:
+    """Compare the configuration file with the plugins installed on disk
+
+    Remote urls are compared in their canonical form, see
+    git.canonical_url, so that adding or removing a trailing .git in the
+    configuration file does not reinstall a plugin.
+
+    Arguments:
+            - repos (dict): key = remote url, value = validated section of
+              the configuration file, see ConfigFile.repos
+            - all_plug (dict): key = <package_name>/{start|opt}/<plugin_name>
+                               value = remote url, see DiskPlugin.all_plug
+
+    Attributs:
+            - specs (dict): key = canonical url, value = (remote url, section)
+            - disk (dict): key = canonical url, value = list of the
+              directories the remote is installed in, relative to the pack
+              path
+            - installs, upgrades, removes, relocates (list(Action)): actions
+              of each kind, sorted by remote url and by path
+    """
+
+    def __init__(self, repos, all_plug):
+        self.specs = {canonical_url(url): (url, spec) for url, spec in repos.items()}
+        self.disk = {}
+        for path, url in all_plug.items():
+            self.disk.setdefault(canonical_url(url), []).append(path)
+        self.installs = []
+        self.upgrades = []
+        self.removes = []
+        self.relocates = []
+        self._compare(all_plug)
+
+    def _compare(self, all_plug):
+        for key, (url, spec) in sorted(self.specs.items()):
+            target = target_path(spec, url)
+            paths = self.disk.get(key)
+            if not paths:
+                self.installs.append(Action(Kind.install, url, None, target))
+                continue
+            if target in paths:
+                current = target
+            else:
+                # the package or the type of the plugin changed
+                current = sorted(paths)[0]
+                self.relocates.append(Action(Kind.relocate, url, current, target))
+            if not spec[const.FRZ_NAME]:
+                self.upgrades.append(Action(Kind.upgrade, url, current, target))
+            for path in sorted(paths):
+                if path != current:
+                    # installed twice, only one copy is kept
+                    self.removes.append(Action(Kind.remove, all_plug[path], path, None))
+        for key, paths in sorted(self.disk.items()):
+            if key not in self.specs:
+                self.removes.extend(Action(Kind.remove, all_plug[path], path, None)
+                                    for path in sorted(paths))
+
+    def actions(self):
+        """Get every action of the plan"""
+
+        return self.relocates + self.installs + self.upgrades + self.removes
@@ -1,5 +1,6 @@
 from enum import Enum
 import itertools
+import shutil
 import sys
 import time
 import threading
@@ -48,7 +49,8 @@ class Spinner():
         self.offset = offset  # number of space to pad on the left
         self.spinner_cycle = itertools.cycle(self.set_spinner_seq(sequence))
 
-    def set_spinner_seq(self, sequence):
+    @staticmethod
+    def set_spinner_seq(sequence):
         seq_list = [name for name, members in Sequence.__members__.items()]
         if sequence.upper() in seq_list:
             seq = Sequence[sequence.upper()].value
@@ -79,6 +81,115 @@ class Spinner():
             sys.stdout.write('\b' * len(cur_mess))
 
 
+class Progress():
+    """A live progress block drawn by a single thread
+
+    The block has one row per active job with a spinner, followed by a
+    summary line. It is redrawn at most once every interval. Permanent lines,
+    such as the result of a job, are written above the block.
+
+    When the stream is not a terminal, no block is drawn and no thread is
+    started: only the permanent lines are written.
+
+    Attributs:
+            - total (int): number of jobs, displayed in the summary line
+            - active (dict): key = job, value = message of the job row
+            - finished (int): number of finished jobs
+    """
+
+    def __init__(self, total=0, interval=0.25, sequence="BASIC", offset=1,
+                 stream=None):
+        self.stream = stream if stream is not None else sys.stdout
+        self.total = total
+        self.interval = interval  # minimal time between two redraws
+        self.offset = offset  # number of space to pad on the left
+        self.active = {}
+        self.finished = 0
+        self.is_tty = self.stream.isatty()
+        self.drawn = 0  # number of lines of the block on screen
+        self.lock = threading.Lock()
+        self.stop_running = threading.Event()
+        self.changed = threading.Event()
+        self.render_thread = threading.Thread(target=self.init_render, daemon=True)
+        self.spinner_cycle = itertools.cycle(Spinner.set_spinner_seq(sequence))
+        self.frame = next(self.spinner_cycle)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def start(self):
+        if self.is_tty:
+            self.render_thread.start()
+
+    def stop(self):
+        if self.is_tty:
+            self.stop_running.set()
+            self.changed.set()
+            self.render_thread.join()
+            with self.lock:
+                self._clear()
+                self.stream.flush()
+
+    def add(self, job, message):
+        """Display a row for a job that has started"""
+        with self.lock:
+            self.active[job] = message
+        self.changed.set()
+
+    def remove(self, job):
+        """Remove the row of a finished job"""
+        with self.lock:
+            self.active.pop(job, None)
+            self.finished += 1
+        self.changed.set()
+
+    def write(self, line):
+        """Write a permanent line above the block"""
+        with self.lock:
+            self._clear()
+            self.stream.write(line + "\n")
+            if self.is_tty:
+                self._draw(next_frame=False)
+            self.stream.flush()
+
+    def _clear(self):
+        """Erase the block, the cursor is put back where the block started"""
+        if self.drawn:
+            self.stream.write("\r\033[{}A\033[J".format(self.drawn))
+            self.drawn = 0
+
+    def _draw(self, next_frame=True):
+        """Draw the block below the cursor"""
+        if next_frame:
+            self.frame = next(self.spinner_cycle)
+        width = shutil.get_terminal_size().columns - 1
+        rows = ["{}{} {}".format(' ' * self.offset, self.frame, message)
+                for message in self.active.values()]
+        if self.total:
+            rows.append("{}[{}/{}] {} running".format(
+                ' ' * self.offset, self.finished, self.total, len(self.active)))
+        for row in rows:
+            self.stream.write(row[:width] + "\n")
+        self.drawn = len(rows)
+
+    def init_render(self):
+        while not self.stop_running.is_set():
+            with self.lock:
+                idle = not self.active
+                self._clear()
+                self._draw()
+                self.stream.flush()
+            if idle:
+                # nothing to animate, sleep until something changes
+                self.changed.wait()
+                self.changed.clear()
+            time.sleep(self.interval)
+
+
 # Quick exemple usage
 if __name__ == "__main__":
 
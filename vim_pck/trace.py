@@ -0,0 +1,251 @@
+"""Timing spans of the vimpck commands
+
+When ``vimpck --trace FILE`` is used, the phases of the command, the work
+done for each plugin and every git subprocess are recorded, then written to
+FILE in the Chrome trace event format, see chrome://tracing or
+https://ui.perfetto.dev. Each plugin is drawn in the lane of the job that
+processed it. Recording costs nothing when --trace is not set.
+"""
+
+import contextlib
+import os
+import time
+
+try:
+    import contextvars
+except ImportError:  # python 3.6, the plugins are not told apart
+    contextvars = None
+
+# Tracer instance while a trace is recorded
+_tracer = None
+
+# remote url of the plugin processed by the current asyncio task
+if contextvars is not None:
+    _plugin = contextvars.ContextVar('plugin', default=None)
+
+# number of plugins of the slowest plugins summary
+SLOWEST = 5
+
+
+class Tracer:
+    """Recorder of the trace events
+
+    Attributs:
+            - path (str): file the trace is written to
+            - origin (float): time.perf_counter() at the start of the trace
+            - events (list(dict)): complete (ph=X) trace events
+            - lanes (set(int)): lanes of the plugins being processed, lane 0
+              is the one of the phases
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.origin = time.perf_counter()
+        self.events = []
+        self.lanes = set()
+        self._plugin = None
+
+    def add(self, name, cat, start, end, lane=0, args=None):
+        """Record a span, start and end are time.perf_counter() values"""
+
+        self.events.append({'name': name, 'cat': cat, 'ph': 'X',
+                            'ts': round((start - self.origin) * 1e6, 1),
+                            'dur': round((end - start) * 1e6, 1),
+                            'pid': os.getpid(), 'tid': lane,
+                            'args': args or {}})
+
+    def take_lane(self):
+        lane = 1
+        while lane in self.lanes:
+            lane += 1
+        self.lanes.add(lane)
+        return lane
+
+    def current_plugin(self):
+        """Get (remote url, lane) of the plugin being processed, None"""
+
+        if contextvars is not None:
+            return _plugin.get()
+        return self._plugin
+
+    def set_plugin(self, value):
+        if contextvars is not None:
+            return _plugin.set(value)
+        self._plugin = value
+
+    def reset_plugin(self, token):
+        if contextvars is not None:
+            _plugin.reset(token)
+        else:
+            self._plugin = None
+
+    def summary(self):
+        """Get the slowest plugins and the parallel efficiency of the phases
+        run by several jobs
+
+        return:
+            summary (dict): slowest = list of {plugin, ms, git = {command:
+            ms}}, phases = list of {name, jobs, ms, efficiency}
+        """
+
+        plugins = {}
+        commands = {}
+        for event in self.events:
+            if event['cat'] == 'plugin':
+                plugins[event['name']] = plugins.get(event['name'], 0) + event['dur']
+            elif event['cat'] == 'git' and event['args'].get('plugin'):
+                by_plugin = commands.setdefault(event['args']['plugin'], {})
+                by_plugin[event['name']] = by_plugin.get(event['name'], 0) + event['dur']
+        slowest = sorted(plugins.items(), key=lambda item: item[1], reverse=True)
+        phases = []
+        for event in self.events:
+            jobs = event['args'].get('jobs')
+            if event['cat'] != 'phase' or not jobs or not event['dur']:
+                continue
+            start, end = event['ts'], event['ts'] + event['dur']
+            busy = sum(min(end, other['ts'] + other['dur']) - max(start, other['ts'])
+                       for other in self.events
+                       if other['cat'] == 'plugin' and other['ts'] < end
+                       and other['ts'] + other['dur'] > start)
+            phases.append({'name': event['name'], 'jobs': jobs,
+                           'ms': event['dur'] / 1e3,
+                           'efficiency': busy / (jobs * event['dur'])})
+        return {'slowest': [{'plugin': name, 'ms': dur / 1e3,
+                             'git': {cmd: ms / 1e3 for cmd, ms in
+                                     sorted(commands.get(name, {}).items())}}
+                            for name, dur in slowest[:SLOWEST]],
+                'phases': phases}
+
+    def save(self, summary):
+        """Write the trace events and the summary to path"""
+
+        import json
+
+        with open(self.path, 'w') as f:
+            json.dump({'traceEvents': self.events, 'displayTimeUnit': 'ms',
+                       'otherData': {'summary': summary}}, f)
+
+
+def start(path):
+    """Start recording a trace written to path by finish"""
+
+    global _tracer
+    _tracer = Tracer(path)
+
+
+def finish():
+    """Stop recording and write the trace
+
+    return:
+        lines (list(str)): the summary of the trace, empty when no trace is
+        recorded
+    """
+
+    global _tracer
+    if _tracer is None:
+        return []
+    tracer, _tracer = _tracer, None
+    summary = tracer.summary()
+    tracer.save(summary)
+    lines = [":: Trace written to {}".format(tracer.path)]
+    if summary['slowest']:
+        lines.append("slowest plugins:")
+    for plugin in summary['slowest']:
+        detail = ", ".join("{} {:.1f}".format(cmd, ms) for cmd, ms in plugin['git'].items())
+        lines.append("  {:>9.1f} ms  {}{}".format(
+            plugin['ms'], plugin['plugin'], "  ({})".format(detail) if detail else ""))
+    if summary['phases']:
+        lines.append("parallel efficiency:")
+    for phase in summary['phases']:
+        lines.append("  {:<10} {:>3} jobs {:>9.1f} ms {:>5.0%}".format(
+            phase['name'], phase['jobs'], phase['ms'], phase['efficiency']))
+    return lines
+
+
+def enabled():
+    return _tracer is not None
+
+
+@contextlib.contextmanager
+def span(name, **args):
+    """Record a phase of a command, also usable as a decorator
+
+    Arguments:
+            - args: arguments of the trace event, jobs is the number of
+              concurrent jobs of the phase, see Tracer.summary
+    """
+
+    if _tracer is None:
+        yield
+        return
+    tracer = _tracer
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        tracer.add(name, 'phase', start_time, time.perf_counter(), args=args)
+
+
+@contextlib.contextmanager
+def plugin(remote_url, phase):
+    """Record the work done on a plugin by a job, the git commands launched
+    meanwhile are attributed to the plugin
+
+    Arguments:
+            - phase (str): ex, pull
+    """
+
+    if _tracer is None:
+        yield
+        return
+    tracer = _tracer
+    lane = tracer.take_lane()
+    token = tracer.set_plugin((remote_url, lane))
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        tracer.add(remote_url, 'plugin', start_time, time.perf_counter(), lane,
+                   {'phase': phase})
+        tracer.reset_plugin(token)
+        tracer.lanes.discard(lane)
+
+
+def git_verb(cmd):
+    """Get the git command of an argv, ex: git -C dir submodule update ->
+    git submodule
+    """
+
+    args = iter(cmd[1:])
+    for arg in args:
+        if arg in ('-C', '-c', '--git-dir'):
+            next(args, None)
+        elif not arg.startswith('-'):
+            return "{} {}".format(os.path.basename(cmd[0]), arg)
+    return cmd[0]
+
+
+def command(cmd, start_time, result):
+    """Record a subprocess launched by git.ex_subprocess
+
+    Arguments:
+            - start_time (float): time.perf_counter() before the launch
+            - result (3-uple): returned by git.ex_subprocess
+    """
+
+    if _tracer is None:
+        return
+    end_time = time.perf_counter()
+    out, compl_proc, error_proc = result
+    proc = compl_proc if compl_proc is not None else error_proc
+    args = {'argv': list(cmd),
+            'exit': getattr(proc, 'returncode', None),
+            'stdout_bytes': len(getattr(proc, 'stdout', None) or b""),
+            'stderr_bytes': len(getattr(proc, 'stderr', None) or b"")}
+    if proc is not None and not hasattr(proc, 'returncode'):
+        args['timeout'] = True
+    current = _tracer.current_plugin()
+    lane = 0
+    if current is not None:
+        args['plugin'], lane = current
+    _tracer.add(git_verb(cmd), 'git', start_time, end_time, lane, args)
@@ -1,28 +1,104 @@
+import hashlib
+import json
 import os
 import sys
-import configobj
-from validate import Validator
+import time
 
-from vim_pck.git import GetRemote
+from vim_pck.git import GetRemote, get_config, git_dir, mirror_dir, read_snapshot, repo_id
 from vim_pck import const
 
 
 class ConfigFile:
     """This class define the configuration file and method that allows to
-    manipulate it"""
+    manipulate it
+
+    The validated configuration is compiled into a json cache keyed on the
+    path, modification time and size of the configuration file and on the
+    content of configspec.ini. When the cache is up to date, the configuration
+    file is neither parsed nor validated.
+
+    Attributs:
+            - settings (dict): validated SETTING section
+            - repos (dict): key = remote url, value = validated dict of the
+                            remote url section
+            - config (ConfigObj object): only parsed when accessed, for
+                                         instance to modify the file
+    """
 
     def __init__(self):
         self.conf_path = ""  # path to the configuration file
-        self.config = None  # ConfigObj object
+        self._config = None  # ConfigObj object
+        self.settings = {}
+        self.repos = {}
         self._get_conf_path()
-        self._read_conf()
-        self._validate_conf()
-        self._get_pack_path()
+        if not self._load_cache():
+            self._compile()
+            self._save_cache()
         self.pack_path = ""
         self.rem_urls = []  # list of remote url section
         self._get_remote_urls()
         self._get_pack_path()
 
+    @property
+    def config(self):
+        """Parse and validate the configuration file on first access"""
+        if self._config is None:
+            self._read_conf()
+            self._validate_conf()
+        return self._config
+
+    def _cache_key(self):
+        """Get what the validity of the cache depends on, None if the
+        configuration file does not exist
+        """
+        try:
+            conf_stat = os.stat(self.conf_path)
+            with open(os.path.join(const.ROOT_DIR, 'configspec.ini'), 'rb') as f:
+                configspec = hashlib.sha1(f.read()).hexdigest()
+        except OSError:
+            return None
+        return {'path': os.path.abspath(self.conf_path),
+                'mtime': conf_stat.st_mtime_ns,
+                'size': conf_stat.st_size,
+                'configspec': configspec}
+
+    def _cache_path(self):
+        name = os.path.abspath(self.conf_path).strip(os.sep).replace(os.sep, '%')
+        return os.path.join(cache_dir(), 'config', name + '.json')
+
+    def _load_cache(self):
+        """Load the compiled configuration, return False if it is outdated"""
+        key = self._cache_key()
+        if key is None:
+            return False
+        try:
+            with open(self._cache_path()) as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if cache.get('key') != key:
+            return False
+        self.settings = cache['settings']
+        self.repos = cache['repos']
+        return True
+
+    def _save_cache(self):
+        key = self._cache_key()
+        if key is None:
+            return
+        try:
+            write_json(self._cache_path(), {'key': key,
+                                            'settings': self.settings,
+                                            'repos': self.repos})
+        except OSError:
+            pass
+
+    def _compile(self):
+        """Parse and validate the configuration file"""
+        self.settings = dict(self.config[const.SECT_1])
+        self.repos = {rem_url: dict(section)
+                      for rem_url, section in self.config[const.SECT_2].items()}
+
     def _get_conf_path(self):
         """ Determine the configuration file path """
         # xdg directory for configuration file
@@ -36,19 +112,24 @@ class ConfigFile:
         self.conf_path = conf_path
 
     def _read_conf(self):
+        import configobj
+
         if os.path.exists(self.conf_path):
-            self.config = configobj.ConfigObj(self.conf_path,
-                                              configspec=os.path.join(const.ROOT_DIR,
-                                                                      'configspec.ini'))
+            self._config = configobj.ConfigObj(self.conf_path,
+                                               configspec=os.path.join(const.ROOT_DIR,
+                                                                       'configspec.ini'))
         else:
             sys.exit("No configuration file found!")
 
     def _validate_conf(self):
         """ Check if the configuration file is correct """
+        import configobj
+        from validate import Validator
+
         validator = Validator()
-        results = self.config.validate(validator)
+        results = self._config.validate(validator)
         if not results:
-            for entry in configobj.flatten_errors(self.config, results):
+            for entry in configobj.flatten_errors(self._config, results):
                 # each entry is a tuple
                 section_list, key, error = entry
                 if key is not None:
@@ -61,21 +142,566 @@ class ConfigFile:
                 print(section_string, ' = ', error)
             sys.exit(1)
 
+    def write(self):
+        """Atomically write the configuration file with the changes made to
+        config
+        """
+        write_atomic(self.conf_path, self.config.write, binary=True)
+
     def _get_pack_path(self):
-        self.pack_path = os.path.expanduser(self.config[const.SECT_1]['pack_path'])
+        self.pack_path = os.path.expanduser(self.settings['pack_path'])
 
     def _get_remote_urls(self):
-        self.rem_urls = self.config[const.SECT_2].keys()
+        self.rem_urls = list(self.repos)
 
     def freeze_false(self):
         """Get the list of sections which freeze option is false
         """
         url_filt = []
         for rem_url in self.rem_urls:
-            if not self.config[const.SECT_2][rem_url].as_bool(const.FRZ_NAME):
+            if not self.repos[rem_url][const.FRZ_NAME]:
                 url_filt.append(rem_url)
         return url_filt
 
+    def clone_opts(self, rem_url):
+        """Get the history depth and the partial clone filter of a remote url
+
+        The value of the repository section override the one of the setting
+        section.
+
+        return:
+            (depth, filter_spec) (2-uple)
+        """
+        opts = []
+        for name in [const.DEPTH_NAME, const.FILTER_NAME]:
+            value = self.repos[rem_url][name]
+            if value is None:
+                value = self.settings[name]
+            opts.append(value)
+        return tuple(opts)
+
+    def mode(self, rem_url):
+        """Get the install mode of a remote url, git for a clone, snapshot
+        for a tree without git metadata, see git.Snapshot
+
+        The value of the repository section override the one of the setting
+        section.
+        """
+        mode = self.repos[rem_url][const.MODE_NAME]
+        if mode is None:
+            mode = self.settings[const.MODE_NAME]
+        return mode
+
+    def merge_path(self):
+        """Get the merge root of the start plugins, see merge.Runtime
+
+        The merge_path setting, default to vimpck-merged next to the pack
+        path
+
+        return:
+            path (str): None when the merge setting is off
+        """
+        if self.settings[const.MERGE_NAME] == 'off':
+            return None
+        if self.settings[const.MERGE_PATH_NAME]:
+            return os.path.expanduser(self.settings[const.MERGE_PATH_NAME])
+        return os.path.join(os.path.dirname(os.path.normpath(self.pack_path)),
+                            'vimpck-merged')
+
+    def timeouts(self):
+        """Get the timeout of each git operation, see git.Git.configure
+
+        return:
+            timeouts (dict): key = operation, value = timeout in seconds, 0
+            to wait forever
+        """
+        return {operation: self.settings[name]
+                for operation, name in const.TIMEOUT_NAMES.items()}
+
+    def mirror(self, rem_url):
+        """Get the path of the mirror of a remote url in the mirror cache
+
+        The mirror cache is the mirror_cache setting, default to
+        <cache_dir>/mirrors
+
+        return:
+            path (str): None when the mirror setting is off
+        """
+        if self.settings[const.MIRROR_NAME] == 'off':
+            return None
+        mirrors_path = self.settings[const.MIRROR_CACHE_NAME]
+        if mirrors_path:
+            mirrors_path = os.path.expanduser(mirrors_path)
+        else:
+            mirrors_path = os.path.join(cache_dir(), 'mirrors')
+        return mirror_dir(rem_url, mirrors_path)
+
+
+def cache_dir():
+    """Get the vimpck cache directory, $XDG_CACHE_HOME/vimpck"""
+
+    try:
+        cache_home = os.environ['XDG_CACHE_HOME']
+    except KeyError:
+        cache_home = os.path.join(os.environ['HOME'], '.cache')
+    return os.path.join(cache_home, 'vimpck')
+
+
+def write_atomic(path, write, binary=False):
+    """Atomically replace the content of path
+
+    The content is written in a temporary file of the same directory that is
+    then renamed to path. The permissions of path are kept.
+
+    Arguments:
+            - write (callable): called with the opened temporary file
+            - binary (bool): open the temporary file in binary mode
+    """
+
+    import tempfile
+
+    dirname = os.path.dirname(os.path.abspath(path))
+    os.makedirs(dirname, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=dirname, prefix='.tmp-')
+    try:
+        try:
+            os.chmod(tmp_path, os.stat(path).st_mode & 0o7777)
+        except FileNotFoundError:
+            pass
+        with os.fdopen(fd, 'wb' if binary else 'w') as f:
+            write(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def write_json(path, data, **kwargs):
+    """Atomically write data as json in path, kwargs are given to json.dump"""
+
+    write_atomic(path, lambda f: json.dump(data, f, **kwargs))
+
+
+class Trash:
+    """Directory where removed plugins are moved before being deleted
+
+    Renaming a plugin directory is instant and atomic, the pack path never
+    contains a partially deleted plugin. The trash is a sibling of the pack
+    path, .vimpck-trash, so that it is on the same filesystem and out of
+    the sight of vim and of DiskPlugin.
+
+    Attributs:
+            - pack_path (str)
+            - path (str): trash directory
+    """
+
+    NAME = '.vimpck-trash'
+
+    def __init__(self, pack_path):
+        self.pack_path = pack_path
+        self.path = os.path.join(os.path.dirname(os.path.abspath(pack_path)),
+                                 self.NAME)
+
+    def move(self, directory):
+        """Move a directory to the trash, delete it in place if the trash is
+        on another filesystem
+
+        raise:
+            OSError: the directory could not be moved nor deleted
+        """
+
+        import errno
+        import shutil
+        import tempfile
+
+        os.makedirs(self.path, exist_ok=True)
+        name = os.path.basename(directory.rstrip(os.sep))
+        # a unique empty directory that the plugin directory replaces
+        dest = tempfile.mkdtemp(prefix=name + '-', dir=self.path)
+        try:
+            os.rename(directory, dest)
+        except OSError as err:
+            os.rmdir(dest)
+            if err.errno != errno.EXDEV:
+                raise
+            shutil.rmtree(directory)
+
+    def empty(self, jobs=1):
+        """Delete the content of the trash with jobs threads, including what
+        an interrupted vimpck left behind. Errors are ignored.
+        """
+
+        import shutil
+        from concurrent.futures import ThreadPoolExecutor
+
+        try:
+            entries = [entry.path for entry in os.scandir(self.path)]
+        except OSError:
+            return
+        with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+            for entry in entries:
+                executor.submit(shutil.rmtree, entry, True)
+        try:
+            os.rmdir(self.path)
+        except OSError:
+            # not empty, moved to by another vimpck process
+            pass
+
+    def empty_detached(self, jobs=1):
+        """Delete the content of the trash in a detached process that
+        vimpck does not wait for, see empty. What an interrupted deletion
+        leaves behind is deleted by the next one. The trash is emptied in
+        place when the process can not be started.
+        """
+
+        import subprocess
+
+        if not os.path.isdir(self.path):
+            return
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        # the process forks and exits at once, its child is left to the init
+        # process so that there is nothing to wait for
+        code = ("import os, sys\n"
+                "if os.fork():\n"
+                "    os._exit(0)\n"
+                "sys.path.insert(0, sys.argv[1])\n"
+                "from vim_pck.utils import Trash\n"
+                "Trash(sys.argv[2]).empty(int(sys.argv[3]))\n")
+        try:
+            proc = subprocess.run([sys.executable, "-c", code, root, self.pack_path,
+                                   str(jobs)],
+                                  stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                                  stderr=subprocess.DEVNULL, start_new_session=True)
+        except OSError:
+            proc = None
+        if proc is None or proc.returncode != 0:
+            self.empty(jobs)
+
+
+def dir_usage(path, skip=()):
+    """Get the apparent size and the number of files of a directory tree,
+    symbolic links are counted as files and not followed
+
+    Arguments:
+            - skip (tuple(str)): names of the entries of path that are not
+              counted, ex: .git
+
+    return:
+        (size, files) (2-uple): size in bytes
+    """
+
+    size = 0
+    files = 0
+    stack = [(path, skip)]
+    while stack:
+        directory, names = stack.pop()
+        try:
+            it = os.scandir(directory)
+        except OSError:
+            continue
+        with it:
+            for entry in it:
+                if entry.name in names:
+                    continue
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append((entry.path, ()))
+                    else:
+                        size += entry.stat(follow_symlinks=False).st_size
+                        files += 1
+                except OSError:
+                    continue
+    return size, files
+
+
+def object_usage(local_dir):
+    """Get the size of the loose and of the packed objects of a repository
+
+    return:
+        (loose, packed) (2-uple): size in bytes, objects/pack holds the
+        packed objects and their index
+    """
+
+    try:
+        repo_dir = git_dir(local_dir)
+    except (OSError, ValueError):
+        repo_dir = None
+    if repo_dir is None:
+        return 0, 0
+    objects = os.path.join(repo_dir, 'objects')
+    packed = dir_usage(os.path.join(objects, 'pack'))[0]
+    loose = dir_usage(objects, skip=('pack', 'info'))[0]
+    return loose, packed
+
+
+class BundleDir:
+    """Directory of git bundles written by ``vimpck bundle export``
+
+    One bundle is written per remote url, plugin or submodule, named after
+    git.repo_id. The manifest records which bundles are needed to install a
+    plugin.
+
+    Attributs:
+            - path (str): bundle directory
+            - manifest_path (str): path of the json manifest
+            - plugins (dict): key = remote url of the plugin, value = dict
+                              with the hash of HEAD ('head') and the remote
+                              urls of the submodules ('submodules')
+    """
+
+    VERSION = 1
+    MANIFEST = 'manifest.json'
+
+    def __init__(self, path):
+        self.path = os.path.abspath(os.path.expanduser(path))
+        self.manifest_path = os.path.join(self.path, self.MANIFEST)
+        self.plugins = {}
+
+    def load(self):
+        """Read the manifest
+
+        raise:
+            ValueError: the manifest is missing or invalid
+        """
+
+        try:
+            with open(self.manifest_path) as f:
+                data = json.load(f)
+        except (OSError, ValueError) as err:
+            raise ValueError("invalid bundle manifest {}: {}".format(self.manifest_path, err))
+        if not isinstance(data, dict) or data.get('version') != self.VERSION:
+            raise ValueError("unsupported bundle manifest {}".format(self.manifest_path))
+        self.plugins = data['plugins']
+
+    def bundle_path(self, remote_url):
+        """Get the path of the bundle of a remote url"""
+
+        return os.path.join(self.path, repo_id(remote_url) + '.bundle')
+
+    def add(self, remote_url, head, submodules):
+        """Record an exported plugin
+
+        Arguments:
+                - head (str): hash of the exported HEAD
+                - submodules (list(str)): remote urls of the exported
+                  submodules
+        """
+
+        self.plugins[remote_url] = {'head': head, 'submodules': sorted(submodules)}
+
+    def url_map(self, remote_url):
+        """Get the bundles of a plugin and of its submodules
+
+        return:
+            url_map (dict): key = remote url, value = bundle path, None when
+            the plugin has not been exported
+        """
+
+        entry = self.plugins.get(remote_url)
+        if entry is None:
+            return None
+        return {url: self.bundle_path(url)
+                for url in [remote_url] + entry['submodules']}
+
+    def save(self):
+        write_json(self.manifest_path, {'version': self.VERSION,
+                                        'plugins': self.plugins})
+
+
+class LockFile:
+    """Lockfile recording the commit checked out for each plugin
+
+    It is written next to the configuration file, <conf_path>.lock, after
+    each install and upgrade, so that ``vimpck install --locked`` installs
+    the same commits on another host.
+
+    Attributs:
+            - path (str): path of the json lockfile
+            - plugins (dict): key = remote url, value = dict with the hash of
+                              the checked out commit ('commit'), the checked
+                              out branch ('branch', None when HEAD is
+                              detached) and the commit of each submodule
+                              ('submodules', key = path relative to the
+                              plugin)
+    """
+
+    VERSION = 1
+
+    def __init__(self, conf_path):
+        self.path = conf_path + '.lock'
+        self.plugins = {}
+
+    def load(self):
+        """Read the lockfile
+
+        raise:
+            ValueError: the lockfile is missing or invalid
+        """
+
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError) as err:
+            raise ValueError("invalid lockfile {}: {}".format(self.path, err))
+        if not isinstance(data, dict) or data.get('version') != self.VERSION:
+            raise ValueError("unsupported lockfile {}".format(self.path))
+        self.plugins = data['plugins']
+
+    def update(self, remote_url, commit, branch, submodules):
+        """Record the commit checked out for a plugin"""
+
+        self.plugins[remote_url] = {'commit': commit, 'branch': branch,
+                                    'submodules': submodules}
+
+    def prune(self, remote_urls):
+        """Forget the plugins that are not in remote_urls"""
+
+        self.plugins = {k: v for k, v in self.plugins.items() if k in remote_urls}
+
+    def save(self):
+        # meant to be versioned with the configuration file, keep it diffable
+        write_json(self.path, {'version': self.VERSION, 'plugins': self.plugins},
+                   indent=2, sort_keys=True)
+
+
+class StateIndex:
+    """On-disk index of the plugins installed in a pack path
+
+    The index is stored in the cache directory and is considered valid as long
+    as the modification time of the pack path and of the package and type
+    directories below it did not change, i.e. no plugin has been added or
+    removed behind vimpck's back.
+
+    Attributs:
+            - pack_path (str): package directory
+            - index_path (str): path of the json index file
+            - plugins (dict): key = <package_name>/{start|opt}/<plugin_name>
+                              value = dict with the remote url ('url'), the
+                              hash of HEAD ('head', None when unknown), the
+                              time of the last install or update ('updated')
+                              and the number of commits of HEAD ('depth',
+                              only once counted by vimpck stats)
+            - dirs (dict): key = directory relative to the pack path,
+                           value = modification time in ns
+    """
+
+    VERSION = 1
+
+    def __init__(self, pack_path):
+        self.pack_path = os.path.abspath(pack_path)
+        self.index_path = os.path.join(cache_dir(), 'state',
+                                       self.pack_path.strip(os.sep).replace(os.sep, '%') + '.json')
+        self.plugins = {}
+        self.dirs = {}
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.index_path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if data.get('version') == self.VERSION and data.get('pack_path') == self.pack_path:
+            self.plugins = data['plugins']
+            self.dirs = data['dirs']
+
+    def _stat_dirs(self):
+        """Get the modification time of the pack path and of the package and
+        type directories
+        """
+
+        dirs = {}
+        for rel_dir, level in self._list_dirs(''):
+            dirs[rel_dir] = os.stat(os.path.join(self.pack_path, rel_dir)).st_mtime_ns
+        return dirs
+
+    def _list_dirs(self, rel_dir, level=0):
+        yield rel_dir, level
+        if level == 2:
+            return
+        with os.scandir(os.path.join(self.pack_path, rel_dir)) as it:
+            for entry in it:
+                if entry.is_dir():
+                    yield from self._list_dirs(os.path.join(rel_dir, entry.name),
+                                               level + 1)
+
+    def is_valid(self):
+        """Check that no directory changed since the index was saved"""
+
+        if not self.dirs:
+            return False
+        for rel_dir, mtime in self.dirs.items():
+            try:
+                if os.stat(os.path.join(self.pack_path, rel_dir)).st_mtime_ns != mtime:
+                    return False
+            except OSError:
+                return False
+        return True
+
+    def rebuild(self, all_plug):
+        """Replace the content of the index by the plugins found on disk, keep
+        the known hash and update time of unchanged plugins
+
+        Arguments:
+                - all_plug (dict): key = <package_name>/{start|opt}/<plugin_name>
+                                   value = remote_url
+        """
+
+        plugins = {}
+        for rel_path, remote_url in all_plug.items():
+            entry = self.plugins.get(rel_path)
+            if entry is None or entry['url'] != remote_url:
+                entry = {'url': remote_url, 'head': None, 'updated': None}
+            plugins[rel_path] = entry
+        self.plugins = plugins
+
+    def update(self, rel_path, remote_url, head=None):
+        """Record a newly installed or updated plugin, the update time is kept
+        when the hash of HEAD did not change
+        """
+
+        entry = self.plugins.get(rel_path)
+        if entry is None or entry['url'] != remote_url or head is None or entry['head'] != head:
+            entry = {'url': remote_url, 'head': head, 'updated': time.time()}
+        self.plugins[rel_path] = entry
+
+    def depth(self, rel_path, head):
+        """Get the cached number of commits of the history of a plugin, None
+        when HEAD moved since it was counted
+        """
+
+        entry = self.plugins.get(rel_path)
+        if entry is None or head is None or entry['head'] != head:
+            return None
+        return entry.get('depth')
+
+    def set_depth(self, rel_path, head, depth):
+        """Cache the number of commits of the history of a plugin at HEAD"""
+
+        entry = self.plugins.get(rel_path)
+        if entry is not None and head is not None:
+            entry['head'] = head
+            entry['depth'] = depth
+
+    def remove(self, rel_path):
+        """Forget a removed plugin"""
+
+        self.plugins.pop(rel_path, None)
+
+    def save(self):
+        """Write the index on disk. Failing to do so is not an error, the
+        index is then rebuilt by the next command.
+        """
+
+        try:
+            self.dirs = self._stat_dirs()
+            write_json(self.index_path, {'version': self.VERSION,
+                                         'pack_path': self.pack_path,
+                                         'dirs': self.dirs,
+                                         'plugins': self.plugins})
+        except OSError:
+            pass
+
 
 class DiskPlugin:
     """This class allow to access the plugins locally installed on the pack
@@ -85,69 +711,84 @@ class DiskPlugin:
             - all_plug (dict): key = <package_name>/{start|opt}/<plugin_name>
                                value = remote_url, ex: https://path/to/repo
             - pack_path (str): package directory
+            - index (StateIndex instance): persistent index of the plugins,
+              the pack path is only scanned when it is outdated or when
+              rescan is True
     """
 
-    def __init__(self, pack_path):
+    def __init__(self, pack_path, rescan=False):
         self.all_plug = {}
         self.pack_path = pack_path
         self.git_config = [GetRemote("")]  # object container
         # Local path is not currently known so initilized at en empty string
-        self._list_remote_url(self._list_plug_dir())
+        self.index = StateIndex(pack_path)
+        if rescan or not self.index.is_valid():
+            self._list_remote_url(self._list_plug_dir())
+            self.index.rebuild(self.all_plug)
+            self.index.save()
+        else:
+            self.all_plug = {k: v['url'] for k, v in self.index.plugins.items()}
 
     @staticmethod
-    def _walklevel(some_dir, level):
-        """
-        Get a list of directories at a specified level from <some_dir>
-        http://stackoverflow.com/questions/229186/os-walk-without-digging-into-directories-below
-        """
-        some_dir = some_dir.rstrip(os.path.sep)
-        assert os.path.isdir(some_dir)
-        num_sep = some_dir.count(os.path.sep)
-        for root, dirs, files in os.walk(some_dir):
-            yield root, dirs, files
-            num_sep_this = root.count(os.path.sep)
-            if num_sep + level <= num_sep_this:
-                del dirs[:]
-
-    def _list_plug_dir(self, level=3):
-        """Get the list of installed plugins with there respective remote url
-        # http://stackoverflow.com/questions/3167154/how-to-split-a-dos-path-into-its-components-in-python
+    def _subdirs(directory):
+        """Get the entries of a directory that are directories, symbolic
+        links to directories included
         """
 
-        dir_list = {}  # temp dictionary key: directory, value: depth
-
-        # Get a complete list of directory 3 level down pack path
-        for dirpath, dirnames, filenames in self._walklevel(self.pack_path,
-                                                            level):
-            dir_list[dirpath] = 0
+        try:
+            with os.scandir(directory) as it:
+                return [entry for entry in it if entry.is_dir()]
+        except OSError:
+            return []
 
-        # compute depth of each path
-        for elem in dir_list.keys():
-            elem_norm = os.path.normpath(elem)
-            dir_list[elem] = len(elem_norm.split(os.sep))
+    def _list_plug_dir(self):
+        """Get the list of installed plugins, the directories
+        <package>/{start|opt}/<plugin> of the pack path that contain a .git
+        or the sidecar file of a snapshot
 
-        # keep only deepest paths
-        max_depth = max(dir_list.values())
-        dir_list = {k: v for k, v in dir_list.items() if v == max_depth}
+        Only the pack path, the package and the type directories are listed,
+        a plugin directory is only checked for these entries.
+        """
 
-        return dir_list.keys()
+        plug_dirs = []
+        for package in self._subdirs(self.pack_path):
+            for plug_type in const.PLUG_TYPES:
+                type_dir = os.path.join(package.path, plug_type)
+                for plugin in self._subdirs(type_dir):
+                    if (os.path.lexists(os.path.join(plugin.path, '.git'))
+                            or os.path.isfile(os.path.join(plugin.path, const.SNAPSHOT_FILE))):
+                        plug_dirs.append(plugin.path)
+        return plug_dirs
 
     def _list_remote_url(self, dir_list):
         """Get remote url of locally cloned repository
 
+        The git config file is read in-process, ``git config`` is only
+        spawned when it can not be parsed. The remote url of a snapshot is
+        read from its sidecar file.
+
         Arguments:
                 - dir_list (list(str)): list of directory
         """
         self.all_plug = {}
 
         for elem in dir_list:
-            out = 1
-            self.git_config[0].local_dir = elem
-            out = self.git_config[0].git_cmd()
-            if out == 0:
+            if not os.path.lexists(os.path.join(elem, '.git')):
+                # a snapshot, git would read the repository above it
+                snapshot = read_snapshot(elem)
+                remote_url = snapshot['url'] if snapshot is not None else None
+            else:
+                try:
+                    remote_url = get_config(elem, "remote.origin.url")
+                except (OSError, ValueError):
+                    remote_url = None
+                    self.git_config[0].local_dir = elem
+                    if self.git_config[0].git_cmd() == 0:
+                        remote_url = self.git_config[0].retrieve_stdout()
+            if remote_url is not None:
                 # keep only : <package>/{<start>|<opt>}/<plugin>
                 rel_plug_path = os.path.relpath(elem, self.pack_path)
-                self.all_plug[rel_plug_path] = self.git_config[0].retrieve_stdout()
+                self.all_plug[rel_plug_path] = remote_url
             else:
                 # TODO: in case something went wrong, write it down to a log
                 pass